@@ -0,0 +1,258 @@
+"""Microphone capture, voice activity detection and level metering."""
+
+import asyncio
+import fractions
+import os
+import sys
+import threading
+import av
+import numpy as np
+from aiortc import MediaStreamTrack
+from typing import Optional, Callable, Tuple
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # 20 ms, one Opus frame
+TIME_BASE = fractions.Fraction(1, SAMPLE_RATE)
+
+# Voice activity detection
+VAD_RMS_THRESHOLD = 0.01  # Minimum frame RMS (full scale = 1.0) to count as speech
+VAD_ENERGY_RATIO = 4.0  # Frame energy must exceed the noise floor by this factor
+VAD_HANGOVER_FRAMES = 15  # Keep sending 300 ms after speech to avoid clipping word ends
+NOISE_FLOOR_ADAPT = 0.05  # How fast the noise floor follows silent frames
+
+LEVEL_RING_SIZE = 64  # Level history kept for the meter (frames)
+CAPTURE_QUEUE_SIZE = 25  # Voiced frames waiting for the encoder before dropping (500 ms)
+
+# Default capture device per platform: (ffmpeg input, format)
+DEFAULT_DEVICES = {
+    "linux": ("default", "pulse"),
+    "darwin": (":0", "avfoundation"),
+    "win32": ("audio=default", "dshow"),
+}
+
+
+def frame_levels(samples: np.ndarray) -> np.ndarray:
+    """
+    RMS level of every 20 ms frame in a block of int16 samples.
+
+    Computed for the whole block at once; a trailing partial frame is ignored.
+    """
+    count = len(samples) // FRAME_SAMPLES
+    frames = samples[:count * FRAME_SAMPLES].reshape(count, FRAME_SAMPLES)
+    scaled = frames.astype(np.float32) / 32768.0
+    return np.sqrt(np.mean(scaled * scaled, axis=1))
+
+
+class LevelRing:
+    """
+    Recent input levels, written by the capture thread and read by the GUI.
+
+    Lock-free for one writer and one reader: the writer stores the value
+    before publishing the new count, and a reader only looks at slots
+    below the count it read.
+    """
+
+    def __init__(self, size: int = LEVEL_RING_SIZE):
+        self._levels = np.zeros(size, dtype=np.float32)
+        self._count = 0
+
+    def push(self, level: float):
+        """Append a level (capture thread only)."""
+        self._levels[self._count % len(self._levels)] = level
+        self._count += 1
+
+    def latest(self, n: int = 1) -> np.ndarray:
+        """Get up to ``n`` most recent levels, oldest first."""
+        count = self._count
+        n = min(n, count, len(self._levels))
+        indices = np.arange(count - n, count) % len(self._levels)
+        return self._levels[indices]
+
+    def peak(self, n: int = 5) -> float:
+        """Highest of the ``n`` most recent levels (0.0 if none)."""
+        recent = self.latest(n)
+        return float(recent.max()) if len(recent) else 0.0
+
+
+class VoiceActivityDetector:
+    """
+    Energy-based voice activity detector with hangover.
+
+    A frame is speech when its RMS is above an absolute threshold and its
+    energy is well above the adaptive noise floor. After speech, frames
+    keep counting as voiced for a short hangover.
+    """
+
+    def __init__(self, threshold: float = VAD_RMS_THRESHOLD,
+                 ratio: float = VAD_ENERGY_RATIO,
+                 hangover: int = VAD_HANGOVER_FRAMES):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.hangover = hangover
+        self.noise_floor = threshold / 2
+        self._hang = 0
+
+    def process(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify each 20 ms frame of a block.
+
+        Args:
+            samples: Mono int16 samples (a multiple of FRAME_SAMPLES)
+
+        Returns:
+            (levels, voiced) arrays with one entry per frame
+        """
+        levels = frame_levels(samples)
+        # Energy test against the floor as it was before this block
+        speech = (levels > self.threshold) & (levels * levels > self.ratio * self.noise_floor ** 2)
+
+        voiced = np.empty(len(levels), dtype=bool)
+        for i, is_speech in enumerate(speech):
+            if is_speech:
+                self._hang = self.hangover
+                voiced[i] = True
+            else:
+                voiced[i] = self._hang > 0
+                self._hang = max(0, self._hang - 1)
+
+        silent = levels[~speech]
+        if len(silent):
+            self.noise_floor += NOISE_FLOOR_ADAPT * (float(silent.mean()) - self.noise_floor)
+        return levels, voiced
+
+
+class MicrophoneCapture:
+    """
+    Pulls audio from the microphone on a dedicated thread.
+
+    Frames are resampled to 48 kHz mono int16 and handed to ``on_samples``
+    in 20 ms multiples, on the capture thread.
+    """
+
+    def __init__(self, on_samples: Callable[[np.ndarray], None],
+                 device: Optional[str] = None, input_format: Optional[str] = None):
+        default_device, default_format = DEFAULT_DEVICES.get(sys.platform, ("default", None))
+        self.device = device or os.getenv("BARA_MIC_DEVICE", default_device)
+        self.input_format = input_format or os.getenv("BARA_MIC_FORMAT", default_format)
+        self.on_samples = on_samples
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Open the device and start capturing."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="mic-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop capturing (the device is closed by the capture thread)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        """Capture loop."""
+        try:
+            container = av.open(self.device, format=self.input_format)
+        except Exception as e:
+            logger.error(f"Could not open microphone {self.device!r} ({self.input_format}): {e}")
+            return
+
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE,
+                                      frame_size=FRAME_SAMPLES)
+        logger.info(f"Capturing from {self.device!r} ({self.input_format})")
+        try:
+            for frame in container.decode(audio=0):
+                if self._stop.is_set():
+                    break
+                for resampled in resampler.resample(frame):
+                    self.on_samples(resampled.to_ndarray().reshape(-1))
+        except Exception as e:
+            logger.error(f"Microphone capture stopped: {e}")
+        finally:
+            container.close()
+
+
+class MicrophoneTrack(MediaStreamTrack):
+    """
+    Audio track publishing voiced microphone frames.
+
+    Silent and muted frames are dropped on the capture thread, before they
+    reach the Opus encoder, so they cost neither CPU nor bandwidth. Frame
+    timestamps follow capture time, so receivers see the gap as a pause.
+
+    The frame before each speech onset is sent as well: it carries the
+    start of the attack, and the encoder (which stamps each packet from
+    the previous input frame) then times the first speech packet right.
+    """
+
+    kind = "audio"
+
+    def __init__(self, capture: Optional[MicrophoneCapture] = None,
+                 vad: Optional[VoiceActivityDetector] = None):
+        super().__init__()
+        self.vad = vad or VoiceActivityDetector()
+        self.levels = LevelRing()
+        self.muted = False
+        self.is_speaking = False
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self._pts = 0
+        self._previous: Optional[np.ndarray] = None  # Last frame of the previous block
+        self._was_voiced = False
+        self.capture = capture or MicrophoneCapture(self.feed)
+
+    def start(self):
+        """Start the capture thread."""
+        self.capture.start()
+
+    def stop(self):
+        """Stop capturing and end the track."""
+        self.capture.stop()
+        super().stop()
+
+    def feed(self, samples: np.ndarray):
+        """Run VAD on captured samples and queue the voiced frames (capture thread)."""
+        levels, voiced = self.vad.process(samples)
+        for level in levels:
+            self.levels.push(level)
+        self.is_speaking = bool(voiced[-1]) if len(voiced) else False
+
+        previous, was_voiced = self._previous, self._was_voiced
+        for i in np.flatnonzero(voiced):
+            if self.muted:
+                break
+            pts = self._pts + i * FRAME_SAMPLES
+            onset = not voiced[i - 1] if i > 0 else not was_voiced
+            if onset:
+                lead = samples[(i - 1) * FRAME_SAMPLES:i * FRAME_SAMPLES] if i > 0 else previous
+                if lead is not None:
+                    self._loop.call_soon_threadsafe(self._enqueue, lead, pts - FRAME_SAMPLES)
+            frame = samples[i * FRAME_SAMPLES:(i + 1) * FRAME_SAMPLES]
+            self._loop.call_soon_threadsafe(self._enqueue, frame, pts)
+
+        if len(levels):
+            self._previous = samples[(len(levels) - 1) * FRAME_SAMPLES:len(levels) * FRAME_SAMPLES]
+            self._was_voiced = bool(voiced[-1]) and not self.muted
+        self._pts += len(levels) * FRAME_SAMPLES
+
+    def _enqueue(self, samples: np.ndarray, pts: int):
+        """Queue a voiced frame, dropping the oldest if the encoder falls behind."""
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait((samples, pts))
+
+    async def recv(self) -> av.AudioFrame:
+        """Wait for the next voiced frame."""
+        samples, pts = await self._queue.get()
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = pts
+        frame.time_base = TIME_BASE
+        return frame
@@ -0,0 +1,289 @@
+"""Local SQLite cache of chat history, one database per server and user."""
+
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlsplit
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+CACHE_LOAD_LIMIT = 2000  # Newest messages per room rendered at startup
+WRITE_BATCH_SIZE = 500  # Messages written per transaction at most
+SEARCH_LIMIT = 50  # Search results returned at most
+SNIPPET_TOKENS = 12  # Words of context around a search match
+MIN_PREFIX_LENGTH = 2  # Shorter last words match whole words only (a one-letter prefix matches most of the index)
+
+# Wire fields stored in their own columns; anything else goes to "extra"
+_COLUMNS = ('room', 'seq', 'type', 'user', 'text', 'timestamp')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    room TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    user TEXT NOT NULL,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (room, seq)
+) WITHOUT ROWID;
+
+-- High-water marks: every message up to last_seq was received, so startup
+-- fetches only newer ones (set by the network client after complete syncs)
+CREATE TABLE IF NOT EXISTS rooms (
+    room TEXT PRIMARY KEY,
+    last_seq INTEGER NOT NULL
+);
+
+-- Messages sent but not acknowledged by the server yet, in sending order
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    frame TEXT NOT NULL
+);
+
+-- Full-text index of the messages; rowids grow as messages are cached
+CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+    text, room UNINDEXED, seq UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+def default_cache_dir() -> Path:
+    """Directory holding the cache databases (BARA_CACHE_DIR overrides it)."""
+    return Path(os.getenv("BARA_CACHE_DIR", Path.home() / ".barachat" / "cache"))
+
+
+class MessageCache:
+    """
+    Server-sequenced chat messages of every room, kept between launches.
+
+    The database is in WAL mode so the GUI can read while messages are
+    written. Writes are queued and committed in batches by a background
+    thread, so receiving never waits on the disk. Each room has a
+    high-water mark, the sequence number up to which its history is
+    complete: on reconnect only newer messages need to be fetched. It is
+    set with ``set_high_water`` rather than by cached messages, since a
+    message received live can be newer than a gap not yet fetched.
+
+    The same thread keeps an FTS5 index of the message texts up to date,
+    so ``search`` answers from the index instead of scanning history,
+    and persists the outbox of messages the server has not acknowledged.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Open (or create) a cache database.
+
+        Args:
+            path: Database file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._reader = self._connect()
+        indexed = self._reader.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'message_search'"
+        ).fetchone()
+        self._reader.executescript(_SCHEMA)
+        self._queue: queue.Queue = queue.Queue()
+        if not indexed:
+            self._queue.put(('reindex', None))  # Cache written before search existed
+        self._writer = threading.Thread(target=self._run_writer, name="message-cache", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def for_account(cls, server_url: str, username: str,
+                    cache_dir: Optional[Path] = None) -> "MessageCache":
+        """Open the cache of a user on a server."""
+        server = urlsplit(server_url).netloc or server_url
+        name = re.sub(r'[^A-Za-z0-9._-]', '_', f"{server}-{username}")
+        return cls(Path(cache_dir or default_cache_dir()) / f"{name}.db")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection in WAL mode."""
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")  # Durable enough for a cache
+        return connection
+
+    def add(self, message: Dict[str, Any]):
+        """Queue a message for writing (any thread); messages without a seq are ignored."""
+        if message.get('seq') is not None and message.get('room'):
+            self._queue.put(('add', message))
+
+    def set_high_water(self, room: str, seq: int):
+        """Queue the move of a room's high-water mark (every message up to ``seq`` was received)."""
+        self._queue.put(('high_water', (room, seq)))
+
+    def clear_room(self, room: str):
+        """Queue the removal of a room's messages (its history restarted on the server)."""
+        self._queue.put(('clear', room))
+
+    def queue_outgoing(self, frame: Dict[str, Any]):
+        """Queue the saving of a message waiting to be sent (keyed by its client ID)."""
+        self._queue.put(('outbox_add', frame))
+
+    def remove_outgoing(self, message_id: str):
+        """Queue the removal of a message the server acknowledged."""
+        self._queue.put(('outbox_remove', message_id))
+
+    def load_outbox(self) -> List[Dict[str, Any]]:
+        """Get the messages left unsent, in sending order."""
+        rows = self._reader.execute("SELECT frame FROM outbox ORDER BY rowid").fetchall()
+        return [json.loads(frame) for frame, in rows]
+
+    def flush(self):
+        """Wait until every queued write is committed."""
+        self._queue.join()
+
+    def close(self):
+        """Commit queued writes and close the database."""
+        self._queue.put(None)
+        self._writer.join()
+        self._reader.close()
+
+    def high_water_marks(self) -> Dict[str, int]:
+        """Sequence number up to which history is cached, by room."""
+        return dict(self._reader.execute("SELECT room, last_seq FROM rooms").fetchall())
+
+    def load_room(self, room: str, limit: int = CACHE_LOAD_LIMIT,
+                  until_seq: Optional[int] = None, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """
+        Get a room's newest cached messages.
+
+        Args:
+            room: Room name
+            limit: Maximum number of messages
+            until_seq: Ignore messages after this sequence number
+            after_seq: Ignore messages up to this sequence number
+
+        Returns:
+            Messages as received from the server, oldest first
+        """
+        rows = self._reader.execute(
+            "SELECT room, seq, type, user, text, timestamp, extra FROM messages "
+            "WHERE room = ? AND seq > ? AND seq <= ? ORDER BY seq DESC LIMIT ?",
+            (room, after_seq, until_seq if until_seq is not None else 2 ** 63 - 1, limit)
+        ).fetchall()
+        messages = []
+        for row in reversed(rows):
+            message = dict(zip(_COLUMNS, row))
+            if row[-1]:
+                message.update(json.loads(row[-1]))
+            messages.append(message)
+        return messages
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Find cached messages containing every word of a query, in any room.
+
+        The last word also matches as a prefix (from MIN_PREFIX_LENGTH
+        characters), so results can follow typing. Messages still queued for writing are not found yet.
+
+        Args:
+            query: Words to look for (not FTS5 syntax)
+            limit: Maximum number of results
+
+        Returns:
+            Messages as received from the server, newest first, each with
+            a ``snippet`` of its text around the match
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return []
+        match = " ".join(f'"{word}"' for word in words)
+        if len(words[-1]) >= MIN_PREFIX_LENGTH:
+            match += "*"
+        rows = self._reader.execute(
+            "WITH hits AS ("
+            "  SELECT room, seq, snippet(message_search, 0, '', '', '…', ?) AS snippet"
+            "  FROM message_search WHERE message_search MATCH ? ORDER BY rowid DESC LIMIT ?"
+            ") SELECT m.room, m.seq, m.type, m.user, m.text, m.timestamp, m.extra, hits.snippet "
+            "FROM hits JOIN messages AS m ON m.room = hits.room AND m.seq = hits.seq",
+            (SNIPPET_TOKENS, match, limit)
+        ).fetchall()
+        results = []
+        for row in rows:
+            message = dict(zip(_COLUMNS, row))
+            if row[6]:
+                message.update(json.loads(row[6]))
+            message['snippet'] = row[7]
+            results.append(message)
+        results.sort(key=lambda message: message['timestamp'], reverse=True)
+        return results
+
+    def _run_writer(self):
+        """Commit queued writes in batches (writer thread)."""
+        connection = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while item is not None and len(batch) < WRITE_BATCH_SIZE:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                try:
+                    self._write(connection, [entry for entry in batch if entry is not None])
+                except sqlite3.Error as e:
+                    logger.error(f"Could not write message cache: {e}")
+                for _ in batch:
+                    self._queue.task_done()
+                if batch[-1] is None:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, batch: list):
+        """Apply a batch of writes in one transaction."""
+        with connection:
+            for action, value in batch:
+                if action == 'clear':
+                    connection.execute("DELETE FROM messages WHERE room = ?", (value,))
+                    connection.execute("DELETE FROM rooms WHERE room = ?", (value,))
+                    connection.execute("DELETE FROM message_search WHERE room = ?", (value,))
+                    continue
+                if action == 'outbox_add':
+                    connection.execute("INSERT OR IGNORE INTO outbox VALUES (?, ?)",
+                                       (value['id'], json.dumps(value)))
+                    continue
+                if action == 'outbox_remove':
+                    connection.execute("DELETE FROM outbox WHERE id = ?", (value,))
+                    continue
+                if action == 'high_water':
+                    connection.execute(
+                        "INSERT INTO rooms VALUES (?, ?) ON CONFLICT (room) "
+                        "DO UPDATE SET last_seq = excluded.last_seq",
+                        value
+                    )
+                    continue
+                if action == 'reindex':
+                    connection.execute("DELETE FROM message_search")
+                    connection.execute(
+                        "INSERT INTO message_search (text, room, seq) "
+                        "SELECT text, room, seq FROM messages ORDER BY timestamp"
+                    )
+                    continue
+                extra = {k: v for k, v in value.items() if k not in _COLUMNS}
+                # A sequence number always stands for the same message
+                inserted = connection.execute(
+                    "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (value['room'], value['seq'], value.get('type', 'text'), value.get('user', ''),
+                     value.get('text', ''), value.get('timestamp', 0),
+                     json.dumps(extra) if extra else None)
+                ).rowcount
+                if inserted:
+                    connection.execute(
+                        "INSERT INTO message_search (text, room, seq) VALUES (?, ?, ?)",
+                        (value.get('text', ''), value['room'], value['seq'])
+                    )
@@ -2,11 +2,12 @@
 
 import os
 from pathlib import Path
-from typing import Optional, Tuple
-from nacl.public import PrivateKey, PublicKey, Box
-from nacl.utils import random
+from typing import Optional, Tuple, TYPE_CHECKING
 from client.utils.logger import get_logger
 
+if TYPE_CHECKING:
+    from nacl.public import PrivateKey, PublicKey  # Loaded on first use (not at startup)
+
 
 logger = get_logger(__name__)
 
@@ -24,8 +25,8 @@ class CryptoManager:
         self.key_dir = Path(key_dir)
         self.key_dir.mkdir(exist_ok=True)
         
-        self.private_key: Optional[PrivateKey] = None
-        self.public_key: Optional[PublicKey] = None
+        self.private_key: Optional["PrivateKey"] = None
+        self.public_key: Optional["PublicKey"] = None
         self.keypair_loaded = False
     
     def load_or_generate_keypair(self, username: str):
@@ -35,6 +36,8 @@ class CryptoManager:
         Args:
             username: Username for key file naming
         """
+        from nacl.public import PrivateKey
+        
         private_key_file = self.key_dir / f"{username}_private.key"
         public_key_file = self.key_dir / f"{username}_public.key"
         
@@ -82,6 +85,8 @@ class CryptoManager:
         if not self.private_key:
             raise ValueError("No keypair loaded")
         
+        from nacl.public import PublicKey, Box
+        
         try:
             recipient_pub = PublicKey(recipient_public_key)
             box = Box(self.private_key, recipient_pub)
@@ -1,74 +1,552 @@
 """Media handling for voice chat using aiortc."""
 
-from typing import Optional, Callable
+import math
+import queue
+import threading
+import time
+import av
+import numpy as np
+from aiortc import RTCConfiguration, RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from aiortc.jitterbuffer import JitterFrame
+from typing import Optional, Callable, Awaitable, Dict, List
+from common.aiortc_internals import check_receiver_internals
+from client.core.audio import FRAME_SAMPLES, SAMPLE_RATE, LevelRing, MicrophoneTrack
 from client.utils.logger import get_logger
 
 
 logger = get_logger(__name__)
 
 
+FRAME_DURATION = FRAME_SAMPLES / SAMPLE_RATE
+
+# Jitter buffer
+JITTER_SLOTS = 64  # Encoded frames held per stream (1.28 s); a power of two
+MIN_DELAY_FRAMES = 1
+MAX_DELAY_FRAMES = 10  # 200 ms
+JITTER_MULTIPLIER = 3.0  # Playout delay in units of the RFC 3550 jitter estimate
+ACCELERATE_MARGIN = 2  # Frames above the target drained at once (bursts)
+DRAIN_WINDOW_FRAMES = 25  # Standing latency is measured as the lowest buffer level over 500 ms
+ACCELERATE_SILENCE_RMS = 0.005  # Frames this quiet are dropped whole when draining
+IDLE_LATE_TOLERANCE = 1  # Frames a talkspurt may start behind the idle playout clock
+
+# Packet loss concealment
+PLC_MAX_FRAMES = 5  # Conceal up to 100 ms, then play silence
+PLC_DECAY = 0.6  # Gain applied per concealed frame
+PITCH_MIN = 120  # 400 Hz
+PITCH_MAX = 480  # 100 Hz
+PITCH_WINDOW = 240  # Samples compared when searching the pitch period
+CROSSFADE_SAMPLES = 120  # 2.5 ms
+
+PCM_RING_SAMPLES = 4 * FRAME_SAMPLES  # Decoded audio waiting for the output
+
+_FRAME_INDEX = np.arange(FRAME_SAMPLES)
+_FADE_IN = np.linspace(0.0, 1.0, CROSSFADE_SAMPLES, dtype=np.float32)
+
+
+def pitch_period(samples: np.ndarray) -> int:
+    """
+    Estimate the pitch period at the end of a block of samples.
+
+    Every candidate lag is scored at once by normalized cross-correlation
+    of the last ``PITCH_WINDOW`` samples with the window one lag earlier.
+    """
+    x = samples[-(PITCH_WINDOW + PITCH_MAX):].astype(np.float32)
+    ref = x[-PITCH_WINDOW:]
+    windows = np.lib.stride_tricks.sliding_window_view(x[:-PITCH_MIN], PITCH_WINDOW)[::-1]
+    # Row i starts i samples before the latest candidate, so lag = PITCH_MIN + i
+    corr = windows @ ref
+    energy = np.einsum('ij,ij->i', windows, windows)
+    score = corr / np.sqrt(energy * float(ref @ ref) + 1e-9)
+    return PITCH_MIN + int(np.argmax(score))
+
+
+class PlayoutStream:
+    """
+    Adaptive jitter buffer, decoder and concealment for one remote stream.
+
+    Encoded frames are pushed as they arrive and placed by timestamp in a
+    preallocated slot ring; ``read`` pulls 20 ms of audio at the output's
+    pace. The playout delay follows the measured jitter: a clean network
+    plays with one frame of buffering, a jittery one with up to
+    ``MAX_DELAY_FRAMES``. Missing frames are concealed by repeating the
+    last pitch period with decaying gain, and latency that builds up
+    after a burst is drained by dropping quiet frames or removing one
+    pitch period from voiced ones. The play position keeps advancing
+    through underruns and pauses, so frames arriving after their slot
+    was played count as late.
+
+    ``push`` (event loop) and ``read`` (audio output) may run on
+    different threads.
+    """
+
+    def __init__(self):
+        self._slots: list = [None] * JITTER_SLOTS
+        self._next: Optional[int] = None  # Frame number to play next
+        self._newest = -1  # Highest frame number received
+        self._playing = False
+        self._lock = threading.Lock()
+
+        self._decoder = av.CodecContext.create("libopus", "r")
+        self._decoder.format = "s16"
+        self._decoder.layout = "mono"
+        self._decoder.sample_rate = SAMPLE_RATE
+
+        # Decoded audio, also the history concealment repeats from
+        self._pcm = np.zeros(PCM_RING_SAMPLES, dtype=np.int16)
+        self._pcm_read = 0
+        self._pcm_write = 0
+
+        # Jitter estimate (seconds), RFC 3550
+        self.jitter = 0.0
+        self._last_transit: Optional[float] = None
+
+        self._concealed = 0
+        self._plc_template = np.zeros(PITCH_MIN, dtype=np.float32)
+        self._plc_phase = 0
+
+        self.packets_received = 0
+        self.packets_late = 0
+        self.frames_concealed = 0
+        self.frames_accelerated = 0
+
+        # Standing latency: lowest buffer level seen in the current window
+        self._window_min: Optional[int] = None
+        self._window_frames = 0
+        self._drain_samples = 0
+        self.underruns = 0
+
+    @property
+    def target_frames(self) -> int:
+        """Frames buffered before playout starts."""
+        frames = math.ceil(JITTER_MULTIPLIER * self.jitter / FRAME_DURATION)
+        return max(MIN_DELAY_FRAMES, min(MAX_DELAY_FRAMES, frames))
+
+    @property
+    def delay_ms(self) -> float:
+        """Audio currently buffered ahead of the output."""
+        frames = max(0, self._newest - self._next + 1) if self._next is not None else 0
+        samples = frames * FRAME_SAMPLES + self._pcm_write - self._pcm_read
+        return samples * 1000 / SAMPLE_RATE
+
+    def push(self, data: bytes, timestamp: int, arrival: Optional[float] = None):
+        """
+        Add one encoded frame.
+
+        Args:
+            data: Opus payload
+            timestamp: RTP timestamp (48 kHz, unwrapped)
+            arrival: Arrival time in seconds (now if not given)
+        """
+        frame_no = timestamp // FRAME_SAMPLES
+        arrival = time.monotonic() if arrival is None else arrival
+
+        with self._lock:
+            self.packets_received += 1
+            if self._next is None or frame_no - self._next >= JITTER_SLOTS:
+                restart = True
+            else:
+                # Start of a talkspurt, unless it is older than the playout clock
+                idle = not self._playing and self._newest < self._next
+                restart = idle and frame_no >= self._next - IDLE_LATE_TOLERANCE
+                if not restart and frame_no < self._next:
+                    self.packets_late += 1
+                    return
+
+            # Late frames stay out of the estimate: the first packet after a
+            # pause can carry the previous talkspurt's timestamp
+            transit = arrival - frame_no * FRAME_DURATION
+            if self._last_transit is not None:
+                self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+            self._last_transit = transit
+
+            if restart:
+                self._slots = [None] * JITTER_SLOTS
+                self._next = frame_no
+                self._newest = frame_no - 1
+                self._playing = False
+
+            self._slots[frame_no % JITTER_SLOTS] = (frame_no, data)
+            self._newest = max(self._newest, frame_no)
+
+    def read(self) -> np.ndarray:
+        """Get the next 20 ms of mono int16 audio."""
+        with self._lock:
+            while self._pcm_write - self._pcm_read < FRAME_SAMPLES:
+                self._produce()
+            indices = (self._pcm_read + _FRAME_INDEX) % PCM_RING_SAMPLES
+            self._pcm_read += FRAME_SAMPLES
+            return self._pcm[indices]
+
+    def _produce(self):
+        """Decode, conceal or wait for one frame into the PCM ring."""
+        if not self._playing:
+            if self._next is not None and self._newest - self._next + 1 >= self.target_frames:
+                self._playing = True
+            else:
+                if self._next is not None and self._newest < self._next:
+                    self._next += 1  # Idle: the clock runs on
+                self._write(self._conceal())
+                return
+
+        slot = self._slots[self._next % JITTER_SLOTS]
+        if slot is not None and slot[0] == self._next:
+            self._slots[self._next % JITTER_SLOTS] = None
+            self._next += 1
+            pcm = self._decode(slot[1])
+            if pcm is None:
+                self.frames_concealed += 1
+                self._write(self._conceal())
+                return
+            if self._should_drain():
+                pcm = self._accelerate(pcm)
+            if self._concealed:
+                self._end_concealment(pcm)
+            self._write(pcm)
+        elif self._newest >= self._next:
+            # Lost: later frames are already here
+            self._next += 1
+            self.frames_concealed += 1
+            self._write(self._conceal())
+        else:
+            # Nothing to play: conceal while rebuffering
+            self._next += 1
+            self._playing = False
+            self.underruns += 1
+            self._write(self._conceal())
+
+    def _decode(self, data: bytes) -> Optional[np.ndarray]:
+        """Decode one Opus frame to float samples."""
+        try:
+            frames = self._decoder.decode(av.Packet(data))
+        except av.FFmpegError as e:
+            logger.debug(f"Opus decode failed: {e}")
+            return None
+        if not frames:
+            return None
+        return np.concatenate([f.to_ndarray().reshape(-1) for f in frames]).astype(np.float32)
+
+    def _should_drain(self) -> bool:
+        """
+        Decide whether the frame being played should be shortened.
+
+        A burst far above the target is drained at once. Otherwise, if the
+        buffer never fell to the target during a window, the lowest level
+        above it is standing latency and is drained over the next window.
+        """
+        buffered = self._newest - self._next + 1  # Behind the frame being played
+        self._window_min = buffered if self._window_min is None else min(self._window_min, buffered)
+        self._window_frames += 1
+        if self._window_frames >= DRAIN_WINDOW_FRAMES:
+            excess = self._window_min - (self.target_frames - 1)
+            self._drain_samples = max(0, excess) * FRAME_SAMPLES
+            self._window_min = None
+            self._window_frames = 0
+        return self._drain_samples > 0 or buffered > self.target_frames + ACCELERATE_MARGIN
+
+    def _accelerate(self, pcm: np.ndarray) -> np.ndarray:
+        """Shorten a frame to drain excess latency."""
+        self.frames_accelerated += 1
+        if np.sqrt(np.mean(pcm * pcm)) / 32768.0 < ACCELERATE_SILENCE_RMS:
+            shortened = pcm[:0]
+        else:
+            # Cross-fade two consecutive pitch periods into one
+            period = pitch_period(pcm)
+            start = (len(pcm) - 2 * period) // 2
+            fade = np.linspace(0.0, 1.0, period, dtype=np.float32)
+            merged = pcm[start:start + period] * (1 - fade) + pcm[start + period:start + 2 * period] * fade
+            shortened = np.concatenate((pcm[:start], merged, pcm[start + 2 * period:]))
+        self._drain_samples = max(0, self._drain_samples - (len(pcm) - len(shortened)))
+        return shortened
+
+    def _conceal(self) -> np.ndarray:
+        """Synthesize a missing frame from the last pitch period."""
+        if self._concealed == 0:
+            history = self._recent(FRAME_SAMPLES).astype(np.float32)
+            self._plc_template = history[-pitch_period(history):]
+            self._plc_phase = 0
+
+        n = self._concealed
+        self._concealed += 1
+        if n >= PLC_MAX_FRAMES:
+            return np.zeros(FRAME_SAMPLES, dtype=np.float32)
+
+        period = len(self._plc_template)
+        samples = self._plc_template[(self._plc_phase + _FRAME_INDEX) % period]
+        self._plc_phase = (self._plc_phase + FRAME_SAMPLES) % period
+        gain = np.linspace(PLC_DECAY ** n, PLC_DECAY ** (n + 1), FRAME_SAMPLES, dtype=np.float32)
+        return samples * gain
+
+    def _end_concealment(self, pcm: np.ndarray):
+        """Cross-fade from the concealed signal into real audio."""
+        if self._concealed <= PLC_MAX_FRAMES and len(pcm) >= CROSSFADE_SAMPLES:
+            period = len(self._plc_template)
+            indices = (self._plc_phase + _FRAME_INDEX[:CROSSFADE_SAMPLES]) % period
+            tail = self._plc_template[indices] * PLC_DECAY ** self._concealed
+            pcm[:CROSSFADE_SAMPLES] = pcm[:CROSSFADE_SAMPLES] * _FADE_IN + tail * (1 - _FADE_IN)
+        self._concealed = 0
+
+    def _write(self, samples: np.ndarray):
+        """Append samples to the PCM ring."""
+        indices = (self._pcm_write + np.arange(len(samples))) % PCM_RING_SAMPLES
+        self._pcm[indices] = np.clip(samples, -32768, 32767)
+        self._pcm_write += len(samples)
+
+    def _recent(self, count: int) -> np.ndarray:
+        """Last ``count`` samples written to the PCM ring."""
+        return self._pcm[(self._pcm_write - count + np.arange(count)) % PCM_RING_SAMPLES]
+
+
+class _PassThroughJitterBuffer:
+    """
+    Stands in for the jitter buffer of an aiortc receiver.
+
+    aiortc's audio buffer holds a fixed four frames and stalls after a
+    loss; every packet is handed on at once instead, and ``PlayoutStream``
+    does the buffering.
+    """
+
+    def add(self, packet):
+        return False, JitterFrame(data=packet._data, timestamp=packet.timestamp)
+
+
+class _TimestampUnwrapper:
+    """
+    Stands in for the timestamp mapper of an aiortc receiver.
+
+    aiortc's mapper takes any step back for a 32-bit wrap, which only
+    holds behind its own in-order jitter buffer; reordered packets are
+    unwrapped by the signed distance to the newest timestamp instead.
+    """
+
+    def __init__(self):
+        self._last_raw: Optional[int] = None
+        self._last = 0
+
+    def map(self, timestamp: int) -> int:
+        if self._last_raw is None:
+            self._last_raw = timestamp
+            return 0
+        delta = (timestamp - self._last_raw + (1 << 31)) % (1 << 32) - (1 << 31)
+        unwrapped = self._last + delta
+        if delta > 0:
+            self._last_raw, self._last = timestamp, unwrapped
+        return unwrapped
+
+
+class _PlayoutQueue(queue.Queue):
+    """
+    Stands in for the decoder queue of an aiortc receiver.
+
+    Encoded frames go to a ``PlayoutStream`` instead of the decoder
+    thread; only the stop sentinel is passed through.
+    """
+
+    def __init__(self, stream: PlayoutStream):
+        super().__init__()
+        self._stream = stream
+
+    def put(self, item, block=True, timeout=None):
+        if item is None:
+            super().put(item, block, timeout)
+        else:
+            _codec, frame = item
+            self._stream.push(frame.data, frame.timestamp)
+
+
+# Receiver attributes replaced by attach_playout
+RECEIVER_INTERNALS = ('_RTCRtpReceiver__jitter_buffer', '_RTCRtpReceiver__timestamp_mapper',
+                      '_RTCRtpReceiver__decoder_queue')
+
+
+def attach_playout(receiver) -> PlayoutStream:
+    """
+    Route an aiortc audio receiver into a new ``PlayoutStream``.
+
+    Must be called from the ``track`` event, before the receiver starts.
+    """
+    stream = PlayoutStream()
+    receiver._RTCRtpReceiver__jitter_buffer = _PassThroughJitterBuffer()
+    receiver._RTCRtpReceiver__timestamp_mapper = _TimestampUnwrapper()
+    receiver._RTCRtpReceiver__decoder_queue = _PlayoutQueue(stream)
+    return stream
+
+
 class VoiceManager:
     """
     Manages voice chat audio streams using WebRTC/aiortc.
-    
-    This is a stub implementation for future development.
+
+    The client publishes exactly one audio track to the server's SFU, which
+    forwards the other participants back on separate downstream tracks, so
+    uplink bandwidth stays the same however many people are in the room.
     """
-    
-    def __init__(self):
+
+    def __init__(self, configuration: Optional[RTCConfiguration] = None):
         """Initialize voice manager."""
-        self.peer_connection = None
-        self.audio_track = None
-        self.is_speaking = False
+        self.configuration = configuration or RTCConfiguration(iceServers=[])
+        self.peer_connection: Optional[RTCPeerConnection] = None
+        self.audio_track: Optional[MediaStreamTrack] = None
+        self.is_muted = False
         self.on_audio_received: Optional[Callable] = None
-    
+        self.on_speakers_changed: Optional[Callable] = None
+        self.active_speakers: List[str] = []  # Peer IDs, loudest first
+        self.peer_id: Optional[str] = None  # Our own, from the signaling roster
+        self.peer_names: Dict[str, str] = {}  # Usernames by peer ID
+
+        # Downstream playout by transceiver mid, and the peer each one forwards
+        self.playout: Dict[str, PlayoutStream] = {}
+        self.slot_peers: Dict[str, str] = {}
+        self._send: Optional[Callable[[dict], Awaitable]] = None
+
     async def initialize(self):
         """Initialize audio system."""
-        logger.info("Voice manager initialized (stub)")
-        # In production:
-        # - Set up aiortc PeerConnection
-        # - Get user media (microphone)
-        # - Create audio tracks
-        pass
-    
-    async def start_voice_chat(self, signaling_ws):
+        logger.info("Voice manager initialized")
+
+    async def start_voice_chat(self, send: Callable[[dict], Awaitable],
+                               track: Optional[MediaStreamTrack] = None):
         """
         Start voice chat in a room.
-        
+
         Args:
-            signaling_ws: WebSocket for signaling
+            send: Coroutine function sending a JSON message on the voice
+                signaling WebSocket (replies go to ``handle_signal``)
+            track: Audio track to publish (the microphone if not given)
         """
-        logger.info("Starting voice chat (stub)")
-        # In production:
-        # - Create WebRTC peer connection
-        # - Handle SDP offer/answer
-        # - Set up audio tracks
-        pass
-    
-    async def stop_voice_chat(self):
-        """Stop voice chat."""
-        logger.info("Stopping voice chat (stub)")
-        # In production:
-        # - Close peer connection
-        # - Stop audio tracks
-        self.is_speaking = False
-    
-    async def send_audio(self, audio_data: bytes):
+        check_receiver_internals(RECEIVER_INTERNALS)  # Before anything is set up
+        self._send = send
+        if track is None:
+            track = MicrophoneTrack()
+            track.muted = self.is_muted
+            track.start()
+        self.audio_track = track
+
+        pc = self.peer_connection = RTCPeerConnection(self.configuration)
+        pc.addTransceiver(self.audio_track, direction="sendonly")
+
+        @pc.on("track")
+        def on_track(remote_track):
+            transceiver = next(t for t in pc.getTransceivers() if t.receiver.track is remote_track)
+            # Take encoded frames before aiortc buffers and decodes them
+            stream = self.playout[transceiver.mid] = attach_playout(transceiver.receiver)
+            if self.on_audio_received:
+                self.on_audio_received(transceiver.mid, stream)
+
+        await pc.setLocalDescription(await pc.createOffer())
+        await send({'type': 'sfu_offer', 'sdp': pc.localDescription.sdp})
+        logger.info("Voice chat started")
+
+    async def handle_signal(self, data: dict):
         """
-        Send audio data.
-        
+        Handle a message from the voice signaling WebSocket.
+
         Args:
-            audio_data: Audio bytes
+            data: Decoded JSON message
         """
-        # In production:
-        # - Send audio through WebRTC data channel or RTP
-        pass
-    
+        msg_type = data.get('type')
+        # Room state arrives on joining, before voice may have started
+        if msg_type == 'sfu_speakers':
+            self._set_speakers(list(data['peers']))
+            return
+        if msg_type == 'roster':
+            self.peer_id = data['peer_id']
+            self.peer_names = {p['peer']: p['user'] for p in data['peers']}
+            return
+        if msg_type == 'peer_joined':
+            self.peer_names[data['peer']] = data['user']
+            return
+        if msg_type == 'peer_left':
+            self.peer_names.pop(data['peer'], None)
+            return
+
+        pc = self.peer_connection
+        if pc is None:
+            return
+
+        if msg_type == 'sfu_answer':
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=data['sdp'], type='answer'))
+        elif msg_type == 'sfu_offer':
+            # The SFU added downstream slots for new participants
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=data['sdp'], type='offer'))
+            await pc.setLocalDescription(await pc.createAnswer())
+            await self._send({'type': 'sfu_answer', 'sdp': pc.localDescription.sdp})
+        elif msg_type == 'sfu_subscribed':
+            self.slot_peers[data['mid']] = data['peer']
+        elif msg_type == 'sfu_unsubscribed':
+            for mid, peer in list(self.slot_peers.items()):
+                if peer == data['peer']:
+                    del self.slot_peers[mid]
+
+    def speaker_names(self, peers: List[str], own_name: str = "You") -> List[str]:
+        """Usernames of peer IDs, for display (``own_name`` for ourselves)."""
+        return [own_name if p == self.peer_id else self.peer_names.get(p, p[:8]) for p in peers]
+
+    async def subscribe(self, peer_id: str):
+        """Ask the SFU to forward a participant's audio."""
+        if self._send:
+            await self._send({'type': 'sfu_subscribe', 'peer': peer_id})
+
+    async def unsubscribe(self, peer_id: str):
+        """Ask the SFU to stop forwarding a participant's audio."""
+        if self._send:
+            await self._send({'type': 'sfu_unsubscribe', 'peer': peer_id})
+
+    async def stop_voice_chat(self):
+        """Stop voice chat."""
+        logger.info("Stopping voice chat")
+        if self.peer_connection:
+            await self.peer_connection.close()
+            self.peer_connection = None
+        if self.audio_track:
+            self.audio_track.stop()
+            self.audio_track = None
+        self.playout.clear()
+        self.slot_peers.clear()
+        self._set_speakers([])
+
+    def _set_speakers(self, peers: List[str]):
+        """Record the active speakers and notify the callback."""
+        self.active_speakers = peers
+        if self.on_speakers_changed:
+            self.on_speakers_changed(peers)
+
+    def set_muted(self, muted: bool):
+        """Mute or unmute the microphone (muted frames are never encoded or sent)."""
+        self.is_muted = muted
+        if isinstance(self.audio_track, MicrophoneTrack):
+            self.audio_track.muted = muted
+
+    @property
+    def is_speaking(self) -> bool:
+        """Whether voice activity is currently detected on the microphone."""
+        return isinstance(self.audio_track, MicrophoneTrack) and self.audio_track.is_speaking
+
+    @property
+    def input_levels(self) -> Optional[LevelRing]:
+        """Microphone levels for a meter, or None without a microphone."""
+        if isinstance(self.audio_track, MicrophoneTrack):
+            return self.audio_track.levels
+        return None
+
+    def read_playout(self) -> np.ndarray:
+        """Mix the next 20 ms of every downstream stream (called by the audio output)."""
+        mix = np.zeros(FRAME_SAMPLES, dtype=np.int32)
+        for stream in list(self.playout.values()):
+            mix += stream.read()
+        return np.clip(mix, -32768, 32767).astype(np.int16)
+
     def on_remote_audio(self, callback: Callable):
         """
         Register callback for received audio.
-        
+
         Args:
-            callback: Function to call with audio data
+            callback: Function called with (mid, PlayoutStream) for each downstream track
         """
         self.on_audio_received = callback
 
+    def on_active_speakers(self, callback: Callable):
+        """
+        Register callback for active speaker changes.
+
+        Args:
+            callback: Function called with the peer IDs speaking, loudest first
+        """
+        self.on_speakers_changed = callback
@@ -1,16 +1,66 @@
 """Network layer for REST API and WebSocket client."""
 
 import asyncio
+import hashlib
 import json
+import mimetypes
+import os
+import random
+import time
+import uuid
 import aiohttp
 import websockets
-from typing import Optional, Callable, Dict, Any
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Callable, Dict, Any, List, Tuple
+from client.core.cache import MessageCache
 from client.utils.logger import get_logger
 
 
 logger = get_logger(__name__)
 
 
+# Download tuning
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # 256 KB per read/write
+SEGMENT_THRESHOLD = 16 * 1024 * 1024  # Split files larger than 16 MB into ranges
+SEGMENT_COUNT = 4
+MAX_CONCURRENT_DOWNLOADS = 3
+PROGRESS_INTERVAL = 0.1  # seconds between progress callbacks
+
+# Upload tuning
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+DOWNLOAD_PATH = "/api/download/"  # Server path of stored files (links need a fresh signature)
+
+# Reconnecting: each wait is drawn uniformly up to an exponentially growing
+# bound (full jitter), so clients dropped together, as by a server
+# restart, come back spread out instead of all at once
+RECONNECT_BASE_DELAY = 0.5  # seconds, bound of the first wait
+RECONNECT_MAX_DELAY = 30.0
+STABLE_CONNECTION_SECONDS = 10  # A connection that lasted this long resets the backoff
+OUTBOX_BATCH_SIZE = 50  # Queued messages sent per frame after reconnecting
+HISTORY_PAGE_SIZE = 100
+HISTORY_ATTEMPTS = 3  # Tries of a failed history request before leaving a gap for the next session
+
+
+@dataclass
+class RoomSession:
+    """Resume state of one room subscription."""
+    resume_token: Optional[str] = None
+    last_seq: Optional[int] = None
+    # History ranges (after_seq, before_seq) that could not be fetched yet;
+    # retried when the next "session" frame arrives
+    gaps: List[Tuple[int, Optional[int]]] = field(default_factory=list)
+    
+    @property
+    def synced_seq(self) -> Optional[int]:
+        """Sequence number up to which every message was received (the cache's high-water mark)."""
+        if self.gaps:
+            return min(after_seq for after_seq, _ in self.gaps)
+        return self.last_seq
+
+
 class NetworkClient:
     """Handles REST API calls and WebSocket connections."""
     
@@ -26,6 +76,23 @@ class NetworkClient:
         self.websocket: Optional[websockets.WebSocketClientProtocol] = None
         self.message_callbacks: list[Callable] = []
         self.auth_token: Optional[str] = None
+        self.downloads = DownloadManager(self)
+        
+        # Rooms carried by the chat connection, with the state used to
+        # resume each of them after a dropped connection
+        self.subscriptions: Dict[str, RoomSession] = {}
+        self.cache: Optional[MessageCache] = None
+        self._high_water: Dict[str, int] = {}  # Cached sequence numbers by room
+        self._closing = False
+        
+        # Messages sent but not yet echoed or acknowledged by the server, by
+        # client ID; resent after a reconnect (the server drops duplicates)
+        self.outbox: OrderedDict = OrderedDict()
+        self._flushing = False
+        
+        # Keeps the chat connection up; called with True/False as it comes and goes
+        self._supervisor: Optional[asyncio.Task] = None
+        self.on_connection_changed: Optional[Callable[[bool], None]] = None
     
     async def connect(self):
         """Create HTTP session."""
@@ -34,6 +101,12 @@ class NetworkClient:
     
     async def disconnect(self):
         """Close HTTP session and WebSocket."""
+        self._closing = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        await self.downloads.cancel_all()
+        
         try:
             if self.websocket:
                 await self.websocket.close()
@@ -48,6 +121,20 @@ class NetworkClient:
         except Exception as e:
             logger.error(f"Error closing session: {e}")
     
+    def use_cache(self, cache: MessageCache):
+        """
+        Keep received messages in a local cache and sync from its contents.
+        
+        Each cached room starts from its high-water mark, so subscribing
+        fetches only the messages newer than the cache. Messages left in
+        the cache's outbox by the last run are sent once connected.
+        """
+        self.cache = cache
+        self._high_water = cache.high_water_marks()
+        for frame in cache.load_outbox():
+            self.outbox.setdefault(frame['id'], frame)
+            self._session(frame['room'])
+    
     def set_auth_token(self, token: str):
         """Set authentication token."""
         self.auth_token = token
@@ -120,14 +207,21 @@ class NetworkClient:
             logger.error(f"Login error: {e}")
             return None
     
-    async def upload_file(self, file_data: bytes, filename: str, room: str) -> Dict[str, Any]:
+    async def upload_file(self, file_path: str, room: str,
+                          on_progress: Optional[Callable[[int, int], None]] = None
+                          ) -> Dict[str, Any]:
         """
-        Upload a file.
+        Upload a file, streaming it from disk.
+        
+        The file is hashed in a worker thread first. If the server already
+        has a blob with that hash no bytes are sent; otherwise the file is
+        sent in chunks, so it is never held in memory. Cancel the calling
+        task to abort the upload.
         
         Args:
-            file_data: File content as bytes
-            filename: File name
+            file_path: Path of the file to upload
             room: Target room name
+            on_progress: Callback receiving (bytes sent, total bytes)
             
         Returns:
             Upload response data
@@ -135,56 +229,368 @@ class NetworkClient:
         await self.connect()
         
         try:
+            path = Path(file_path)
             url = f"{self.base_url}/api/upload"
             
+            total = (await asyncio.to_thread(path.stat)).st_size
+            file_hash = await asyncio.to_thread(hash_file, path)
+            
+            existing = await self._check_upload(file_hash, path.name, total, room)
+            if existing:
+                logger.info(f"Server already has {path.name}, skipped upload")
+                if on_progress:
+                    on_progress(total, total)
+                return existing
+            
+            content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+            
+            # Metadata goes first so the server knows the room before the body arrives
             form_data = aiohttp.FormData()
-            form_data.add_field('file', file_data, filename=filename, content_type='application/octet-stream')
             form_data.add_field('room', room)
+            form_data.add_field('sha256', file_hash)
+            form_data.add_field(
+                'file',
+                _read_file_chunks(path, _Progress(on_progress, total)),
+                filename=path.name,
+                content_type=content_type
+            )
             
             headers = self.get_headers()
             
             async with self.session.post(url, data=form_data, headers=headers) as response:
                 return await response.json()
         
+        except asyncio.CancelledError:
+            logger.info(f"File upload cancelled: {file_path}")
+            raise
         except Exception as e:
             logger.error(f"File upload error: {e}")
             raise
     
+    async def _check_upload(self, file_hash: str, filename: str, file_size: int,
+                            room: str) -> Optional[Dict[str, Any]]:
+        """
+        Ask the server whether it already stores a file with this hash.
+        
+        Returns:
+            Upload response data if the server linked the existing blob,
+            None if the file must be uploaded
+        """
+        try:
+            url = f"{self.base_url}/api/upload/check"
+            data = {
+                'sha256': file_hash,
+                'file_name': filename,
+                'file_size': file_size,
+                'room': room
+            }
+            
+            async with self.session.post(url, json=data, headers=self.get_headers()) as response:
+                if response.status != 200:
+                    return None
+                result = await response.json()
+                return result if result.get('exists') else None
+        
+        except (aiohttp.ClientError, ValueError) as e:
+            logger.warning(f"Upload check failed, uploading instead: {e}")
+            return None
+    
+    async def list_room_files(self, room: str, before: Optional[int] = None,
+                              file_type: Optional[str] = None,
+                              limit: int = 50) -> Dict[str, Any]:
+        """
+        Get one page of a room's attachments, newest first.
+        
+        Args:
+            room: Room name
+            before: Cursor from the previous page's ``next_cursor``
+            file_type: Optional filter ("image", "document", "other")
+            limit: Page size
+            
+        Returns:
+            Response data with ``files`` and ``next_cursor``
+        """
+        await self.connect()
+        
+        from urllib.parse import quote
+        url = f"{self.base_url}/api/rooms/{quote(room, safe='')}/files"
+        params = {'limit': str(limit)}
+        if before is not None:
+            params['before'] = str(before)
+        if file_type:
+            params['type'] = file_type
+        
+        try:
+            async with self.session.get(url, params=params, headers=self.get_headers()) as response:
+                return await response.json()
+        
+        except Exception as e:
+            logger.error(f"File listing error: {e}")
+            raise
+    
+    async def fetch_bytes(self, url: str, max_size: int) -> bytes:
+        """
+        Download a small file (such as an image to preview) into memory.
+
+        Args:
+            url: Absolute URL
+            max_size: Largest accepted size in bytes
+
+        Raises:
+            aiohttp.ClientError: The request failed
+            ValueError: The file is larger than max_size
+        """
+        await self.connect()
+
+        async with self.session.get(url, headers=self.get_headers()) as response:
+            response.raise_for_status()
+            if (response.content_length or 0) > max_size:
+                raise ValueError(f"file larger than {max_size} bytes")
+            data = bytearray()
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                data += chunk
+                if len(data) > max_size:
+                    raise ValueError(f"file larger than {max_size} bytes")
+            return bytes(data)
+
+    async def sign_file_url(self, url: str) -> str:
+        """
+        Get a fresh signed URL for a file link taken from a message.
+
+        Signed download URLs expire after a few minutes while messages keep
+        their links, so the server mints a new signature before each
+        download. Links that are not server downloads are returned as is.
+
+        Args:
+            url: Absolute or server-relative file URL (any query is ignored)
+
+        Returns:
+            Absolute URL to download, or the given URL if no new one was minted
+        """
+        from urllib.parse import quote, unquote, urlsplit
+
+        path = unquote(urlsplit(url).path)
+        if not path.startswith(DOWNLOAD_PATH):
+            return url
+
+        await self.connect()
+
+        filename = path[len(DOWNLOAD_PATH):]
+        try:
+            async with self.session.get(
+                f"{self.base_url}/api/files/{quote(filename, safe='')}/url",
+                headers=self.get_headers()
+            ) as response:
+                result = await response.json()
+                if response.status != 200:
+                    logger.warning(f"Could not renew link to {filename}: {result.get('error')}")
+                    return url
+                return f"{self.base_url}{result['file_url']}"
+        except (aiohttp.ClientError, ValueError) as e:
+            logger.warning(f"Could not renew link to {filename}: {e}")
+            return url
+
+    async def fetch_room_messages(self, room: str, after_seq: int,
+                                  before_seq: Optional[int] = None,
+                                  limit: int = HISTORY_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        Fetch one page of a room's message history by sequence number.
+        
+        Args:
+            room: Room name
+            after_seq: Last sequence number already seen
+            before_seq: Stop before this sequence number
+            limit: Page size
+            
+        Returns:
+            Response data with 'messages' (oldest first) and 'next_after_seq'
+            (None on the last page), or 'error'
+        """
+        from urllib.parse import quote
+        
+        await self.connect()
+        
+        params = {'after_seq': str(after_seq), 'limit': str(limit)}
+        if before_seq is not None:
+            params['before_seq'] = str(before_seq)
+        
+        try:
+            async with self.session.get(
+                f"{self.base_url}/api/rooms/{quote(room, safe='')}/messages",
+                params=params,
+                headers=self.get_headers()
+            ) as response:
+                result = await response.json()
+                if response.status != 200:
+                    return {'error': result.get('error', f'HTTP {response.status}')}
+                return result
+        except Exception as e:
+            logger.error(f"History fetch error: {e}")
+            return {'error': str(e)}
+    
     async def connect_websocket(self, room: str, 
                                on_message: Optional[Callable] = None) -> bool:
         """
-        Connect to WebSocket for chat.
+        Connect to WebSocket for chat and subscribe to a room.
+        
+        A single connection carries every room: once connected, further
+        calls only add a subscription. The first call starts a supervisor
+        that keeps reconnecting, with backoff, until ``disconnect()``,
+        whether or not the first attempt succeeds.
         
         Args:
-            room: Room name (will be URL-encoded)
+            room: Room name
             on_message: Callback for incoming messages
             
         Returns:
             True if connected successfully
         """
-        try:
-            # URL encode the room name
-            from urllib.parse import quote
-            encoded_room = quote(room)
-            ws_url = self.base_url.replace('http', 'ws') + f"/ws?room={encoded_room}"
-            
-            self.websocket = await websockets.connect(ws_url)
-            
-            if on_message:
-                self.message_callbacks.append(on_message)
-            
-            # Start listening for messages
-            asyncio.create_task(self._listen_messages())
-            
+        if on_message:
+            self.message_callbacks.append(on_message)
+        
+        self._session(room)
+        if self._supervisor is not None and not self._supervisor.done():
+            return await self.subscribe_room(room)
+        
+        self._closing = False
+        first_attempt = asyncio.get_running_loop().create_future()
+        self._supervisor = asyncio.create_task(self._supervise(first_attempt))
+        connected = await first_attempt
+        if connected:
             logger.info(f"Connected to WebSocket in room '{room}'")
-            return True
+        return connected
+    
+    async def subscribe_room(self, room: str) -> bool:
+        """
+        Start receiving a room's messages on the existing connection.
         
+        Returns:
+            True if the subscription was sent
+        """
+        session = self._session(room)
+        if not self.websocket:
+            logger.warning("WebSocket not connected")
+            return False
+        try:
+            await self.websocket.send(json.dumps(self._subscribe_frame(room, session)))
+            return True
         except Exception as e:
-            logger.error(f"WebSocket connection error: {e}")
+            logger.error(f"Error subscribing to '{room}': {e}")
             return False
     
+    async def unsubscribe_room(self, room: str):
+        """Stop receiving a room's messages."""
+        session = self.subscriptions.pop(room, None)
+        if session is None:
+            return
+        if self.cache is not None and session.synced_seq is not None:
+            self._high_water[room] = session.synced_seq  # Everything up to it is cached
+        if not self.websocket:
+            return
+        try:
+            await self.websocket.send(json.dumps({'type': 'unsubscribe', 'room': room}))
+        except Exception as e:
+            logger.error(f"Error unsubscribing from '{room}': {e}")
+    
+    def _session(self, room: str) -> RoomSession:
+        """Get a room's subscription state, starting from the cache if it has the room."""
+        session = self.subscriptions.get(room)
+        if session is None:
+            session = self.subscriptions[room] = RoomSession(last_seq=self._high_water.get(room))
+        return session
+    
+    def _ws_url(self) -> str:
+        """Build the chat WebSocket URL."""
+        from urllib.parse import quote
+        
+        ws_url = self.base_url.replace('http', 'ws') + "/ws"
+        if self.auth_token:
+            # Verified once by the server at the handshake
+            ws_url += f"?token={quote(self.auth_token)}"
+        return ws_url
+    
+    def _subscribe_frame(self, room: str, session: RoomSession) -> Dict[str, Any]:
+        """Build a subscribe frame, with resume parameters when available."""
+        frame = {'type': 'subscribe', 'room': room}
+        if session.resume_token and session.last_seq is not None:
+            # The server replays only what we missed
+            frame['resume'] = session.resume_token
+            frame['last_seq'] = session.last_seq
+        return frame
+    
+    async def _send_subscriptions(self):
+        """Subscribe a new connection to every room."""
+        for room, session in list(self.subscriptions.items()):
+            await self.websocket.send(json.dumps(self._subscribe_frame(room, session)))
+    
+    async def _supervise(self, first_attempt: asyncio.Future):
+        """Keep the chat connection up until disconnect(), resuming the session after drops."""
+        attempt = 0
+        try:
+            while not self._closing:
+                try:
+                    await self._open_websocket()
+                except Exception as e:
+                    if not first_attempt.done():
+                        first_attempt.set_result(False)
+                    delay = reconnect_delay(attempt)
+                    attempt += 1
+                    logger.warning(f"WebSocket connection failed ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                
+                if first_attempt.done():
+                    logger.info(f"Resumed WebSocket in {len(self.subscriptions)} room(s)")
+                else:
+                    first_attempt.set_result(True)
+                self._notify_connection(True)
+                connected_at = time.monotonic()
+                await self._listen_messages()
+                self.websocket = None
+                if self._closing:
+                    return
+                
+                self._notify_connection(False)
+                if time.monotonic() - connected_at >= STABLE_CONNECTION_SECONDS:
+                    attempt = 0
+                delay = reconnect_delay(attempt)
+                attempt += 1
+                await asyncio.sleep(delay)
+        finally:
+            if not first_attempt.done():
+                first_attempt.set_result(False)
+    
+    async def _open_websocket(self):
+        """Connect, subscribe every room and send the messages queued meanwhile."""
+        websocket = await websockets.connect(self._ws_url())
+        try:
+            self.websocket = websocket
+            await self._send_subscriptions()
+            await self._flush_outbox()
+        except Exception:
+            self.websocket = None
+            await websocket.close()
+            raise
+    
+    async def _flush_outbox(self):
+        """Send the unacknowledged messages, oldest first, several per frame."""
+        self._flushing = True  # New messages wait, so they stay behind the queued ones
+        sent = set()
+        try:
+            while True:
+                pending = [frame for message_id, frame in self.outbox.items() if message_id not in sent]
+                if not pending:
+                    return
+                for start in range(0, len(pending), OUTBOX_BATCH_SIZE):
+                    batch = pending[start:start + OUTBOX_BATCH_SIZE]
+                    await self.websocket.send(json.dumps({'type': 'batch', 'messages': batch}))
+                    sent.update(frame['id'] for frame in batch)
+                logger.info(f"Sent {len(pending)} queued message(s)")
+        finally:
+            self._flushing = False
+    
     async def _listen_messages(self):
-        """Listen for incoming WebSocket messages."""
+        """Handle incoming WebSocket messages until the connection closes."""
         try:
             async for message in self.websocket:
                 # Parse message
@@ -195,52 +601,561 @@ class NetworkClient:
                     logger.error(f"Invalid JSON received: {e}")
                     continue
                 
-                # Notify callbacks
-                for callback in self.message_callbacks:
-                    try:
-                        await callback(data)
-                    except Exception as e:
-                        logger.error(f"Message callback error: {e}")
+                await self._handle_frame(data)
         
         except websockets.exceptions.ConnectionClosed:
             logger.info("WebSocket closed")
         except Exception as e:
             logger.error(f"Error listening for messages: {e}")
     
+    def _notify_connection(self, connected: bool):
+        """Report the connection coming up or dropping."""
+        if self.on_connection_changed is None:
+            return
+        try:
+            self.on_connection_changed(connected)
+        except Exception as e:
+            logger.error(f"Connection callback error: {e}")
+    
+    async def _handle_frame(self, data: Dict[str, Any]):
+        """Track session frames and pass chat messages on to the callbacks."""
+        msg_type = data.get('type')
+        room = data.get('room')
+        
+        if msg_type == 'error':
+            logger.warning(f"Server error for room '{room}': {data.get('error')}")
+            return
+        
+        if msg_type == 'ack':
+            self._acknowledge(data.get('id'))  # A resent message the server already had
+            return
+        if data.get('id') in self.outbox:
+            self._acknowledge(data['id'])  # Our message, broadcast back
+        
+        session = self.subscriptions.get(room)
+        if session is None:
+            return  # Unsubscribed (or sent before the unsubscribe was seen)
+        
+        if msg_type == 'session':
+            session.resume_token = data.get('resume_token')
+            seq = data.get('seq', 0)
+            await self._fill_gaps(room, session)
+            # A resumed session gets what it missed replayed by the server
+            resumed = data.get('resumed') and session.last_seq is not None
+            if not resumed and session.last_seq is not None and session.last_seq < seq:
+                # Known history (from the cache): fetch only the delta
+                await self._backfill(room, session, session.last_seq, seq + 1)
+            elif not resumed:
+                if session.last_seq is not None and session.last_seq > seq and self.cache:
+                    self.cache.clear_room(room)  # The server's history restarted
+                session.last_seq = seq
+            self._save_high_water(room, session)
+            return
+        
+        if msg_type == 'resync':
+            # Part of the gap is older than the server's replay buffer
+            await self._backfill(room, session, data.get('after_seq', 0), data.get('before_seq'))
+            self._save_high_water(room, session)
+            return
+        
+        seq = data.get('seq')
+        if seq is not None:
+            if session.last_seq is not None and seq <= session.last_seq:
+                return  # Already delivered before the reconnect
+            session.last_seq = seq
+        
+        await self._dispatch(data)
+        if seq is not None:
+            self._save_high_water(room, session)
+    
+    async def _backfill(self, room: str, session: RoomSession, after_seq: int,
+                        before_seq: Optional[int]) -> bool:
+        """
+        Deliver the messages between two sequence numbers from history, in order.
+        
+        A failed request is retried with backoff. If history stays
+        unreachable, the session only advances past the messages received
+        and keeps the rest of the range as a gap, fetched again when the
+        next "session" frame arrives.
+        
+        Returns:
+            True if the whole range was delivered
+        """
+        attempt = 0
+        while True:
+            result = await self.fetch_room_messages(room, after_seq, before_seq)
+            if result.get('error'):
+                attempt += 1
+                if attempt < HISTORY_ATTEMPTS and not self._closing:
+                    await asyncio.sleep(reconnect_delay(attempt))
+                    continue
+                logger.warning(f"Could not backfill history for '{room}': {result['error']}")
+                session.gaps.append((after_seq, before_seq))
+                return False
+            attempt = 0
+            
+            for message in result.get('messages', []):
+                await self._dispatch(message)
+                after_seq = max(after_seq, message.get('seq') or after_seq)
+                session.last_seq = max(session.last_seq or 0, after_seq)
+            if result.get('next_after_seq') is None:
+                break
+            after_seq = result['next_after_seq']
+        
+        if before_seq is not None:
+            session.last_seq = max(session.last_seq or 0, before_seq - 1)
+        return True
+    
+    async def _fill_gaps(self, room: str, session: RoomSession):
+        """Fetch history ranges that earlier backfills could not."""
+        gaps, session.gaps = session.gaps, []
+        for after_seq, before_seq in gaps:
+            await self._backfill(room, session, after_seq, before_seq)
+    
+    def _save_high_water(self, room: str, session: RoomSession):
+        """Move the cache's high-water mark to the end of the room's complete history."""
+        if self.cache is not None and session.synced_seq is not None:
+            self.cache.set_high_water(room, session.synced_seq)
+    
+    async def _dispatch(self, data: Dict[str, Any]):
+        """Cache a chat message and notify callbacks of it."""
+        if self.cache is not None:
+            self.cache.add(data)
+        for callback in self.message_callbacks:
+            try:
+                await callback(data)
+            except Exception as e:
+                logger.error(f"Message callback error: {e}")
+    
     async def send_message(self, room: str, user: str, text: str, 
-                          msg_type: str = "text") -> bool:
+                          msg_type: str = "text", message_id: Optional[str] = None) -> bool:
         """
-        Send a text message through WebSocket.
+        Send a text message through WebSocket, or queue it until reconnected.
+        
+        The message stays in the outbox (saved in the cache, if any) until
+        the server echoes or acknowledges it, so a message lost with the
+        connection is sent again; the server drops copies by ID.
         
         Args:
             room: Room name
             user: Username
             text: Message text
             msg_type: Message type
+            message_id: Client-generated ID (a new one by default)
             
         Returns:
-            True if sent successfully
+            True if sent now, False if queued for the next connection
         """
-        if not self.websocket:
-            logger.warning("WebSocket not connected")
+        message = {
+            'type': msg_type,
+            'room': room,
+            'user': user,
+            'text': text,
+            'id': message_id or uuid.uuid4().hex
+        }
+        self.outbox[message['id']] = message
+        if self.cache is not None:
+            self.cache.queue_outgoing(message)
+        self._session(room)  # Resent messages need the room subscribed
+        
+        if not self.websocket or self._flushing:
+            logger.info("WebSocket not connected, message queued")
             return False
         
         try:
-            message = {
-                'type': msg_type,
-                'room': room,
-                'user': user,
-                'text': text
-            }
-            
             await self.websocket.send(json.dumps(message))
             return True
         
         except Exception as e:
-            logger.error(f"Error sending message: {e}")
+            logger.warning(f"Message queued, sending failed: {e}")
             return False
     
+    def _acknowledge(self, message_id: Optional[str]):
+        """Forget a queued message the server has received."""
+        if self.outbox.pop(message_id, None) is not None and self.cache is not None:
+            self.cache.remove_outgoing(message_id)
+    
     def on_message(self, callback: Callable):
         """Register a message callback."""
         self.message_callbacks.append(callback)
 
+
+
+class DownloadManager:
+    """
+    Streams files to disk over the client's shared aiohttp session.
+    
+    Downloads are written to a ``.part`` file in chunks and renamed on
+    completion. Partial files are resumed with a Range request, large files
+    are fetched as parallel byte-range segments, and a semaphore caps how
+    many downloads run at once (the rest wait in FIFO order).
+    
+    Partial files remember the validator (Last-Modified or ETag) of the
+    response they came from: streamed ones in ``.part.validator``, sent
+    back as ``If-Range``; segmented ones in their ``.part.json`` state.
+    A partial file whose source cannot be checked is downloaded again.
+    """
+    
+    def __init__(self, client: NetworkClient,
+                 max_concurrent: int = MAX_CONCURRENT_DOWNLOADS,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 segment_threshold: int = SEGMENT_THRESHOLD,
+                 segment_count: int = SEGMENT_COUNT):
+        """
+        Initialize download manager.
+        
+        Args:
+            client: Network client owning the HTTP session
+            max_concurrent: Maximum downloads running at the same time
+            chunk_size: Bytes read from the response per iteration
+            segment_threshold: Minimum size for parallel range downloads
+            segment_count: Number of parallel ranges for large files
+        """
+        self.client = client
+        self.max_concurrent = max_concurrent
+        self.chunk_size = chunk_size
+        self.segment_threshold = segment_threshold
+        self.segment_count = segment_count
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._active: Dict[str, asyncio.Task] = {}
+        
+        # Callbacks (download_id, ...) - called from the event loop thread
+        self.on_progress: Optional[Callable[[str, int, int], None]] = None
+        self.on_finished: Optional[Callable[[str, Path], None]] = None
+        self.on_failed: Optional[Callable[[str, str], None]] = None
+    
+    async def download(self, url: str, dest: Path,
+                       download_id: Optional[str] = None) -> Optional[Path]:
+        """
+        Download a URL to a local path, waiting for a free slot first.
+        
+        Args:
+            url: Absolute file URL
+            dest: Final destination path
+            download_id: Identifier used in callbacks (generated if omitted)
+            
+        Returns:
+            Destination path, or None if the download failed or was cancelled
+        """
+        download_id = download_id or uuid.uuid4().hex
+        dest = Path(dest)
+        self._active[download_id] = asyncio.current_task()
+        
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        
+        try:
+            async with self._semaphore:
+                await self.client.connect()
+                await self._fetch(download_id, url, dest)
+            
+            logger.info(f"Download complete: {dest}")
+            self._notify(self.on_finished, download_id, dest)
+            return dest
+        
+        except asyncio.CancelledError:
+            logger.info(f"Download cancelled: {url}")
+            self._notify(self.on_failed, download_id, "Cancelled")
+            return None
+        
+        except Exception as e:
+            logger.error(f"Download error for {url}: {e}")
+            self._notify(self.on_failed, download_id, str(e))
+            return None
+        
+        finally:
+            self._active.pop(download_id, None)
+    
+    def cancel(self, download_id: str) -> bool:
+        """Cancel a queued or running download (partial data is kept)."""
+        task = self._active.get(download_id)
+        if task and not task.done():
+            task.cancel()
+            return True
+        return False
+    
+    async def cancel_all(self):
+        """Cancel every queued or running download."""
+        tasks = [task for task in self._active.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _fetch(self, download_id: str, url: str, dest: Path):
+        """Pick a download strategy and move the finished file into place."""
+        part_path = dest.with_name(dest.name + '.part')
+        total, accepts_ranges, validator = await self._probe(url)
+        
+        progress = _Progress(
+            lambda received, size: self._notify(self.on_progress, download_id, received, size),
+            total
+        )
+        
+        if accepts_ranges and total >= self.segment_threshold and self.segment_count > 1:
+            await self._fetch_segmented(url, part_path, total, validator, progress)
+        else:
+            await self._fetch_stream(url, part_path, progress)
+        
+        progress.report(force=True)
+        await asyncio.to_thread(os.replace, part_path, dest)
+        await asyncio.to_thread(_validator_path(part_path).unlink, True)
+    
+    async def _probe(self, url: str) -> tuple[int, bool, Optional[str]]:
+        """Return (content length, range support, validator) using a HEAD request."""
+        try:
+            async with self.client.session.head(
+                url, headers=self.client.get_headers(), allow_redirects=True
+            ) as response:
+                if response.status != 200:
+                    return 0, False, None
+                total = response.content_length or 0
+                accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                return total, accepts_ranges, _validator(response.headers)
+        except aiohttp.ClientError:
+            return 0, False, None
+    
+    async def _fetch_stream(self, url: str, part_path: Path, progress: "_Progress"):
+        """Stream the body into the .part file, resuming from its current size."""
+        state_path = part_path.with_name(part_path.name + '.json')
+        validator_path = _validator_path(part_path)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        validator = await asyncio.to_thread(_read_validator, validator_path) if offset else None
+        if offset and (validator is None or state_path.exists()):
+            # A segmented download's preallocated file, or data of unknown origin
+            await asyncio.to_thread(_discard_partial, part_path)
+            offset = 0
+        
+        headers = self.client.get_headers()
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validator
+        
+        async with self.client.session.get(url, headers=headers) as response:
+            if response.status == 416 and offset:
+                if _range_total(response.headers.get('Content-Range')) == offset:
+                    # Nothing left to fetch - the .part file is already complete
+                    progress.total = progress.received = offset
+                    return
+                restart = True
+            else:
+                restart = False
+                response.raise_for_status()
+                
+                if response.status != 206:
+                    # Server ignored the Range header, or the file changed: start over
+                    offset = 0
+                    await asyncio.to_thread(_write_validator, validator_path, _validator(response.headers))
+                if response.content_length is not None:
+                    progress.total = offset + response.content_length
+                progress.received = offset
+                
+                mode = 'ab' if offset else 'wb'
+                f = await asyncio.to_thread(open, part_path, mode)
+                try:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        await asyncio.to_thread(f.write, chunk)
+                        progress.advance(len(chunk))
+                finally:
+                    await asyncio.to_thread(f.close)
+        
+        if restart:
+            # The server's copy is not the size of the .part file
+            await asyncio.to_thread(_discard_partial, part_path)
+            await self._fetch_stream(url, part_path, progress)
+    
+    async def _fetch_segmented(self, url: str, part_path: Path, total: int,
+                               validator: Optional[str], progress: "_Progress"):
+        """Fetch byte ranges in parallel into a preallocated .part file."""
+        state_path = part_path.with_name(part_path.name + '.json')
+        segments = None
+        
+        if part_path.exists() and part_path.stat().st_size == total and validator:
+            segments = await asyncio.to_thread(_load_segments, state_path, total, validator)
+        if segments is None:
+            segments = _split_segments(total, self.segment_count)
+            await asyncio.to_thread(_preallocate, part_path, total)
+        
+        progress.received = sum(pos - start for start, _, pos in segments)
+        
+        try:
+            await asyncio.gather(*(
+                self._fetch_segment(url, part_path, segment, validator, progress)
+                for segment in segments
+            ))
+        finally:
+            if all(pos > end for _, end, pos in segments):
+                await asyncio.to_thread(state_path.unlink, True)
+            else:
+                await asyncio.to_thread(_save_segments, state_path, segments, validator)
+    
+    async def _fetch_segment(self, url: str, part_path: Path, segment: list,
+                             validator: Optional[str], progress: "_Progress"):
+        """Fetch one [start, end, next] segment, updating ``next`` as data lands."""
+        _, end, pos = segment
+        if pos > end:
+            return
+        
+        headers = self.client.get_headers()
+        headers['Range'] = f'bytes={pos}-{end}'
+        if validator:
+            headers['If-Range'] = validator  # A changed file comes back whole and is refused
+        
+        async with self.client.session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RuntimeError("Server does not honor range requests")
+            
+            f = await asyncio.to_thread(open, part_path, 'r+b')
+            try:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    await asyncio.to_thread(_write_at, f, segment[2], chunk)
+                    segment[2] += len(chunk)
+                    progress.advance(len(chunk))
+            finally:
+                await asyncio.to_thread(f.close)
+    
+    def _notify(self, callback: Optional[Callable], *args):
+        """Call a callback, logging instead of raising on failure."""
+        if callback:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Download callback error: {e}")
+
+
+class _Progress:
+    """Byte counter that throttles progress callbacks."""
+    
+    def __init__(self, callback: Optional[Callable[[int, int], None]], total: int):
+        self.callback = callback
+        self.total = total
+        self.received = 0
+        self._last_report = 0.0
+    
+    def advance(self, size: int):
+        """Record transferred bytes and report if the interval elapsed."""
+        self.received += size
+        self.report()
+    
+    def report(self, force: bool = False):
+        """Call the callback (at most every PROGRESS_INTERVAL seconds)."""
+        now = time.monotonic()
+        if self.callback and (force or now - self._last_report >= PROGRESS_INTERVAL):
+            self._last_report = now
+            self.callback(self.received, self.total)
+
+
+def reconnect_delay(attempt: int) -> float:
+    """Seconds to wait before a reconnect attempt (numbered from 0), with full jitter."""
+    bound = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** min(attempt, 16))
+    return random.uniform(0, bound)
+
+
+def hash_file(path: Path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """Return the SHA-256 hex digest of a file (blocking - run in a thread)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def _read_file_chunks(path: Path, progress: _Progress,
+                            chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Yield a file's content chunk by chunk, reading in a worker thread."""
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+            progress.advance(len(chunk))
+        progress.report(force=True)
+    finally:
+        f.close()
+
+
+def _split_segments(total: int, count: int) -> list[list[int]]:
+    """Split [0, total) into ``count`` [start, end, next] ranges."""
+    size = -(-total // count)
+    return [
+        [start, min(start + size, total) - 1, start]
+        for start in range(0, total, size)
+    ]
+
+
+def _preallocate(path: Path, size: int):
+    """Create (or reset) a file of the given size."""
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+
+def _write_at(f, offset: int, data: bytes):
+    """Write data at an absolute offset."""
+    f.seek(offset)
+    f.write(data)
+
+
+def _load_segments(state_path: Path, total: int, validator: str) -> Optional[list[list[int]]]:
+    """Load saved segment progress, or None if missing or stale."""
+    try:
+        state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if state.get('total') != total or state.get('validator') != validator:
+        return None
+    return state.get('segments')
+
+
+def _save_segments(state_path: Path, segments: list[list[int]], validator: Optional[str]):
+    """Persist segment progress next to the .part file."""
+    total = segments[-1][1] + 1 if segments else 0
+    state_path.write_text(json.dumps({'total': total, 'validator': validator, 'segments': segments}))
+
+
+def _validator(headers) -> Optional[str]:
+    """Last-Modified date of a response, else its strong ETag (None if neither).
+    
+    The date comes first because aiohttp's FileResponse, which serves our
+    downloads, only evaluates dates in If-Range and ignores entity tags.
+    """
+    last_modified = headers.get('Last-Modified')
+    if last_modified:
+        return last_modified
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return None
+
+
+def _validator_path(part_path: Path) -> Path:
+    return part_path.with_name(part_path.name + '.validator')
+
+
+def _read_validator(path: Path) -> Optional[str]:
+    """Validator a streamed .part file was started with, if recorded."""
+    try:
+        return path.read_text().strip() or None
+    except OSError:
+        return None
+
+
+def _write_validator(path: Path, validator: Optional[str]):
+    """Record the validator of a streamed download (or forget it if there is none)."""
+    if validator:
+        path.write_text(validator)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _discard_partial(part_path: Path):
+    """Remove a .part file and its state."""
+    for path in (part_path, part_path.with_name(part_path.name + '.json'), _validator_path(part_path)):
+        path.unlink(missing_ok=True)
+
+
+def _range_total(content_range: Optional[str]) -> Optional[int]:
+    """Complete length from an unsatisfied range's ``Content-Range: bytes */N``."""
+    if not content_range or not content_range.startswith('bytes */'):
+        return None
+    length = content_range[len('bytes */'):]
+    return int(length) if length.isdigit() else None
@@ -1,86 +1,50 @@
 """Main application window."""
 
 from PySide6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QTextEdit, QLabel, QSplitter, QListWidget, QTabWidget, QListWidgetItem
-from PySide6.QtCore import Qt, Signal, QThread, QTimer, QObject
+from PySide6.QtCore import Qt, QTimer, QObject
 from PySide6.QtGui import QFont
-from typing import Optional
-from client.core.network import NetworkClient
+from typing import Optional, TYPE_CHECKING
+from pathlib import Path
 from client.utils.logger import get_logger
 import asyncio
-import threading
+import importlib
+import uuid
+from collections import deque
 from functools import partial
 
 
 logger = get_logger(__name__)
 
 
-class AsyncWorker(QThread):
-    """Worker thread for async operations."""
-    
-    def __init__(self):
-        super().__init__()
-        self.loop = None
-        self.is_terminating = False
-    
-    def run(self):
-        """Run asyncio event loop."""
-        try:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)
-            self.loop.run_forever()
-        except Exception as e:
-            if not self.is_terminating:
-                logger.error(f"AsyncWorker error: {e}")
-        finally:
-            if self.loop:
-                try:
-                    # Cancel pending tasks
-                    pending = asyncio.all_tasks(self.loop)
-                    for task in pending:
-                        task.cancel()
-                    # Let tasks finish cancellation
-                    self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
-                    self.loop.close()
-                except:
-                    pass
-    
-    def request_stop(self):
-        """Request the worker to stop."""
-        self.is_terminating = True
-        if self.loop and self.loop.is_running():
-            self.loop.call_soon_threadsafe(self.loop.stop)
-    
-    def schedule_coroutine(self, coro, callback=None):
-        """Schedule a coroutine and optionally call callback when done."""
-        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
-        if callback:
-            def check_result(fut):
-                if fut.done():
-                    try:
-                        result = fut.result()
-                        callback(result)
-                    except Exception as e:
-                        logger.error(f"Async operation failed: {e}")
-            future.add_done_callback(check_result)
-        return future
+UI_FRAME_MS = 16  # Incoming messages are shown at most once per frame (~60 fps)
+NETWORK_PRELOAD_MS = 500  # The network stack is imported this long after the window is up
+OWN_ECHO_WINDOW = 500  # Newest rows searched for the sent copy of an echoed own message
+
+if TYPE_CHECKING:
+    from client.core.cache import MessageCache
+    from client.core.network import NetworkClient
 
 
 class AppWindow(QMainWindow):
-    """Main application window."""
+    """
+    Main application window.
     
-    # Signal for adding messages from async context
-    message_received = Signal(str, str, float)
+    Runs on the GUI thread together with its coroutines (see
+    client.gui.event_loop), so network results update widgets directly.
+    """
     
     def __init__(self):
         """Initialize the main window."""
         super().__init__()
         
-        self.network_client: Optional[NetworkClient] = None
+        self.network_client: Optional["NetworkClient"] = None
         self.current_room = "general"
         self.username = ""
         
         # Store conversation history per room
-        self.room_histories = {}  # {room_name: [messages]}
+        self.room_histories = {}  # {room_name: [messages]}, shared with the chat view's models
+        self.message_cache: Optional["MessageCache"] = None
+        self.uncached_rooms = {}  # {room_name: last cached seq} of rooms not restored yet
         
         # Store channel data (text only for now)
         self.voice_channels = {
@@ -90,20 +54,35 @@ class AppWindow(QMainWindow):
         }
         self.current_voice_channel = None  # Currently joined voice channel
         
-        # Setup async worker
-        self.async_worker = AsyncWorker()
-        self.async_worker.start()
+        # Running coroutines (the loop keeps only weak references)
+        self._tasks = set()
         
-        # Connect signal
-        self.message_received.connect(self._handle_message_received)
+        # Incoming messages, queued as they arrive and shown once per frame
+        self._inbound = deque()  # (room, message)
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(UI_FRAME_MS)
+        self._flush_timer.timeout.connect(self._flush_inbound)
+        
+        # Tasks of running uploads (for cancellation)
+        self._uploads = set()
+        self._connection_lost = False  # Reconnecting (announced in the chat)
         
         self.setWindowTitle("BaraChat - Local Chat")
         self.setGeometry(100, 100, 1000, 700)
         
         self._setup_ui()
         
+        # aiohttp and websockets take about as long to import as all of
+        # Qt: load them off the GUI thread while the user logs in
+        QTimer.singleShot(NETWORK_PRELOAD_MS, self._preload_network)
+        
         logger.info("App window initialized")
     
+    def _preload_network(self):
+        """Import the network stack on a worker thread."""
+        asyncio.get_event_loop().run_in_executor(None, importlib.import_module, "client.core.network")
+    
     def _setup_channels(self):
         """Setup the room and channel list."""
         for room_name, channels in self.voice_channels.items():
@@ -145,8 +124,26 @@ class AppWindow(QMainWindow):
         # Create a simple chat view for now
         from client.gui.chat_view import ChatView
         self.chat_view = ChatView()
+        self.chat_view.history_source = self._load_older_messages
+        self.chat_view.newer_source = self._load_newer_messages
+        self.chat_view.show_room(self.current_room, self.room_histories.setdefault(self.current_room, []))
         self.chat_tabs.addTab(self.chat_view, "Chat")
         
+        # Create file gallery for the current room
+        from client.gui.gallery_view import GalleryView
+        self.gallery_view = GalleryView()
+        self.gallery_view.load_requested.connect(self._load_gallery_page)
+        self.gallery_view.file_activated.connect(self._on_gallery_file_activated)
+        self.gallery_view.set_room(self.current_room)
+        self.chat_tabs.addTab(self.gallery_view, "Files")
+        
+        # Create search over the cached history of all rooms
+        from client.gui.search_view import SearchView
+        self.search_view = SearchView()
+        self.search_view.search_requested.connect(self._search_messages)
+        self.search_view.message_activated.connect(self._open_search_result)
+        self.chat_tabs.addTab(self.search_view, "Search")
+        
         # Remove voice panel - not needed for now
         
         # Create settings view
@@ -182,21 +179,26 @@ class AppWindow(QMainWindow):
     def _join_text_channel(self, room_name: str, channel_name: str):
         """Join a text channel."""
         channel_id = f"{room_name}/{channel_name}"
-        
-        # Save current channel's history
-        if self.current_room:
-            self.room_histories[self.current_room] = self.chat_view.messages.copy()
-        
-        # Switch to new channel
-        self.current_room = channel_id
+        self._switch_room(channel_id)
         logger.info(f"Joined text channel: {channel_id}")
         
-        # Load channel history
-        self._load_room_history(channel_id)
-        
         # Switch to chat tab
         self.chat_tabs.setCurrentIndex(0)
     
+    def _switch_room(self, room: str):
+        """Show a room's history and subscribe to it."""
+        self.current_room = room
+        
+        # Load channel history
+        self._load_room_history(room)
+        self.gallery_view.set_room(room)
+        
+        # Rooms share the chat connection: switching only adds a subscription
+        if self.network_client:
+            self._run_async(
+                self.network_client.subscribe_room(room)
+            )
+    
     def _join_voice_channel(self, room_name: str, channel_name: str):
         """Join a voice channel."""
         # Leave previous voice channel if joined
@@ -233,10 +235,22 @@ class AppWindow(QMainWindow):
         logger.info(f"Login attempted: {username} @ {server_url}")
         
         # Initialize network client
+        from client.core.network import NetworkClient
         self.network_client = NetworkClient(server_url)
+        self.network_client.downloads.on_progress = self._on_download_progress
+        self.network_client.downloads.on_finished = (
+            lambda download_id, path: self._on_download_finished(download_id, str(path))
+        )
+        self.network_client.downloads.on_failed = self._on_download_failed
+        self.chat_view.previews.fetch = self._fetch_preview
+        self.network_client.on_connection_changed = self._on_connection_changed
+        
+        # Show cached history right away; the connection then fetches
+        # only what is newer than the cache
+        self._open_cache(username, server_url)
         
         # Connect to WebSocket asynchronously
-        self.async_worker.schedule_coroutine(
+        self._run_async(
             self._connect_websocket(),
             callback=self._on_websocket_connected
         )
@@ -244,36 +258,125 @@ class AppWindow(QMainWindow):
         # Update UI
         self.chat_view.set_username(username)
     
+    def _open_cache(self, username: str, server_url: str):
+        """Open the local history cache of this account and show the current room from it."""
+        if self.message_cache is not None:
+            self.message_cache.close()
+        try:
+            from client.core.cache import MessageCache
+            self.message_cache = MessageCache.for_account(server_url, username)
+        except Exception as e:
+            logger.error(f"Could not open message cache: {e}")
+            self.message_cache = None
+            return
+        self.network_client.use_cache(self.message_cache)
+        self.uncached_rooms = self.message_cache.high_water_marks()
+        self._load_room_history(self.current_room)
+    
+    def _restore_room(self, room: str):
+        """Put a room's cached messages before the ones received this session."""
+        last_seq = self.uncached_rooms.pop(room, None)
+        if last_seq is None:
+            return
+        # Newer messages were received (and cached) this session already
+        cached = self.message_cache.load_room(room, until_seq=last_seq)
+        cached = [self._display_message(data) for data in cached]
+        # A new list, so the chat view builds a new model over it
+        self.room_histories[room] = cached + self.room_histories.get(room, [])
+    
+    def _load_older_messages(self, room: str, before_seq: int) -> list:
+        """Page of cached messages before a sequence number, for the chat view."""
+        if self.message_cache is None:
+            return []
+        from client.gui.chat_view import PAGE_ROWS
+        older = self.message_cache.load_room(room, limit=PAGE_ROWS, until_seq=before_seq - 1)
+        return [self._display_message(data) for data in older]
+    
+    def _load_newer_messages(self, room: str, after_seq: int) -> list:
+        """Page of cached messages after a sequence number, up to the room's loaded history."""
+        if self.message_cache is None:
+            return []
+        from client.gui.chat_view import PAGE_ROWS
+        loaded = next((m['seq'] for m in self.room_histories.get(room, []) if m.get('seq') is not None), None)
+        until_seq = after_seq + PAGE_ROWS if loaded is None else min(after_seq + PAGE_ROWS, loaded - 1)
+        newer = self.message_cache.load_room(room, limit=PAGE_ROWS, after_seq=after_seq, until_seq=until_seq)
+        return [self._display_message(data) for data in newer]
+    
     def _load_room_history(self, room: str):
-        """Load conversation history for a room."""
-        # Clear current view
-        self.chat_view.clear()
-        
-        # Load history if it exists
-        if room in self.room_histories:
-            messages = self.room_histories[room]
-            for msg in messages:
-                if msg.get('type') == 'file':
-                    # Handle file messages
-                    self.chat_view.add_file_message(
-                        msg['user'],
-                        msg['filename'],
-                        msg['file_url'],
-                        msg.get('is_image', False),
-                        msg['timestamp']
-                    )
-                else:
-                    # Handle text messages
-                    self.chat_view.add_message(
-                        msg['user'],
-                        msg['text'],
-                        msg['timestamp']
-                    )
-            logger.info(f"Loaded history for room '{room}' ({len(messages)} messages)")
-        else:
-            # Initialize empty history for new room
-            self.room_histories[room] = []
-            logger.info(f"Created new history for room '{room}'")
+        """Show a room's history (the view shares the list and adds to it)."""
+        self._restore_room(room)
+        messages = self.room_histories.setdefault(room, [])
+        self.chat_view.show_room(room, messages)
+        logger.info(f"Loaded history for room '{room}' ({len(messages)} messages)")
+    
+    async def _fetch_preview(self, url: str) -> bytes:
+        """Download an image for the chat view's previews."""
+        from client.gui.previews import MAX_SOURCE_BYTES
+        url = await self.network_client.sign_file_url(url)
+        if url.startswith('/'):
+            url = f"{self.network_client.base_url}{url}"
+        return await self.network_client.fetch_bytes(url, MAX_SOURCE_BYTES)
+    
+    def _search_messages(self, query: str):
+        """Search the cached history of all rooms (answered from the cache's full-text index)."""
+        results = []
+        if query and self.message_cache is not None:
+            try:
+                results = self.message_cache.search(query)
+            except Exception as e:
+                logger.error(f"Search failed: {e}")
+        self.search_view.show_results(query, results)
+    
+    def _open_search_result(self, room: str, seq: int):
+        """Show a found message in its room."""
+        if room != self.current_room:
+            item = self._room_item(room)
+            if item is not None:
+                self.room_list.setCurrentItem(item)  # Joins the room
+            else:
+                self._switch_room(room)
+        self.chat_tabs.setCurrentIndex(0)
+        
+        messages = self.room_histories[room]
+        position = self._find_message(messages, seq)
+        if position is not None:
+            if self.chat_view.detached_room is not None:
+                self.chat_view.show_room(room, messages)
+            self.chat_view.scroll_to_message(position)
+            return
+        
+        # Older than the loaded history: show a page either side of it on its own
+        from client.gui.chat_view import PAGE_ROWS
+        loaded = next((m['seq'] for m in messages if m.get('seq') is not None), None)
+        until_seq = seq + PAGE_ROWS if loaded is None else min(seq + PAGE_ROWS, loaded - 1)
+        around = self.message_cache.load_room(
+            room, limit=2 * PAGE_ROWS + 1, after_seq=seq - PAGE_ROWS - 1, until_seq=until_seq
+        ) if self.message_cache is not None else []
+        position = next((i for i, data in enumerate(around) if data.get('seq') == seq), None)
+        if position is None:
+            logger.warning(f"Message {seq} of room '{room}' is not cached")
+            return
+        self.chat_view.show_detached(room, [self._display_message(data) for data in around], position)
+    
+    def _room_item(self, room: str) -> Optional[QListWidgetItem]:
+        """Room list entry of a room, if it has one."""
+        for row in range(self.room_list.count()):
+            item = self.room_list.item(row)
+            item_data = item.data(Qt.UserRole)
+            if item_data and "/".join(item_data) == room:
+                return item
+        return None
+    
+    @staticmethod
+    def _find_message(messages: list, seq: int) -> Optional[int]:
+        """Position of a message in a room history, searched from the newest."""
+        for position in range(len(messages) - 1, -1, -1):
+            found = messages[position].get('seq')
+            if found == seq:
+                return position
+            if found is not None and found < seq:
+                return None  # The history is in sequence order
+        return None
     
     def _on_websocket_connected(self, connected):
         """Callback when WebSocket connection is established."""
@@ -281,11 +384,18 @@ class AppWindow(QMainWindow):
         if connected:
             # Add system message to chat and history
             self.chat_view.add_message("System", "Connected to server!", 0)
-            self.room_histories.setdefault(self.current_room, []).append({
-                'user': "System",
-                'text': "Connected to server!",
-                'timestamp': 0
-            })
+        else:
+            # The network client keeps trying; messages are sent once connected
+            self._connection_lost = True
+            self.chat_view.add_message("System", "Could not connect to server, retrying...", 0)
+    
+    def _on_connection_changed(self, connected: bool):
+        """Announce the chat connection dropping and coming back."""
+        if not connected:
+            self.chat_view.add_message("System", "Connection lost, reconnecting...", 0)
+        elif self._connection_lost:
+            self.chat_view.add_message("System", "Reconnected to server", 0)
+        self._connection_lost = not connected
     
     async def _connect_websocket(self):
         """Connect to WebSocket in background."""
@@ -302,32 +412,56 @@ class AppWindow(QMainWindow):
                 logger.error(f"WebSocket connection error: {e}")
                 return False
     
-    def _handle_message_received(self, user: str, text: str, timestamp: float):
-        """Handle incoming message from signal (runs on main thread)."""
-        self.chat_view.add_message(user, text, timestamp)
-        
-        # Update room history
-        self.room_histories.setdefault(self.current_room, []).append({
-            'user': user,
-            'text': text,
-            'timestamp': timestamp
-        })
-    
     async def _on_message_received(self, data: dict):
-        """Handle incoming message from WebSocket (runs in async context)."""
+        """Queue a message from the WebSocket for the next UI frame."""
         user = data.get('user', 'unknown')
-        text = data.get('text', '')
-        msg_type = data.get('type', 'text')
-        timestamp = data.get('timestamp', 0)
+        room = data.get('room', self.current_room)
         
-        logger.info(f"Received message from {user}: {text[:50]}")
+        logger.debug(f"Received message from {user}: {data.get('text', '')[:50]}")
         
-        # Only show if it's not from the current user (to avoid duplicates)
-        # since we already show it immediately when sending
-        if user == self.username:
+        # Our own messages are shown when sent: their echo only confirms
+        # the shown copy (messages sent elsewhere or by a previous run are shown)
+        if user == self.username and self._confirm_own_message(room, data):
             return
         
-        if msg_type == 'file':
+        message = self._display_message(data)
+        
+        # One view update per frame, however many messages arrive
+        self._inbound.append((room, message))
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+    
+    def _confirm_own_message(self, room: str, data: dict) -> bool:
+        """
+        Mark the copy of our own message shown when it was sent as delivered.
+        
+        Returns:
+            False if no copy with the message's client ID is shown
+        """
+        message_id = data.get('id')
+        if message_id is None:
+            return False
+        history = self.room_histories.get(room, [])
+        for message in history[-1:-OWN_ECHO_WINDOW - 1:-1]:
+            if message.get('id') == message_id:
+                if data.get('seq') is not None:
+                    message['seq'] = data['seq']  # Found again by search
+                if message.get('type') == 'file':
+                    # The link to the stored file is only known once uploaded
+                    message['file_url'] = self._display_message(data).get('file_url', '')
+                message.pop('pending', None)
+                self.chat_view.message_list.viewport().update()
+                return True
+        return False
+    
+    @staticmethod
+    def _display_message(data: dict) -> dict:
+        """Convert a message from the server to the chat view's format."""
+        user = data.get('user', 'unknown')
+        text = data.get('text', '')
+        timestamp = data.get('timestamp', 0)
+        
+        if data.get('type', 'text') == 'file':
             # Handle file message
             # Parse filename and URL from text
             if '[FILE]' in text and ' - ' in text:
@@ -339,102 +473,127 @@ class AppWindow(QMainWindow):
                 file_url = text
             
             is_image = filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))
-            
-            # Emit special signal for file
-            QTimer.singleShot(0, lambda: self.chat_view.add_file_message(
-                user, filename, file_url, is_image, timestamp
-            ))
-            
-            # Add to room history
-            self.room_histories.setdefault(self.current_room, []).append({
+            message = {
                 'user': user,
                 'type': 'file',
                 'filename': filename,
                 'file_url': file_url,
                 'is_image': is_image,
                 'timestamp': timestamp
-            })
+            }
+            if data.get('thumbnail_url'):
+                message['thumbnail_url'] = data['thumbnail_url']
         else:
             # Regular text message
-            self.message_received.emit(user, text, timestamp)
+            message = {
+                'user': user,
+                'text': text,
+                'timestamp': timestamp
+            }
+        if data.get('seq') is not None:
+            message['seq'] = data['seq']  # Found again by search
+        if data.get('id') is not None:
+            message['id'] = data['id']
+        return message
+    
+    def _flush_inbound(self):
+        """Show every queued message with one model update per room."""
+        batches = {}
+        while self._inbound:
+            room, message = self._inbound.popleft()
+            batches.setdefault(room, []).append(message)
+        
+        for room, messages in batches.items():
+            if room == self.current_room:
+                self.chat_view.add_messages(messages)  # Also extends the room's history
+            else:
+                self.chat_view.add_room_messages(room, self.room_histories.setdefault(room, []), messages)
     
     def send_message(self, text: str):
         """Send a message."""
         if self.network_client and self.username and text:
-            # Show message immediately in the UI
-            self.chat_view.add_message(self.username, text, 0)
-            
-            # Update room history
-            self.room_histories.setdefault(self.current_room, []).append({
-                'user': self.username,
-                'text': text,
-                'timestamp': 0
-            })
+            # Show message immediately in the UI (and the room history),
+            # as pending until the server echoes it
+            message_id = uuid.uuid4().hex
+            self.chat_view.add_message(self.username, text, 0, message_id=message_id)
             
-            # Schedule async send to server
-            self.async_worker.schedule_coroutine(
-                self._send_message_async(text)
+            # Schedule async send to server (queued while disconnected)
+            self._run_async(
+                self._send_message_async(self.current_room, text, message_id)
             )
             logger.info(f"Sent message to room '{self.current_room}': {text[:50]}")
     
-    def send_file(self, filename: str, file_data: bytes, is_image: bool):
-        """Send a file to the current room."""
+    def send_file(self, file_path: str, is_image: bool):
+        """Send a file to the current room (the file is read in the loop's executor)."""
         if self.network_client and self.username:
-            # Show file in chat immediately
-            # Use absolute URL for clickable links
-            file_url = f"http://127.0.0.1:8765/download/{filename}"
-            self.chat_view.add_file_message(self.username, filename, file_url, is_image, 0)
+            filename = Path(file_path).name
             
-            # Update room history
-            self.room_histories.setdefault(self.current_room, []).append({
-                'user': self.username,
-                'type': 'file',
-                'filename': filename,
-                'file_url': file_url,
-                'is_image': is_image,
-                'timestamp': 0
-            })
+            # Show file in chat immediately; its link is filled in when the
+            # server echoes the message after the upload.
+            # Images preview from the local file, not a download of it
+            message_id = uuid.uuid4().hex
+            self.chat_view.add_file_message(self.username, filename, "", is_image, 0,
+                                            preview_path=file_path if is_image else None,
+                                            message_id=message_id)
             
             # Schedule async send
-            self.async_worker.schedule_coroutine(
-                self._send_file_async(filename, file_data, is_image)
+            task = self._run_async(
+                self._send_file_async(file_path, filename, is_image, message_id)
             )
+            self._uploads.add(task)
+            task.add_done_callback(self._uploads.discard)
             logger.info(f"Sending file: {filename}")
     
-    async def _send_file_async(self, filename: str, file_data: bytes, is_image: bool):
+    def cancel_uploads(self):
+        """Cancel all running uploads."""
+        for task in list(self._uploads):
+            task.cancel()
+    
+    async def _send_file_async(self, file_path: str, filename: str, is_image: bool, message_id: str):
         """Upload and share a file."""
         if self.network_client:
             try:
                 # Upload file to server
                 result = await self.network_client.upload_file(
-                    file_data=file_data,
-                    filename=filename,
-                    room=self.current_room
+                    file_path,
+                    room=self.current_room,
+                    on_progress=self._on_upload_progress
                 )
                 
+                if result.get('error'):
+                    self._on_upload_finished(f"Upload failed: {result['error']}")
+                    return
                 if result:
-                    file_url = result.get('file_url', f'/download/{filename}')
-                    # Make URL absolute for browser to open
-                    absolute_url = f"http://127.0.0.1:8765{file_url}"
+                    # Messages keep the unsigned link: it is signed again
+                    # (sign_file_url) whenever someone downloads it
+                    file_url = result.get('file_url', f'/api/download/{filename}').partition('?')[0]
+                    absolute_url = f"{self.network_client.base_url}{file_url}"
                     # Send as message
                     await self.network_client.send_message(
                         self.current_room,
                         self.username,
                         f"[FILE] {filename} - {absolute_url}",
-                        msg_type="file"
+                        msg_type="file",
+                        message_id=message_id
                     )
                     logger.info(f"File uploaded: {filename}")
+                self._on_upload_finished("")
+            except asyncio.CancelledError:
+                self._on_upload_finished(f"Upload cancelled: {filename}")
+                raise
             except Exception as e:
                 logger.error(f"Error uploading file: {e}")
+                self._on_upload_finished(f"Upload failed: {e}")
     
-    async def _send_message_async(self, text: str):
+    async def _send_message_async(self, room: str, text: str, message_id: str):
         """Send message async."""
         if self.network_client:
             try:
                 result = await self.network_client.send_message(
-                    self.current_room,
+                    room,
                     self.username,
-                    text
+                    text,
+                    message_id=message_id
                 )
                 return result
             except Exception as e:
@@ -443,90 +602,130 @@ class AppWindow(QMainWindow):
     
     
     def download_file(self, file_url: str):
-        """Download a file from the given URL."""
-        if self.network_client:
-            # Schedule async download
-            self.async_worker.schedule_coroutine(
-                self._download_file_async(file_url)
-            )
-            logger.info(f"Downloading file from: {file_url}")
-    
-    async def _download_file_async(self, file_url: str):
-        """Download file asynchronously."""
-        import urllib.request
-        from pathlib import Path
+        """Queue a download of the given URL into the Downloads folder."""
+        if not self.network_client:
+            return
+        
         from urllib.parse import unquote, quote
         
+        # URL encode the filename properly, keeping the signature query intact
+        # Split base URL and filename
+        file_url, sep, query = file_url.partition('?')
+        if '/download/' in file_url:
+            base_url, filename = file_url.split('/download/', 1)
+            full_url = f"{base_url}/download/{quote(unquote(filename), safe='')}{sep}{query}"
+        else:
+            full_url = f"{file_url}{sep}{query}"
+            filename = file_url.split('/')[-1]
+        
+        # Decode filename for local storage
+        downloads_dir = Path.home() / "Downloads"
+        downloads_dir.mkdir(exist_ok=True)
+        file_path = downloads_dir / Path(unquote(filename)).name
+        
+        self._run_async(self._download_async(full_url, file_path))
+        logger.info(f"Downloading file from: {full_url}")
+    
+    async def _download_async(self, file_url: str, file_path: Path):
+        """Download a file through a freshly signed link (the one in the message may have expired)."""
+        url = await self.network_client.sign_file_url(file_url)
+        await self.network_client.downloads.download(url, file_path, download_id=file_url)
+    
+    def _on_download_progress(self, download_id: str, received: int, total: int):
+        """Show download progress."""
+        self.chat_view.set_download_progress(received, total)
+    
+    def _on_download_finished(self, download_id: str, file_path: str):
+        """Report a finished download."""
+        self.chat_view.add_message("System", f"✅ File downloaded to: {file_path}", 0)
+    
+    def _on_download_failed(self, download_id: str, error: str):
+        """Report a failed download."""
+        self.chat_view.add_message("System", f"❌ Download failed: {error}", 0)
+    
+    def _load_gallery_page(self, room: str, cursor, file_type: str):
+        """Fetch a page of the room's files for the gallery."""
+        if not self.network_client:
+            self.gallery_view.add_page(room, file_type, {'error': 'Not connected'})
+            return
+        
+        self._run_async(
+            self._fetch_gallery_page(room, cursor, file_type)
+        )
+    
+    async def _fetch_gallery_page(self, room: str, cursor, file_type: str):
+        """Request a gallery page and show it."""
+        from client.gui.gallery_view import PAGE_SIZE
+        
         try:
-            # URL encode the filename properly
-            # Split base URL and filename
-            if '/download/' in file_url:
-                base_url = file_url.split('/download/')[0]
-                filename = file_url.split('/download/')[1]
-                # Properly encode the filename
-                encoded_filename = quote(filename, safe='')
-                full_url = f"{base_url}/download/{encoded_filename}"
-            else:
-                full_url = file_url
-                filename = file_url.split('/')[-1]
-            
-            # Decode filename for local storage
-            local_filename = unquote(filename)
-            
-            downloads_dir = Path.home() / "Downloads"
-            downloads_dir.mkdir(exist_ok=True)
-            
-            file_path = downloads_dir / local_filename
-            
-            # Download file using properly encoded URL
-            logger.info(f"Downloading from: {full_url}")
-            urllib.request.urlretrieve(full_url, str(file_path))
-            
-            self.chat_view.add_message(
-                "System",
-                f"✅ File downloaded to: {file_path}",
-                0
+            result = await self.network_client.list_room_files(
+                room, before=cursor, file_type=file_type or None, limit=PAGE_SIZE
             )
-            logger.info(f"File downloaded to: {file_path}")
-        
         except Exception as e:
-            self.chat_view.add_message(
-                "System",
-                f"❌ Download failed: {e}",
-                0
-            )
-            logger.error(f"Error downloading file: {e}")
+            result = {'error': str(e)}
+        self.gallery_view.add_page(room, file_type, result)
     
-    def closeEvent(self, event):
-        """Clean up when window closes."""
-        logger.info("Closing application...")
-        
-        # Disconnect network client if connected
+    def _on_gallery_file_activated(self, file_url: str):
+        """Download a file picked in the gallery."""
         if self.network_client:
-            try:
-                # Schedule disconnect
-                self.async_worker.schedule_coroutine(
-                    self.network_client.disconnect()
-                )
-            except:
-                pass
+            self.download_file(f"{self.network_client.base_url}{file_url}")
+    
+    def _on_upload_progress(self, sent: int, total: int):
+        """Show upload progress."""
+        self.chat_view.set_upload_progress(sent, total)
+    
+    def _on_upload_finished(self, error: str):
+        """Reset upload state and report errors."""
+        self.chat_view.set_upload_progress(None, None)
+        if error:
+            self.chat_view.add_message("System", f"❌ {error}", 0)
+    
+    def _run_async(self, coro, callback=None) -> asyncio.Task:
+        """
+        Start a coroutine on the event loop.
+        
+        Args:
+            coro: Coroutine to run
+            callback: Called with its result once it finishes (not if it fails)
+            
+        Returns:
+            The coroutine's task
+        """
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if callback:
+            def check_result(task):
+                if task.cancelled():
+                    return
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.error(f"Async operation failed: {e}")
+                    return
+                callback(result)
+            task.add_done_callback(check_result)
+        return task
+    
+    async def shutdown(self):
+        """Close the connection and commit the last cached messages (after the window closed)."""
+        for task in list(self._tasks):
+            task.cancel()
+        self.chat_view.previews.close()
         
-        # Stop async worker
-        if self.async_worker:
+        if self.network_client:
             try:
-                # Request stop
-                self.async_worker.request_stop()
-                
-                # Wait for thread to finish gracefully
-                if self.async_worker.isRunning():
-                    self.async_worker.wait(1000)
+                await self.network_client.disconnect()
             except Exception as e:
-                logger.error(f"Error stopping async worker: {e}")
-                # Force terminate if still running
-                if self.async_worker.isRunning():
-                    self.async_worker.terminate()
-                    self.async_worker.wait(500)
+                logger.error(f"Error disconnecting: {e}")
+        
+        if self.message_cache is not None:
+            self.message_cache.close()
+            self.message_cache = None
         
         logger.info("Application closed")
+    
+    def closeEvent(self, event):
+        """Clean up when window closes (the event loop then runs shutdown())."""
+        logger.info("Closing application...")
         super().closeEvent(event)
-
@@ -1,18 +1,393 @@
 """Chat view widget for displaying and sending messages."""
 
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QFileDialog
-from PySide6.QtCore import Qt, QUrl
-from PySide6.QtGui import QTextCharFormat, QTextCursor, QDesktopServices
+from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QLabel,
+                               QFileDialog, QListView, QStyledItemDelegate, QStyle, QAbstractItemView)
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QPoint
+from PySide6.QtGui import QColor, QFont, QFontMetrics
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable
+from functools import partial
+from urllib.parse import unquote
+from client.gui.previews import PreviewLoader, PREVIEW_WIDTH, PREVIEW_HEIGHT
 from client.utils.logger import get_logger
-import base64
-import webbrowser
+import time
 
 
 logger = get_logger(__name__)
 
 
+# Rows kept in the list while following new messages; older ones are
+# dropped from the view and reloaded a page at a time when scrolled to
+MAX_LOADED_ROWS = 500
+WINDOW_LIMIT = 2000  # Rows kept at most while browsing older messages
+PAGE_ROWS = 100
+HISTORY_LIMIT = 2 * WINDOW_LIMIT  # Messages kept in memory per room; older ones are paged in from the cache
+HEIGHT_CACHE_SIZE = 4 * WINDOW_LIMIT  # Laid out row heights kept (per width)
+ROOM_MODEL_CACHE_SIZE = 8  # Rooms whose model and scroll position stay alive
+
+USER_COLOR = "#4ec9b0"
+OTHER_USER_COLOR = "#9cdcfe"
+TIME_COLOR = "#888888"
+LINK_COLOR = "#28a745"
+PREVIEW_PLACEHOLDER_COLOR = "#3c3c3c"
+ROW_PADDING = 5
+
+
+class MessageListModel(QAbstractListModel):
+    """
+    Window of rows over a room's messages.
+    
+    The messages themselves stay in a plain list; the model only exposes
+    the rows from ``start`` to ``end``, so the view never lays out more
+    than ``WINDOW_LIMIT`` rows however long the room history is. The
+    window follows new messages, grows backwards a page at a time with
+    ``load_older`` and forwards again through Qt's ``fetchMore``.
+    
+    The list itself is kept to ``HISTORY_LIMIT`` messages by dropping the
+    oldest ones above the window; ``fetch_older`` brings them back from
+    the cache when the window reaches the start of the list. A detached
+    list (a stretch of old history) also has ``fetch_newer``, which pages
+    in later messages at its end, so its newest ones can be dropped too.
+    """
+    
+    def __init__(self, parent=None, room: Optional[str] = None):
+        super().__init__(parent)
+        self.room = room
+        self.messages: List[Dict[str, Any]] = []
+        self.start = 0
+        self.end = 0
+        self.scroll_value: Optional[int] = None  # Saved while another room is shown
+        # Called with a sequence number for the cached messages before it, oldest first
+        self.fetch_older: Optional[Callable[[int], List[Dict[str, Any]]]] = None
+        self._older_exhausted = False
+        # Called with a sequence number for the cached messages after it (detached lists only)
+        self.fetch_newer: Optional[Callable[[int], List[Dict[str, Any]]]] = None
+        self._newer_exhausted = False
+    
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.end - self.start
+    
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < self.end - self.start:
+            return None
+        message = self.messages[self.start + index.row()]
+        if role == Qt.DisplayRole:
+            return message.get('text') or message.get('filename', '')
+        return None
+    
+    def message(self, index: QModelIndex) -> Dict[str, Any]:
+        """
+        Message shown on a row.
+        
+        Delegates use this instead of ``data``, which would copy the dict
+        into a QVariant and back on every paint.
+        """
+        return self.messages[self.start + index.row()]
+    
+    def set_messages(self, messages: List[Dict[str, Any]], rows: int = MAX_LOADED_ROWS):
+        """
+        Show another message list, starting with its newest messages.
+        
+        The list is shared, not copied: messages added through the model
+        are appended to it.
+        
+        Args:
+            messages: Messages, oldest first
+            rows: Newest rows to expose at first
+        """
+        self.beginResetModel()
+        self.messages = messages
+        self.end = len(messages)
+        self.start = max(0, self.end - rows)
+        self._older_exhausted = False
+        self._newer_exhausted = False
+        self.endResetModel()
+    
+    def catch_up(self):
+        """Bring in messages appended to the list behind the model's back."""
+        count = len(self.messages) - self.end
+        if count > 0:
+            row = self.end - self.start
+            self.beginInsertRows(QModelIndex(), row, row + count - 1)
+            self.end += count
+            self.endInsertRows()
+            self._trim_top(WINDOW_LIMIT)
+            self._trim_history()
+    
+    def append(self, message: Dict[str, Any], follow: bool = True):
+        """Add a message at the end (see ``extend``)."""
+        self.extend([message], follow)
+    
+    def extend(self, messages: List[Dict[str, Any]], follow: bool = True):
+        """
+        Add messages at the end with a single row insertion.
+        
+        Args:
+            messages: Message data, oldest first
+            follow: Whether the view is following new messages, in which case
+                rows beyond ``MAX_LOADED_ROWS`` are dropped from the top
+        """
+        at_tail = self.end == len(self.messages)
+        self.messages.extend(messages)
+        if not at_tail or not messages:
+            return  # Browsing older messages; fetchMore brings them in later
+        
+        row = self.end - self.start
+        self.beginInsertRows(QModelIndex(), row, row + len(messages) - 1)
+        self.end += len(messages)
+        self.endInsertRows()
+        self._trim_top(MAX_LOADED_ROWS if follow else WINDOW_LIMIT)
+        self._trim_history()
+    
+    def load_older(self) -> int:
+        """
+        Bring a page of older messages into the window.
+        
+        At the start of the list, a page is first fetched from the cache.
+        
+        Returns:
+            Number of rows inserted at the top
+        """
+        if not self.start:
+            self._page_in_older()
+        count = min(PAGE_ROWS, self.start)
+        if count:
+            self.beginInsertRows(QModelIndex(), 0, count - 1)
+            self.start -= count
+            self.endInsertRows()
+            self._trim_bottom(WINDOW_LIMIT)
+        return count
+    
+    def reveal(self, position: int) -> int:
+        """
+        Bring a message into the window, moving the window there if needed.
+        
+        Args:
+            position: Index of the message in the message list
+            
+        Returns:
+            Row of the message
+        """
+        if not self.start <= position < self.end:
+            self.beginResetModel()
+            self.start = max(0, position - PAGE_ROWS)
+            self.end = min(len(self.messages), position + PAGE_ROWS)
+            self.endResetModel()
+        return position - self.start
+    
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        if parent.isValid():
+            return False
+        return self.end < len(self.messages) or (self.fetch_newer is not None and not self._newer_exhausted)
+    
+    def fetchMore(self, parent=QModelIndex()):
+        """Bring a page of newer messages into the window (called by the view)."""
+        if self.end == len(self.messages):
+            self._page_in_newer()
+        count = min(PAGE_ROWS, len(self.messages) - self.end)
+        if count <= 0:
+            return
+        row = self.end - self.start
+        self.beginInsertRows(QModelIndex(), row, row + count - 1)
+        self.end += count
+        self.endInsertRows()
+        self._trim_top(WINDOW_LIMIT)
+        self._trim_history()
+    
+    def _trim_top(self, limit: int):
+        """Drop the oldest rows beyond ``limit``."""
+        excess = self.end - self.start - limit
+        if excess > 0:
+            self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+            self.start += excess
+            self.endRemoveRows()
+    
+    def _page_in_older(self):
+        """Put the page of cached messages before the oldest loaded one at the start of the list."""
+        if self.fetch_older is None or self._older_exhausted:
+            return
+        seq = next((m['seq'] for m in self.messages if m.get('seq') is not None), None)
+        older = self.fetch_older(seq) if seq is not None else []
+        if not older:
+            self._older_exhausted = True
+            return
+        self.messages[:0] = older  # In place: the list is shared with the room history
+        self.start += len(older)
+        self.end += len(older)
+        if self.fetch_newer is not None:
+            # Newest messages below the window can be paged in again
+            count = min(len(self.messages) - HISTORY_LIMIT, len(self.messages) - self.end)
+            if count > 0:
+                del self.messages[len(self.messages) - count:]
+                self._newer_exhausted = False
+    
+    def _page_in_newer(self):
+        """Append the page of cached messages after the newest loaded one."""
+        if self.fetch_newer is None or self._newer_exhausted:
+            return
+        seq = next((m['seq'] for m in reversed(self.messages) if m.get('seq') is not None), None)
+        newer = self.fetch_newer(seq) if seq is not None else []
+        if not newer:
+            self._newer_exhausted = True
+            return
+        self.messages.extend(newer)
+    
+    def _trim_history(self):
+        """Drop the oldest messages beyond ``HISTORY_LIMIT`` that are above the window."""
+        count = min(len(self.messages) - HISTORY_LIMIT, self.start)
+        if count > 0:
+            del self.messages[:count]
+            self.start -= count
+            self.end -= count
+            self._older_exhausted = False
+    
+    def _trim_bottom(self, limit: int):
+        """Drop the newest rows beyond ``limit``."""
+        excess = self.end - self.start - limit
+        if excess > 0:
+            rows = self.end - self.start
+            self.beginRemoveRows(QModelIndex(), rows - excess, rows - 1)
+            self.end -= excess
+            self.endRemoveRows()
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """
+    Paints a message row: author and time on top, then the wrapped text.
+    
+    Row heights are measured once per message and width and kept in a
+    bounded cache, so scrolling never measures the same row twice. Image
+    rows always reserve the preview box, so a preview arriving later
+    only repaints its row instead of moving the rows below.
+    """
+    
+    def __init__(self, chat_view: "ChatView"):
+        super().__init__(chat_view)
+        self.chat_view = chat_view
+        self.body_font = QFont("Consolas")
+        self.body_font.setStyleHint(QFont.Monospace)
+        self.body_font.setPixelSize(12)
+        self.header_font = QFont(self.body_font)
+        self.header_font.setBold(True)
+        self._heights: OrderedDict = OrderedDict()  # (message key, width) -> height
+    
+    def clear_cache(self):
+        """Forget measured heights (after the fonts or messages changed)."""
+        self._heights.clear()
+    
+    def sizeHint(self, option, index: QModelIndex) -> QSize:
+        model = index.model()
+        message = model.message(index)
+        width = max(1, option.rect.width() or self.chat_view.message_list.viewport().width())
+        message_key = _message_key(model.room, message)
+        if message_key is None:
+            return QSize(width, self._measure(message, width))
+        key = (message_key, width)
+        height = self._heights.get(key)
+        if height is None:
+            height = self._measure(message, width)
+            self._heights[key] = height
+            if len(self._heights) > HEIGHT_CACHE_SIZE:
+                self._heights.popitem(last=False)
+        else:
+            self._heights.move_to_end(key)
+        return QSize(width, height)
+    
+    def paint(self, painter, option, index: QModelIndex):
+        message = index.model().message(index)
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, QColor("#094771"))
+        
+        rect = option.rect.adjusted(ROW_PADDING, ROW_PADDING, -ROW_PADDING, -ROW_PADDING)
+        header_height = QFontMetrics(self.header_font).height()
+        
+        user = message.get('user', '')
+        painter.setFont(self.header_font)
+        painter.setPen(QColor(USER_COLOR if user == self.chat_view.username else OTHER_USER_COLOR))
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignTop, user)
+        user_width = QFontMetrics(self.header_font).horizontalAdvance(user)
+        painter.setFont(self.body_font)
+        painter.setPen(QColor(TIME_COLOR))
+        status = " - sending..." if message.get('pending') else ""
+        painter.drawText(rect.adjusted(user_width, 0, 0, 0), Qt.AlignLeft | Qt.AlignTop,
+                         f" ({_format_time(message.get('timestamp', 0))}){status}")
+        
+        body = rect.adjusted(0, header_height, 0, 0)
+        if message.get('type') == 'file':
+            painter.drawText(body, Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, _file_label(message))
+            painter.setPen(QColor(LINK_COLOR))
+            label_height = self._text_height(_file_label(message), body.width())
+            painter.drawText(body.adjusted(0, label_height, 0, 0),
+                             Qt.AlignLeft | Qt.AlignTop, "📥 Download")
+            if message.get('is_image'):
+                top = body.top() + label_height + QFontMetrics(self.body_font).height() + ROW_PADDING
+                self._paint_preview(painter, QRect(body.left(), top, PREVIEW_WIDTH, PREVIEW_HEIGHT), message)
+        else:
+            painter.setPen(QColor("#ffffff"))
+            painter.drawText(body, Qt.AlignLeft | Qt.AlignTop | Qt.TextWordWrap, message.get('text', ''))
+        painter.restore()
+    
+    def _paint_preview(self, painter, box: QRect, message: Dict[str, Any]):
+        """Paint an image's preview, or a placeholder while it loads."""
+        pixmap = self.chat_view.previews.preview(_preview_source(message))
+        if pixmap is None:
+            painter.fillRect(box, QColor(PREVIEW_PLACEHOLDER_COLOR))
+            return
+        painter.drawPixmap(box.left(), box.top(), pixmap)
+    
+    def _measure(self, message: Dict[str, Any], width: int) -> int:
+        """Height of a row laid out at the given width."""
+        text_width = max(1, width - 2 * ROW_PADDING)
+        height = QFontMetrics(self.header_font).height()
+        if message.get('type') == 'file':
+            height += self._text_height(_file_label(message), text_width)
+            height += QFontMetrics(self.body_font).height()
+            if message.get('is_image'):
+                height += ROW_PADDING + PREVIEW_HEIGHT
+        else:
+            height += self._text_height(message.get('text', ''), text_width)
+        return height + 2 * ROW_PADDING
+    
+    def _text_height(self, text: str, width: int) -> int:
+        """Height of wrapped body text."""
+        bounds = QFontMetrics(self.body_font).boundingRect(
+            QRect(0, 0, width, 1_000_000), Qt.AlignLeft | Qt.TextWordWrap, text or " "
+        )
+        return bounds.height()
+
+
+def _message_key(room: Optional[str], message: Dict[str, Any]):
+    """
+    Stable identity of a message, or None if it has none.
+    
+    The client ID is kept from sending to delivery; server sequence
+    numbers are per room.
+    """
+    if message.get('id') is not None:
+        return message['id']
+    if message.get('seq') is not None:
+        return room, message['seq']
+    return None
+
+
+def _format_time(timestamp: float) -> str:
+    """Clock time of a message."""
+    return datetime.fromtimestamp(timestamp or time.time()).strftime("%H:%M:%S")
+
+
+def _preview_source(message: Dict[str, Any]) -> str:
+    """Where an image message's preview comes from: the sent file, a thumbnail or the file itself."""
+    return message.get('preview_path') or message.get('thumbnail_url') or message['file_url']
+
+
+def _file_label(message: Dict[str, Any]) -> str:
+    """Icon and name of a file message."""
+    return f"{'📷' if message.get('is_image') else '📎'} {message.get('filename', '')}"
+
+
 class ChatView(QWidget):
     """Widget for displaying and sending chat messages."""
     
@@ -24,6 +399,16 @@ class ChatView(QWidget):
         self.messages = []
         self.download_button = None
         self.current_file_url = None
+        self.upload_in_progress = False
+        # Called with (room, sequence number) for the cached messages before it
+        self.history_source: Optional[Callable[[str, int], List[Dict[str, Any]]]] = None
+        # Called with (room, sequence number) for the cached messages after it,
+        # up to the room's loaded history
+        self.newer_source: Optional[Callable[[str, int], List[Dict[str, Any]]]] = None
+        self.detached_room: Optional[str] = None  # Room whose old history is shown instead of its live list
+        
+        # Image previews, loaded as their rows are painted
+        self.previews = PreviewLoader(self)
         
         self._setup_ui()
         
@@ -35,20 +420,31 @@ class ChatView(QWidget):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(5, 5, 5, 5)
         
-        # Message display area
-        self.message_display = QTextEdit()
-        self.message_display.setReadOnly(True)
-        # Note: QTextEdit doesn't have setOpenExternalLinks, links will be clickable in HTML
-        self.message_display.setStyleSheet("""
-            QTextEdit {
+        # Message display area: only the visible rows are laid out and painted.
+        # Recently shown rooms keep their model, so switching back is a swap
+        self.room_models: OrderedDict = OrderedDict()  # room -> MessageListModel
+        self.message_model = MessageListModel(self)
+        self.message_model.set_messages(self.messages)
+        self.message_list = QListView()
+        self.message_list.setModel(self.message_model)
+        self.message_delegate = MessageDelegate(self)
+        self.message_list.setItemDelegate(self.message_delegate)
+        self.message_list.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.message_list.setLayoutMode(QListView.Batched)
+        self.message_list.setBatchSize(PAGE_ROWS)
+        self.message_list.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.message_list.clicked.connect(self._on_message_clicked)
+        self.message_list.doubleClicked.connect(self._on_message_activated)
+        self.message_list.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+        self.message_list.setStyleSheet("""
+            QListView {
                 background-color: #2b2b2b;
                 color: #ffffff;
                 border: 1px solid #3c3c3c;
-                font-family: 'Consolas', 'Monaco', monospace;
-                font-size: 12px;
             }
         """)
-        layout.addWidget(self.message_display)
+        layout.addWidget(self.message_list)
+        self.previews.preview_ready.connect(self.message_list.viewport().update)
         
         # Input area
         input_layout = QHBoxLayout()
@@ -187,18 +583,27 @@ class ChatView(QWidget):
     def update_download_button(self, file_url: str):
         """Update download button with new file URL."""
         self.current_file_url = file_url
-        display_url = file_url.split('/')[-1]  # Show just the filename
+        display_url = unquote(file_url.split('?')[0].split('/')[-1])  # Show just the filename
         self.download_url_label.setText(display_url)
         self.download_url_label.setStyleSheet("color: #28a745; font-size: 10px; font-weight: bold;")
         self.download_button.setEnabled(True)
     
+    def set_download_progress(self, received: int, total: int):
+        """Show progress of the running download next to the download button."""
+        filename = unquote((self.current_file_url or '').split('?')[0].split('/')[-1])
+        if total > 0:
+            percent = min(100, received * 100 // total)
+            self.download_url_label.setText(f"{filename} - {percent}%")
+        else:
+            self.download_url_label.setText(f"{filename} - {received // 1024} KB")
+    
     def set_username(self, username: str):
         """Set the current username."""
         self.username = username
         self.username_label.setText(f"{username}: ")
         logger.info(f"Username set: {username}")
     
-    def add_message(self, user: str, text: str, timestamp: float = 0):
+    def add_message(self, user: str, text: str, timestamp: float = 0, message_id: Optional[str] = None):
         """
         Add a message to the display.
         
@@ -206,51 +611,192 @@ class ChatView(QWidget):
             user: Username
             text: Message text
             timestamp: Message timestamp
+            message_id: Client ID of a message being sent (shown as pending until delivered)
         """
-        # Format timestamp
-        if timestamp > 0:
-            dt = datetime.fromtimestamp(timestamp)
-            time_str = dt.strftime("%H:%M:%S")
+        message = {
+            'user': user,
+            'text': text,
+            'timestamp': timestamp or time.time()
+        }
+        if message_id:
+            message.update(id=message_id, pending=True)
+        if self.detached_room is not None:
+            self._return_to_live()
+        self._append([message])
+    
+    def set_messages(self, messages: List[Dict[str, Any]]):
+        """Show a message list in the current model (shared, not copied), scrolled to the end."""
+        self.messages = messages
+        self.message_delegate.clear_cache()
+        self.message_model.set_messages(self.messages)
+        self.message_list.scrollToBottom()
+    
+    def show_room(self, room: str, messages: List[Dict[str, Any]]):
+        """
+        Switch the display to a room.
+        
+        A room shown recently gets its model back where it was scrolled to.
+        Other rooms get a new model over their message list (shared, not
+        copied) exposing only the last page; older pages load on scroll.
+        
+        Args:
+            room: Room name
+            messages: The room's messages, oldest first
+        """
+        scrollbar = self.message_list.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - ROW_PADDING
+        self.message_model.scroll_value = None if at_bottom else scrollbar.value()
+        self.detached_room = None
+        
+        model = self.room_models.get(room)
+        if model is None or model.messages is not messages:
+            replaced = self.room_models.pop(room, None)
+            model = MessageListModel(self, room)
+            model.fetch_older = partial(self._fetch_older, room)
+            model.set_messages(messages, rows=PAGE_ROWS)
+            self.room_models[room] = model
+            if replaced is not None:
+                replaced.deleteLater()  # Its list was replaced; deleted once the view lets go of it
+            while len(self.room_models) > ROOM_MODEL_CACHE_SIZE:
+                _, evicted = self.room_models.popitem(last=False)
+                evicted.deleteLater()
+        else:
+            self.room_models.move_to_end(room)
+            model.catch_up()
+        
+        self.messages = messages
+        self._set_model(model)
+        
+        if model.scroll_value is None:
+            self.message_list.scrollToBottom()
         else:
-            time_str = datetime.now().strftime("%H:%M:%S")
-        
-        # Determine color based on user
-        color = "#4ec9b0" if user == self.username else "#9cdcfe"
-        
-        # Format message
-        message_html = f"""
-        <div style="margin: 5px 0;">
-            <span style="color: {color}; font-weight: bold;">{user}</span>
-            <span style="color: #888; font-size: 10px;"> ({time_str})</span>
-            <br>
-            <span style="color: #ffffff;">{self._escape_html(text)}</span>
-        </div>
+            scrollbar.setValue(model.scroll_value)
+    
+    def show_detached(self, room: str, messages: List[Dict[str, Any]], position: int):
         """
+        Show a stretch of a room's old history around a message.
         
-        # Add to display
-        self.message_display.append(message_html)
+        The stretch is not joined to the room's loaded history: it pages
+        in older and newer messages from the history sources as it is
+        scrolled, and gives way to the live list once it reaches it (or
+        when a message is sent). Received messages go to the live list
+        meanwhile.
         
-        # Store in messages list
-        self.messages.append({
-            'user': user,
-            'text': text,
-            'timestamp': timestamp
-        })
+        Args:
+            room: Room name (the room shown)
+            messages: Messages around the one to show, oldest first
+            position: Index of the message to show in ``messages``
+        """
+        model = MessageListModel(self, room)
+        model.fetch_older = partial(self._fetch_older, room)
+        model.fetch_newer = partial(self._fetch_newer, room)
+        model.set_messages(messages, rows=len(messages))
+        self.detached_room = room
+        self._set_model(model)
+        self.scroll_to_message(position)
+    
+    def _return_to_live(self):
+        """Leave a detached history for the room's live list, scrolled to the end."""
+        room = self.detached_room
+        model = self.room_models.get(room)
+        if model is not None:
+            model.scroll_value = None
+        self.show_room(room, self.messages)
+    
+    def _set_model(self, model: MessageListModel):
+        """Put a model in the list view (a detached one being replaced is deleted)."""
+        if model is self.message_model:
+            return
+        previous = self.message_model
+        self.message_model = model
+        selection = self.message_list.selectionModel()
+        self.message_list.setModel(model)
+        selection.deleteLater()
+        if previous.fetch_newer is not None:
+            previous.deleteLater()
+    
+    def add_room_messages(self, room: str, history: List[Dict[str, Any]],
+                          messages: List[Dict[str, Any]]):
+        """
+        Add messages to the history of a room that is not shown.
         
-        # Auto-scroll to bottom
-        scrollbar = self.message_display.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+        A room with a live model adds them through it; other histories are
+        trimmed to ``HISTORY_LIMIT`` directly.
+        """
+        model = self.room_models.get(room)
+        if model is not None and model.messages is history:
+            model.extend(messages, follow=False)
+        else:
+            history.extend(messages)
+            del history[:max(0, len(history) - HISTORY_LIMIT)]
     
-    def _escape_html(self, text: str) -> str:
-        """Escape HTML special characters."""
-        return (text
-                .replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace('"', "&quot;")
-                .replace("'", "&#x27;"))
+    def _fetch_older(self, room: str, before_seq: int) -> List[Dict[str, Any]]:
+        """Get the page of messages before a sequence number from the history source."""
+        return self.history_source(room, before_seq) if self.history_source else []
     
+    def _fetch_newer(self, room: str, after_seq: int) -> List[Dict[str, Any]]:
+        """Get the page of messages after a sequence number from the history source."""
+        return self.newer_source(room, after_seq) if self.newer_source else []
     
+    def scroll_to_message(self, position: int):
+        """Scroll to a message of the shown list and select it."""
+        index = self.message_model.index(self.message_model.reveal(position))
+        self.message_list.scrollTo(index, QAbstractItemView.PositionAtCenter)
+        self.message_list.setCurrentIndex(index)
+    
+    def add_messages(self, messages: List[Dict[str, Any]]):
+        """
+        Add a batch of received messages with one model update and one scroll.
+        
+        Args:
+            messages: Message dicts as stored in room histories, oldest first
+        """
+        messages = [{**m, 'timestamp': m.get('timestamp') or time.time()} for m in messages]
+        if self.detached_room is not None:
+            self.add_room_messages(self.detached_room, self.messages, messages)
+        else:
+            self._append(messages)
+        files = [m for m in messages if m.get('type') == 'file']
+        if files and self.download_button:
+            self.update_download_button(files[-1]['file_url'])
+    
+    def _append(self, messages: List[Dict[str, Any]]):
+        """Add message rows, following them if the view is at the bottom."""
+        scrollbar = self.message_list.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - ROW_PADDING
+        self.message_model.extend(messages, follow=at_bottom)
+        if at_bottom:
+            self.message_list.scrollToBottom()
+    
+    def _on_scrolled(self, value: int):
+        """Load older messages when scrolled to the top (and leave a detached history at its end)."""
+        scrollbar = self.message_list.verticalScrollBar()
+        if self.detached_room is not None and value >= scrollbar.maximum() > scrollbar.minimum():
+            if not self.message_model.canFetchMore():
+                self._return_to_live()
+            return
+        if value > scrollbar.minimum():
+            return
+        anchor = self.message_list.indexAt(QPoint(0, 0))
+        count = self.message_model.load_older()
+        if count and anchor.isValid():
+            # Keep the row that was at the top where it was
+            self.message_list.scrollTo(self.message_model.index(anchor.row() + count),
+                                       QAbstractItemView.PositionAtTop)
+    
+    def _on_message_clicked(self, index: QModelIndex):
+        """Offer a clicked file message for download."""
+        message = self.message_model.message(index)
+        if message.get('type') == 'file' and message['file_url']:
+            self.update_download_button(message['file_url'])
+    
+    def _on_message_activated(self, index: QModelIndex):
+        """Download a double-clicked file message."""
+        message = self.message_model.message(index)
+        if message.get('type') == 'file' and message['file_url']:
+            window = self.window()
+            if hasattr(window, 'download_file'):
+                window.download_file(message['file_url'])
     
     def _on_send_clicked(self):
         """Handle send button click or Enter key."""
@@ -267,6 +813,12 @@ class ChatView(QWidget):
     
     def _on_attach_clicked(self):
         """Handle attach file button click."""
+        if self.upload_in_progress:
+            window = self.window()
+            if hasattr(window, 'cancel_uploads'):
+                window.cancel_uploads()
+            return
+        
         try:
             # Use native=False to avoid Windows dialog issues
             file_path, _ = QFileDialog.getOpenFileName(
@@ -284,94 +836,69 @@ class ChatView(QWidget):
             self.add_message("System", f"Error opening file dialog: {e}", 0)
     
     def _send_file(self, file_path: str):
-        """Send a file."""
+        """Send a file (the upload streams it from disk in the background)."""
         file_path_obj = Path(file_path)
         filename = file_path_obj.name
         
-        # Read file
-        try:
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            # Check if it's an image
-            is_image = file_path_obj.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']
-            
-            # Show file in chat immediately
-            self.add_message(self.username, f"[FILE] {filename}", 0)
-            
-            # Get parent window to send message
-            window = self.window()
-            if hasattr(window, 'send_file'):
-                window.send_file(filename, file_data, is_image)
-            
-            logger.info(f"Attached file: {filename}")
+        # Check if it's an image
+        is_image = file_path_obj.suffix.lower() in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']
         
-        except Exception as e:
-            logger.error(f"Error reading file: {e}")
-            self.add_message("System", f"Error: Could not read file - {e}", 0)
-    
-    def add_file_message(self, user: str, filename: str, file_url: str, is_image: bool, timestamp: float = 0):
-        """Add a file message to the display."""
-        if timestamp > 0:
-            dt = datetime.fromtimestamp(timestamp)
-            time_str = dt.strftime("%H:%M:%S")
-        else:
-            time_str = datetime.now().strftime("%H:%M:%S")
-        
-        color = "#4ec9b0" if user == self.username else "#9cdcfe"
-        
-        # Create a clickable download link
-        download_link = f"file://download/{filename}"
-        
-        if is_image:
-            # For images, show filename with download link
-            message_html = f"""
-            <div style="margin: 5px 0;">
-                <span style="color: {color}; font-weight: bold;">{user}</span>
-                <span style="color: #888; font-size: 10px;"> ({time_str})</span>
-                <br>
-                <span style="color: #888;">📷 {self._escape_html(filename)}</span>
-                <br>
-                <a href="{download_link}" style="color: #28a745; text-decoration: underline; cursor: pointer;">📥 Download</a>
-            </div>
-            """
-        else:
-            # For other files
-            message_html = f"""
-            <div style="margin: 5px 0;">
-                <span style="color: {color}; font-weight: bold;">{user}</span>
-                <span style="color: #888; font-size: 10px;"> ({time_str})</span>
-                <br>
-                <span style="color: #888;">📎 {self._escape_html(filename)}</span>
-                <br>
-                <a href="{download_link}" style="color: #28a745; text-decoration: underline; cursor: pointer;">📥 Download</a>
-            </div>
-            """
-        
-        # Add to display
-        self.message_display.append(message_html)
-        
-        # Update last download button
-        if self.download_button:
-            self.update_download_button(file_url)
+        # Show file in chat immediately
+        self.add_message(self.username, f"[FILE] {filename}", 0)
+        
+        # Get parent window to send message
+        window = self.window()
+        if hasattr(window, 'send_file'):
+            window.send_file(file_path, is_image)
+        
+        logger.info(f"Attached file: {filename}")
+    
+    def set_upload_progress(self, sent: Optional[int], total: Optional[int]):
+        """
+        Show upload progress on the attach button.
+        
+        While an upload runs the button shows a percentage and cancels the
+        upload when clicked. Pass None to restore it.
+        """
+        if sent is None:
+            self.upload_in_progress = False
+            self.attach_button.setText("📎")
+            self.attach_button.setToolTip("Attach file")
+            return
+        
+        self.upload_in_progress = True
+        percent = min(100, sent * 100 // total) if total else 0
+        self.attach_button.setText(f"{percent}%")
+        self.attach_button.setToolTip("Cancel upload")
+    
+    def add_file_message(self, user: str, filename: str, file_url: str, is_image: bool, timestamp: float = 0,
+                         preview_path: Optional[str] = None, message_id: Optional[str] = None):
+        """
+        Add a file message to the display.
         
-        # Store in messages list with file data for download
-        self.messages.append({
+        Args:
+            preview_path: Local copy of an image to preview instead of downloading it
+            message_id: Client ID of a message being sent (shown as pending until delivered)
+        """
+        message = {
             'user': user,
             'type': 'file',
             'filename': filename,
             'file_url': file_url,
             'is_image': is_image,
-            'timestamp': timestamp
-        })
-        
-        # Auto-scroll
-        scrollbar = self.message_display.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+            'timestamp': timestamp or time.time()
+        }
+        if preview_path:
+            message['preview_path'] = preview_path
+        if message_id:
+            message.update(id=message_id, pending=True)
+        self._append([message])
+        
+        # Update last download button (a file being sent has no link yet)
+        if self.download_button and file_url:
+            self.update_download_button(file_url)
     
     def clear(self):
-        """Clear all messages (for room switching)."""
-        self.message_display.clear()
-        self.messages.clear()
+        """Clear all messages."""
+        self.set_messages([])
         logger.info("Chat view cleared")
-
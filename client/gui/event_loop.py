@@ -0,0 +1,148 @@
+"""asyncio event loop running inside the Qt event loop, on the GUI thread."""
+
+import asyncio
+import math
+import os
+import selectors
+from concurrent.futures import ThreadPoolExecutor
+from PySide6.QtCore import QCoreApplication, QSocketNotifier, QTimer, Qt
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Threads for blocking and CPU-heavy work (asyncio.to_thread, run_in_executor)
+EXECUTOR_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+
+class _QtSelector(selectors.BaseSelector):
+    """
+    Selector whose waiting is done by Qt.
+
+    File descriptors are watched with socket notifiers that wake the
+    asyncio loop; ``select`` itself never blocks.
+    """
+
+    def __init__(self, on_ready):
+        self._selector = selectors.DefaultSelector()
+        self._notifiers = {}  # {fd: [QSocketNotifier]}
+        self._on_ready = on_ready
+
+    def register(self, fileobj, events, data=None):
+        key = self._selector.register(fileobj, events, data)
+        notifiers = []
+        for event, kind in ((selectors.EVENT_READ, QSocketNotifier.Read),
+                            (selectors.EVENT_WRITE, QSocketNotifier.Write)):
+            if events & event:
+                notifier = QSocketNotifier(key.fd, kind)
+                notifier.activated.connect(self._on_ready)
+                notifiers.append(notifier)
+        self._notifiers[key.fd] = notifiers
+        return key
+
+    def unregister(self, fileobj):
+        key = self._selector.unregister(fileobj)
+        for notifier in self._notifiers.pop(key.fd, ()):
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        return key
+
+    def select(self, timeout=None):
+        return self._selector.select(0)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        for fd in list(self._notifiers):
+            self.unregister(fd)
+        self._selector.close()
+
+
+class QtEventLoop(asyncio.SelectorEventLoop):
+    """
+    asyncio event loop sharing the GUI thread with Qt.
+
+    Qt does all the waiting: socket notifiers and a timer step the asyncio
+    loop when it has something to do, and Qt handles input and painting
+    in between. Coroutines can therefore touch widgets directly, with no
+    thread hop or signal per result. Blocking and CPU-heavy work must go
+    to the loop's executor (``asyncio.to_thread``), never run inline.
+
+    A QApplication must exist before the loop is created. The loop runs
+    Qt through ``QApplication.exec()``, so Qt's own quit paths work:
+    ``run_forever`` returns when ``stop`` is called, when the last window
+    is closed (if the application quits on last window closed) or when
+    ``QApplication.quit()`` is called.
+    """
+
+    def __init__(self):
+        self._step_timer = QTimer()
+        self._step_timer.setSingleShot(True)
+        self._step_timer.setTimerType(Qt.PreciseTimer)  # Audio frames are 20 ms apart
+        self._step_timer.timeout.connect(self._step)
+        self._stepping = False
+        # Qt's own quit paths end run_forever too
+        self._app = QCoreApplication.instance()
+        self._app.aboutToQuit.connect(self._on_qt_quit)
+        if hasattr(self._app, "lastWindowClosed"):
+            self._app.lastWindowClosed.connect(self._on_last_window_closed)
+        super().__init__(_QtSelector(self._wake))
+        self.set_default_executor(ThreadPoolExecutor(EXECUTOR_WORKERS, thread_name_prefix="blocking"))
+
+    def _wake(self, *args):
+        """Step asyncio as soon as Qt is idle (a watched socket is ready)."""
+        if not self._step_timer.isActive() or self._step_timer.remainingTime() > 0:
+            self._step_timer.start(0)
+
+    def _on_qt_quit(self):
+        """Stop run_forever (at the next step)."""
+        if self.is_running():
+            self.stop()
+            self._wake()
+
+    def _on_last_window_closed(self):
+        if self._app.quitOnLastWindowClosed():
+            self._on_qt_quit()
+
+    def _run_once(self):
+        """Hand the waiting over to Qt (called in a loop by run_forever)."""
+        self._wake()
+        self._app.exec()
+        if not self._stopping:
+            self.stop()  # Qt quit on its own
+
+    def _step(self):
+        """Run the asyncio callbacks that are due, then arm the timer for the next ones."""
+        if self._stepping:
+            # A callback opened a nested Qt loop (a modal dialog): the timer
+            # is re-armed once it returns, and ready sockets keep notifying
+            return
+        self._stepping = True
+        try:
+            super()._run_once()
+        except Exception as e:
+            logger.error(f"Event loop step failed: {e}")
+        finally:
+            self._stepping = False
+
+        if self._stopping:
+            self._app.exit()
+            return
+        # Callbacks that just ran may have scheduled more
+        if self._ready:
+            self._step_timer.start(0)
+        elif self._scheduled:
+            timeout = self._scheduled[0].when() - self.time()
+            self._step_timer.start(max(0, math.ceil(timeout * 1000)))
+
+    def close(self):
+        if self.is_running():
+            raise RuntimeError("Cannot close a running event loop")
+        if not self.is_closed():
+            self._step_timer.stop()
+            self._app.aboutToQuit.disconnect(self._on_qt_quit)
+            if hasattr(self._app, "lastWindowClosed"):
+                self._app.lastWindowClosed.disconnect(self._on_last_window_closed)
+        super().close()
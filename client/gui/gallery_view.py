@@ -0,0 +1,194 @@
+"""Room file gallery with lazily loaded pages."""
+
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QListWidget, QListWidgetItem
+from PySide6.QtCore import Qt, Signal
+from typing import Optional
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Fetch the next page when the scrollbar is this close to the bottom (pixels)
+LOAD_MORE_THRESHOLD = 200
+PAGE_SIZE = 50
+
+FILE_TYPE_FILTERS = [
+    ("All files", None),
+    ("Images", "image"),
+    ("Documents", "document"),
+    ("Other", "other"),
+]
+
+TYPE_ICONS = {
+    "image": "📷",
+    "document": "📄",
+    "other": "📎",
+}
+
+
+class GalleryView(QWidget):
+    """
+    Lists the attachments of the current room.
+    
+    Pages are requested from the server only when the gallery is visible and
+    the user scrolls near the end of what has been loaded.
+    """
+    
+    # Emitted to ask the app window for a page: room, cursor (or None), file type (or "")
+    load_requested = Signal(str, object, str)
+    # Emitted when the user opens a file: server-relative file URL
+    file_activated = Signal(str)
+    
+    def __init__(self):
+        """Initialize gallery view."""
+        super().__init__()
+        
+        self.room: Optional[str] = None
+        self.next_cursor: Optional[int] = None
+        self.has_more = True
+        self.is_loading = False
+        
+        self._setup_ui()
+    
+    def _setup_ui(self):
+        """Set up the UI layout."""
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(5, 5, 5, 5)
+        
+        # Filter row
+        filter_layout = QHBoxLayout()
+        
+        self.title_label = QLabel("Files")
+        self.title_label.setStyleSheet("color: #888; font-weight: bold;")
+        filter_layout.addWidget(self.title_label)
+        filter_layout.addStretch()
+        
+        self.type_filter = QComboBox()
+        for label, file_type in FILE_TYPE_FILTERS:
+            self.type_filter.addItem(label, file_type)
+        self.type_filter.currentIndexChanged.connect(self._on_filter_changed)
+        filter_layout.addWidget(self.type_filter)
+        
+        layout.addLayout(filter_layout)
+        
+        # File list
+        self.file_list = QListWidget()
+        self.file_list.setUniformItemSizes(True)
+        self.file_list.itemDoubleClicked.connect(self._on_item_activated)
+        self.file_list.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+        self.file_list.setStyleSheet("""
+            QListWidget {
+                background-color: #2b2b2b;
+                color: #ffffff;
+                border: 1px solid #3c3c3c;
+                font-size: 12px;
+            }
+            QListWidget::item {
+                padding: 6px;
+            }
+            QListWidget::item:selected {
+                background-color: #0078d4;
+            }
+        """)
+        layout.addWidget(self.file_list)
+        
+        # Status line
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("color: #888; font-size: 10px;")
+        layout.addWidget(self.status_label)
+    
+    def set_room(self, room: str):
+        """Switch the gallery to another room (pages are fetched lazily)."""
+        if room == self.room:
+            return
+        self.room = room
+        self.title_label.setText(f"Files in {room}")
+        self._reset()
+        if self.isVisible():
+            self._request_page()
+    
+    def add_page(self, room: str, file_type: str, result: dict):
+        """
+        Append a page returned by the server.
+        
+        Args:
+            room: Room the page was requested for
+            file_type: Type filter the page was requested with
+            result: Response data from the room files endpoint
+        """
+        if room != self.room or file_type != self._file_type():
+            return  # Stale response for a room or filter we already left
+        
+        self.is_loading = False
+        
+        if result.get('error'):
+            self.status_label.setText(f"Could not load files: {result['error']}")
+            return
+        
+        for file_info in result.get('files', []):
+            self.file_list.addItem(self._make_item(file_info))
+        
+        self.next_cursor = result.get('next_cursor')
+        self.has_more = self.next_cursor is not None
+        self.status_label.setText(
+            f"{self.file_list.count()} file(s)" + (" - scroll for more" if self.has_more else "")
+        )
+        
+        # Keep loading until the viewport is filled
+        if self.has_more and self.file_list.verticalScrollBar().maximum() == 0:
+            self._request_page()
+    
+    def _make_item(self, file_info: dict) -> QListWidgetItem:
+        """Create a list row for one file."""
+        icon = TYPE_ICONS.get(file_info.get('type'), TYPE_ICONS['other'])
+        size_kb = max(1, file_info.get('file_size', 0) // 1024)
+        item = QListWidgetItem(
+            f"{icon} {file_info.get('file_name', 'file')}    "
+            f"{file_info.get('uploader', '')} - {size_kb} KB"
+        )
+        item.setData(Qt.UserRole, file_info.get('file_url'))
+        return item
+    
+    def _reset(self):
+        """Forget loaded pages."""
+        self.file_list.clear()
+        self.next_cursor = None
+        self.has_more = True
+        self.is_loading = False
+        self.status_label.setText("")
+    
+    def _request_page(self):
+        """Ask for the next page if one is available and none is pending."""
+        if not self.room or self.is_loading or not self.has_more:
+            return
+        self.is_loading = True
+        self.status_label.setText("Loading...")
+        self.load_requested.emit(self.room, self.next_cursor, self._file_type())
+    
+    def _file_type(self) -> str:
+        """Get the selected type filter ("" for all files)."""
+        return self.type_filter.currentData() or ""
+    
+    def _on_scrolled(self, value: int):
+        """Load the next page when the user nears the end of the list."""
+        scrollbar = self.file_list.verticalScrollBar()
+        if value >= scrollbar.maximum() - LOAD_MORE_THRESHOLD:
+            self._request_page()
+    
+    def _on_filter_changed(self, index: int):
+        """Reload from the first page with the new type filter."""
+        self._reset()
+        self._request_page()
+    
+    def _on_item_activated(self, item: QListWidgetItem):
+        """Open (download) the double-clicked file."""
+        file_url = item.data(Qt.UserRole)
+        if file_url:
+            self.file_activated.emit(file_url)
+    
+    def showEvent(self, event):
+        """Fetch the first page the first time the gallery becomes visible."""
+        super().showEvent(event)
+        if self.file_list.count() == 0:
+            self._request_page()
@@ -0,0 +1,306 @@
+"""Image previews for chat rows: decoded off the GUI thread, cached in memory and on disk."""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Callable, Awaitable
+from urllib.parse import urlsplit
+from PySide6.QtCore import QObject, Signal, QBuffer, QByteArray, QIODevice, QSize, Qt
+from PySide6.QtGui import QImage, QImageReader, QPixmap
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+PREVIEW_WIDTH = 240  # Previews fit in this box (pixels)
+PREVIEW_HEIGHT = 160
+PIXMAP_CACHE_BYTES = 48 * 1024 * 1024  # Decoded previews kept in memory
+DECODE_WORKERS = 2  # Threads decoding and downscaling images
+MAX_CONCURRENT_LOADS = 4
+MAX_PENDING_LOADS = 64  # Older requests were for rows scrolled away; they are dropped
+MAX_SOURCE_BYTES = 32 * 1024 * 1024  # Larger images get no preview
+MAX_SOURCE_PIXELS = 24_000_000  # Neither do images claiming more pixels (decompression bombs)
+DISK_CACHE_BYTES = 64 * 1024 * 1024  # Preview files kept on disk
+FAILED_RETRY_SECONDS = 60  # A failed preview is tried again after this long
+
+
+def preview_key(source: str) -> str:
+    """Cache key of an image: its URL without the (expiring) signature, or its path."""
+    parts = urlsplit(source)
+    if parts.scheme in ("http", "https"):
+        return parts._replace(query="", fragment="").geturl()
+    return source
+
+
+def decode_preview(data: bytes, size: QSize = QSize(PREVIEW_WIDTH, PREVIEW_HEIGHT)) -> QImage:
+    """
+    Decode an image scaled down to fit a box (worker thread).
+
+    The size in the image header is checked before anything is decoded.
+    JPEG images are scaled while decoding, so large photos are never
+    decoded at full size.
+
+    Raises:
+        ValueError: The data is not a readable image, or claims more than
+            ``MAX_SOURCE_PIXELS`` pixels
+    """
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    reader.setAutoTransform(True)
+    full_size = reader.size()
+    if not full_size.isValid():
+        raise ValueError(f"unknown image size: {reader.errorString()}")
+    if full_size.width() * full_size.height() > MAX_SOURCE_PIXELS:
+        raise ValueError(f"image too large ({full_size.width()}x{full_size.height()})")
+    if full_size.width() > size.width() or full_size.height() > size.height():
+        reader.setScaledSize(full_size.scaled(size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        raise ValueError(reader.errorString())
+    if image.width() > size.width() or image.height() > size.height():
+        image = image.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return _pixmap_format(image)
+
+
+def _pixmap_format(image: QImage) -> QImage:
+    """Convert an image to the format pixmaps are made from without conversion."""
+    if image.hasAlphaChannel():
+        return image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    return image.convertToFormat(QImage.Format_RGB32)
+
+
+class PixmapCache:
+    """Least recently used pixmaps, within a budget of decoded bytes."""
+
+    def __init__(self, budget: int = PIXMAP_CACHE_BYTES):
+        self.budget = budget
+        self.size = 0  # Bytes held
+        self._pixmaps: OrderedDict = OrderedDict()  # key -> (pixmap, bytes)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pixmaps
+
+    def __len__(self) -> int:
+        return len(self._pixmaps)
+
+    def get(self, key: str) -> Optional[QPixmap]:
+        """Get a pixmap, marking it as recently used."""
+        entry = self._pixmaps.get(key)
+        if entry is None:
+            return None
+        self._pixmaps.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, pixmap: QPixmap):
+        """Add a pixmap, evicting the least recently used ones beyond the budget."""
+        cost = pixmap.width() * pixmap.height() * max(1, pixmap.depth() // 8)
+        old = self._pixmaps.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self._pixmaps[key] = (pixmap, cost)
+        self.size += cost
+        while self.size > self.budget and len(self._pixmaps) > 1:
+            _, (_, evicted) = self._pixmaps.popitem(last=False)
+            self.size -= evicted
+
+
+class DiskCache:
+    """
+    Preview files on disk, least recently used removed beyond a byte budget.
+
+    The files are indexed by modification time on first use; reading a
+    file touches it. Used from the decode threads.
+    """
+
+    def __init__(self, directory: Path, budget: int = DISK_CACHE_BYTES):
+        self.directory = directory
+        self.budget = budget
+        self.size = 0  # Bytes held
+        self._files: Optional[OrderedDict] = None  # name -> bytes, oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Path]:
+        """Path of a cached preview, marking it as recently used."""
+        name = self._name(key)
+        with self._lock:
+            files = self._index()
+            if name not in files:
+                return None
+            files.move_to_end(name)
+        path = self.directory / name
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, image: QImage):
+        """Save a preview, removing the least recently used ones beyond the budget."""
+        name = self._name(key)
+        path = self.directory / name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        # Photos as JPEG (small, quick to decode); PNG keeps transparency
+        if not image.save(str(tmp_path), "PNG" if image.hasAlphaChannel() else "JPG", 85):
+            return
+        cost = tmp_path.stat().st_size
+        tmp_path.replace(path)
+        with self._lock:
+            files = self._index()
+            self.size += cost - files.pop(name, 0)
+            files[name] = cost
+            evicted = []
+            while self.size > self.budget and len(files) > 1:
+                old, old_cost = files.popitem(last=False)
+                self.size -= old_cost
+                evicted.append(old)
+        for old in evicted:
+            (self.directory / old).unlink(missing_ok=True)
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _index(self) -> OrderedDict:
+        """Files on disk by age (built on first use, with the lock held)."""
+        if self._files is None:
+            entries = []
+            if self.directory.is_dir():
+                for path in self.directory.iterdir():
+                    if path.suffix != ".tmp" and path.is_file():
+                        stat = path.stat()
+                        entries.append((stat.st_mtime, path.name, stat.st_size))
+            entries.sort()
+            self._files = OrderedDict((name, cost) for _, name, cost in entries)
+            self.size = sum(self._files.values())
+        return self._files
+
+
+class PreviewLoader(QObject):
+    """
+    Loads image previews for the rows being painted.
+
+    ``preview()`` returns a cached pixmap or starts loading one: from the
+    disk cache, else from the image's local path or URL (through
+    ``fetch``). Decoding and downscaling run on a small thread pool; only
+    the final, small QImage is turned into a pixmap on the GUI thread.
+    The newest requests are served first, since they are for the rows
+    just scrolled into view. A preview that failed (an expired link, a
+    dropped connection) is tried again after ``FAILED_RETRY_SECONDS``.
+    """
+
+    # One or more previews were added to the cache
+    preview_ready = Signal()
+
+    def __init__(self, parent: Optional[QObject] = None, cache_dir: Optional[Path] = None):
+        super().__init__(parent)
+        if cache_dir is None:
+            from client.core.cache import default_cache_dir
+            cache_dir = default_cache_dir()
+        self.disk = DiskCache(Path(cache_dir) / "previews")
+        self.pixmaps = PixmapCache()
+        self.fetch: Optional[Callable[[str], Awaitable[bytes]]] = None  # Downloads a URL
+        self._wanted: OrderedDict = OrderedDict()  # key -> source, oldest first
+        self._loading = set()
+        self._failed = {}  # key -> time of the failure
+        self._tasks = set()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def preview(self, source: str) -> Optional[QPixmap]:
+        """
+        Get the preview of an image, or None while it loads.
+
+        Args:
+            source: Local path or URL of the image
+        """
+        key = preview_key(source)
+        pixmap = self.pixmaps.get(key)
+        remote = urlsplit(source).scheme in ("http", "https")
+        if remote and self.fetch is None:
+            return pixmap  # Loaded once connected
+        if pixmap is None and key not in self._loading and not self._recently_failed(key):
+            self._wanted[key] = source
+            self._wanted.move_to_end(key)
+            while len(self._wanted) > MAX_PENDING_LOADS:
+                self._wanted.popitem(last=False)
+            self._start_loads()
+        return pixmap
+
+    def _recently_failed(self, key: str) -> bool:
+        """Whether a preview failed too recently to be tried again."""
+        failed_at = self._failed.get(key)
+        if failed_at is None:
+            return False
+        if time.monotonic() - failed_at < FAILED_RETRY_SECONDS:
+            return True
+        del self._failed[key]
+        return False
+
+    def close(self):
+        """Stop loading previews."""
+        self._wanted.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _start_loads(self):
+        """Start the newest wanted loads, up to the concurrency limit."""
+        while self._wanted and len(self._loading) < MAX_CONCURRENT_LOADS:
+            key, source = self._wanted.popitem(last=True)
+            self._loading.add(key)
+            task = asyncio.ensure_future(self._load(key, source))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _load(self, key: str, source: str):
+        """Load one preview into the pixmap cache."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="preview")
+        loop = asyncio.get_running_loop()
+        image = None
+        try:
+            image = await loop.run_in_executor(self._pool, self._read_cached, key)
+            if image is None:
+                if urlsplit(source).scheme in ("http", "https"):
+                    data = await self.fetch(source)
+                else:
+                    data = await loop.run_in_executor(self._pool, Path(source).read_bytes)
+                image = await loop.run_in_executor(self._pool, self._decode_and_store, key, data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"No preview for {key}: {e}")
+            self._failed[key] = time.monotonic()
+        finally:
+            self._loading.discard(key)
+
+        if image is not None:
+            self.pixmaps.put(key, QPixmap.fromImage(image))
+            self.preview_ready.emit()
+        self._start_loads()
+
+    def _read_cached(self, key: str) -> Optional[QImage]:
+        """Read a preview from the disk cache (worker thread)."""
+        path = self.disk.get(key)
+        if path is None:
+            return None
+        image = QImage(str(path))
+        return None if image.isNull() else _pixmap_format(image)
+
+    def _decode_and_store(self, key: str, data: bytes) -> QImage:
+        """Decode a preview and save it to the disk cache (worker thread)."""
+        if len(data) > MAX_SOURCE_BYTES:
+            raise ValueError("image too large")
+        image = decode_preview(data)
+        self.disk.put(key, image)
+        return image
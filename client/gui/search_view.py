@@ -0,0 +1,135 @@
+"""Search over the locally cached history of every room."""
+
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QLineEdit, QListWidget, QListWidgetItem
+from PySide6.QtCore import Qt, Signal, QTimer
+from datetime import datetime
+from typing import List, Dict, Any
+from client.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+SEARCH_DELAY_MS = 50  # Typing pause before searching (a search takes about a millisecond)
+
+
+class SearchView(QWidget):
+    """
+    Search box with results that update while typing.
+
+    The search itself runs in the app window, over the message cache; a
+    result is opened in its room by double-clicking it or pressing Enter.
+    """
+
+    # Emitted to ask the app window for results: query
+    search_requested = Signal(str)
+    # Emitted when the user opens a result: room, sequence number
+    message_activated = Signal(str, int)
+
+    def __init__(self):
+        """Initialize search view."""
+        super().__init__()
+
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DELAY_MS)
+        self._search_timer.timeout.connect(self._request_search)
+
+        self._setup_ui()
+
+    def _setup_ui(self):
+        """Set up the UI layout."""
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(5, 5, 5, 5)
+
+        self.query_input = QLineEdit()
+        self.query_input.setPlaceholderText("🔍 Search messages in all rooms...")
+        self.query_input.setClearButtonEnabled(True)
+        self.query_input.textChanged.connect(lambda text: self._search_timer.start())
+        self.query_input.returnPressed.connect(self._on_return_pressed)
+        self.query_input.setStyleSheet("""
+            QLineEdit {
+                background-color: #3c3c3c;
+                color: #ffffff;
+                border: 1px solid #555;
+                padding: 8px;
+                font-size: 12px;
+            }
+            QLineEdit:focus {
+                border: 1px solid #0078d4;
+            }
+        """)
+        layout.addWidget(self.query_input)
+
+        # Result list
+        self.result_list = QListWidget()
+        self.result_list.setUniformItemSizes(True)
+        self.result_list.itemActivated.connect(self._on_item_activated)
+        self.result_list.setStyleSheet("""
+            QListWidget {
+                background-color: #2b2b2b;
+                color: #ffffff;
+                border: 1px solid #3c3c3c;
+                font-size: 12px;
+            }
+            QListWidget::item {
+                padding: 6px;
+            }
+            QListWidget::item:selected {
+                background-color: #0078d4;
+            }
+        """)
+        layout.addWidget(self.result_list)
+
+        # Status line
+        self.status_label = QLabel("")
+        self.status_label.setStyleSheet("color: #888; font-size: 10px;")
+        layout.addWidget(self.status_label)
+
+    def show_results(self, query: str, results: List[Dict[str, Any]]):
+        """
+        Show the results of a search.
+
+        Args:
+            query: Query the results are for
+            results: Matching messages from the cache, newest first
+        """
+        if query != self.query_input.text().strip():
+            return  # Stale results for a query the user already changed
+
+        self.result_list.clear()
+        for message in results:
+            self.result_list.addItem(self._make_item(message))
+        if not query:
+            self.status_label.setText("")
+        else:
+            self.status_label.setText(f"{len(results)} result(s)" if results else "No messages found")
+
+    def _make_item(self, message: Dict[str, Any]) -> QListWidgetItem:
+        """Create a list row for one result."""
+        when = datetime.fromtimestamp(message.get('timestamp') or 0).strftime("%Y-%m-%d %H:%M")
+        item = QListWidgetItem(
+            f"{message['room']}  {message.get('user', '')} ({when}):  {message.get('snippet', '')}"
+        )
+        item.setData(Qt.UserRole, (message['room'], message['seq']))
+        item.setToolTip(message.get('text', ''))
+        return item
+
+    def _request_search(self):
+        """Search for the current query."""
+        self.search_requested.emit(self.query_input.text().strip())
+
+    def _on_return_pressed(self):
+        """Open the first result."""
+        if self.result_list.count():
+            self._on_item_activated(self.result_list.item(0))
+
+    def _on_item_activated(self, item: QListWidgetItem):
+        """Open the activated result in its room."""
+        room, seq = item.data(Qt.UserRole)
+        self.message_activated.emit(room, seq)
+
+    def showEvent(self, event):
+        """Put the cursor in the search box."""
+        super().showEvent(event)
+        self.query_input.setFocus()
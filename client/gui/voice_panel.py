@@ -2,12 +2,23 @@
 
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout
 from PySide6.QtCore import Qt, Signal, QTimer
+from collections import deque
+from typing import List, Optional, TYPE_CHECKING
+import math
 from client.utils.logger import get_logger
 
+if TYPE_CHECKING:
+    from client.core.audio import LevelRing  # numpy, av and aiortc load with the voice stack
+    from client.core.media import VoiceManager
+
 
 logger = get_logger(__name__)
 
 
+METER_BARS = 5
+METER_FLOOR_DB = -60.0  # Levels at or below this show no bars
+
+
 class VoicePanel(QWidget):
     """Voice chat panel with dynamic voice transmission."""
     
@@ -22,6 +33,8 @@ class VoicePanel(QWidget):
         self.is_muted = False
         self.is_enabled = True  # Voice is always-on when enabled
         self.echo_test_active = False
+        self.level_ring: Optional["LevelRing"] = None
+        self.voice_manager: Optional["VoiceManager"] = None
         
         self._setup_ui()
         
@@ -31,7 +44,7 @@ class VoicePanel(QWidget):
         
         self.echo_timer = QTimer()
         self.echo_timer.timeout.connect(self._process_echo)
-        self.echo_buffer = []
+        self.echo_buffer = deque()
     
     def _setup_ui(self):
         """Set up the UI layout."""
@@ -60,6 +73,12 @@ class VoicePanel(QWidget):
         self.room_label.setStyleSheet("color: #888; font-size: 12px;")
         layout.addWidget(self.room_label)
         
+        # Active speakers, as announced by the server
+        self.speakers_label = QLabel("")
+        self.speakers_label.setAlignment(Qt.AlignCenter)
+        self.speakers_label.setStyleSheet("color: #28a745; font-size: 12px; font-weight: bold;")
+        layout.addWidget(self.speakers_label)
+        
         layout.addSpacing(20)
         
         # Mute button
@@ -114,7 +133,7 @@ class VoicePanel(QWidget):
         """)
         layout.addWidget(self.voice_toggle)
         
-        # Voice level indicator (simulated)
+        # Voice level indicator (microphone input)
         self.level_indicator = QLabel("Voice level: ▯▯▯▯▯")
         self.level_indicator.setAlignment(Qt.AlignCenter)
         self.level_indicator.setStyleSheet("color: #888; font-size: 12px; margin-top: 5px;")
@@ -163,6 +182,10 @@ class VoicePanel(QWidget):
         self.room_label.setText(f"Connected to: {room_name}")
         logger.info(f"Voice panel room set to: {room_name}")
     
+    def set_active_speakers(self, names: List[str]):
+        """Highlight the participants currently speaking (loudest first)."""
+        self.speakers_label.setText(f"🗣️ {', '.join(names)}" if names else "")
+    
     def _toggle_mute(self):
         """Toggle mute state."""
         self.is_muted = not self.is_muted
@@ -296,24 +319,50 @@ class VoicePanel(QWidget):
         self.voice_toggled.emit(self.is_enabled)
         logger.info(f"Voice toggled: {self.is_enabled}")
     
+    def set_voice_manager(self, manager: "VoiceManager"):
+        """
+        Drive a voice manager from the panel.
+        
+        The mute button mutes its microphone track, the level meter
+        follows the track from ``start_voice`` on, and the speakers the
+        server announces are shown by name.
+        """
+        self.voice_manager = manager
+        manager.set_muted(self.is_muted)
+        self.mute_toggled.connect(manager.set_muted)
+        manager.on_active_speakers(lambda peers: self.set_active_speakers(manager.speaker_names(peers)))
+    
+    def set_level_ring(self, ring: Optional["LevelRing"]):
+        """Set the microphone level source for the meter (None to clear it)."""
+        self.level_ring = ring
+    
+    def _current_level(self) -> int:
+        """Recent microphone peak as a number of meter bars."""
+        if self.level_ring is None:
+            return 0
+        peak = self.level_ring.peak()
+        if peak <= 0:
+            return 0
+        db = 20 * math.log10(peak)
+        bars = math.ceil((db - METER_FLOOR_DB) / -METER_FLOOR_DB * METER_BARS)
+        return max(0, min(METER_BARS, bars))
+    
     def _check_voice_activity(self):
-        """Simulate voice activity detection."""
-        # In production, this would read from actual microphone input
-        # For now, simulate random voice activity
-        import random
-        if random.random() > 0.7:  # 30% chance of activity
-            self.level_indicator.setText("Voice level: ▮▮▮▮▮")
-        else:
-            self.level_indicator.setText("Voice level: ▮▮▯▯▯")
+        """Update the level meter from the microphone."""
+        level = self._current_level()
+        self.level_indicator.setText(f"Voice level: {'▮' * level}{'▯' * (METER_BARS - level)}")
     
     def start_voice(self):
         """Start voice transmission."""
+        if self.voice_manager is not None:
+            self.set_level_ring(self.voice_manager.input_levels)
         if not self.is_muted and self.is_enabled:
             self.activity_timer.start(100)
     
     def stop_voice(self):
         """Stop voice transmission."""
         self.activity_timer.stop()
+        self.set_level_ring(None)
         self.level_indicator.setText("Voice level: ▯▯▯▯▯")
     
     def _toggle_echo_test(self):
@@ -337,18 +386,15 @@ class VoicePanel(QWidget):
     
     def _process_echo(self):
         """Process echo feedback with 0.5 second delay."""
-        # Simulate capturing audio
-        import random
-        
-        # Simulate current voice level
-        level = random.randint(0, 5)
+        # Current microphone level
+        level = self._current_level()
         level_bars = "▮" * level + "▯" * (5 - level)
         self.level_indicator.setText(f"Voice level: {level_bars}")
         
         # Add to buffer (simulating 0.5s = 25 samples at 20ms intervals)
         self.echo_buffer.append(level)
         if len(self.echo_buffer) > 25:  # 25 * 20ms = 0.5 seconds
-            delayed_level = self.echo_buffer.pop(0)
+            delayed_level = self.echo_buffer.popleft()
             
             # Play back the delayed audio (simulated)
             delayed_level_bars = "▮" * delayed_level + "▯" * (5 - delayed_level)
@@ -1,5 +1,11 @@
 """Main entry point for the client application."""
 
+import time
+
+LAUNCHED = time.perf_counter()  # Start of the --profile-startup timeline
+
+import argparse
+import asyncio
 import sys
 from pathlib import Path
 
@@ -8,25 +14,51 @@ project_root = Path(__file__).parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
-from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import Qt
-from client.gui.app_window import AppWindow
-
-
 
 def main():
     """Run the BaraChat client application."""
+    parser = argparse.ArgumentParser(description="BaraChat client")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print import and first-paint timings")
+    args, qt_args = parser.parse_known_args()
+    
+    profile = None
+    if args.profile_startup:
+        from client.utils.startup_profile import StartupProfile
+        profile = StartupProfile(LAUNCHED)
+    
+    # Qt and the window are imported here, after the profile starts;
+    # heavier modules (network, voice, crypto) load on first use
+    from PySide6.QtWidgets import QApplication
+    from client.gui.event_loop import QtEventLoop
+    from client.gui.app_window import AppWindow
+    if profile:
+        profile.mark("imports")
+    
     # Create QApplication
-    app = QApplication(sys.argv)
+    app = QApplication([sys.argv[0], *qt_args])
+    
+    # asyncio runs inside Qt's event loop, on this thread
+    loop = QtEventLoop()
+    asyncio.set_event_loop(loop)
+    if profile:
+        profile.mark("QApplication")
     
     # Create and show main window
     window = AppWindow()
     window.show()
+    if profile:
+        profile.mark("window")
+        profile.watch_first_paint(window, lambda report: print(report, file=sys.stderr))
     
-    # Run event loop
-    sys.exit(app.exec())
+    # Run event loop until the window is closed
+    loop.run_forever()
+    if profile:
+        profile.stop()  # The window may close before its first paint
+    loop.run_until_complete(window.shutdown())
+    loop.close()
+    sys.exit(0)
 
 
 if __name__ == "__main__":
     main()
-
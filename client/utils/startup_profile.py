@@ -0,0 +1,129 @@
+"""Startup timing for ``--profile-startup``: startup phases, import costs and first paint."""
+
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+MIN_IMPORT_MS = 3.0  # Imports cheaper than this are left out of the report
+
+
+class _TimedLoader:
+    """Loader wrapper measuring how long a module takes to execute (imports included)."""
+
+    def __init__(self, loader, timer: "_ImportTimer", name: str):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        entry = [self._name, self._timer.depth, 0.0]
+        self._timer.entries.append(entry)
+        self._timer.depth += 1
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            entry[2] = time.perf_counter() - started
+            self._timer.depth -= 1
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer:
+    """Meta path finder timing every module imported after it is installed."""
+
+    def __init__(self):
+        self.entries: List[list] = []  # [name, nesting depth, seconds], in import order
+        self.depth = 0
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self, name)
+                return spec
+        return None
+
+
+class StartupProfile:
+    """
+    Breakdown of the time from launch to the first painted window.
+
+    Phases are marked by the caller; imports are timed by a meta path
+    finder installed when the profile is created, so only what is
+    imported after that point shows up.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        """
+        Start profiling.
+
+        Args:
+            started: perf_counter() value at launch (defaults to now)
+        """
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self._last = self.started
+        self._imports = _ImportTimer()
+        sys.meta_path.insert(0, self._imports)
+
+    def mark(self, label: str):
+        """End a phase."""
+        now = time.perf_counter()
+        self.phases.append((label, now - self._last))
+        self._last = now
+
+    def watch_first_paint(self, window, on_painted: Callable[[str], None]):
+        """
+        Mark the first paint of a window, then hand over the report.
+
+        The phase ends once the event loop has delivered the whole first
+        batch of paint events, not just the first one.
+        """
+        from PySide6.QtCore import QEvent, QObject, QTimer
+        from PySide6.QtWidgets import QApplication, QWidget
+
+        app = QApplication.instance()
+
+        def finish():
+            self.mark("first paint")
+            self.stop()
+            on_painted(self.report())
+
+        class PaintWatcher(QObject):
+            def eventFilter(self, watched, event):
+                if (event.type() == QEvent.Paint and isinstance(watched, QWidget)
+                        and watched.window() is window):
+                    app.removeEventFilter(self)
+                    QTimer.singleShot(0, finish)
+                return False
+
+        self._watcher = PaintWatcher()
+        app.installEventFilter(self._watcher)
+
+    def stop(self):
+        """Stop timing imports."""
+        if self._imports in sys.meta_path:
+            sys.meta_path.remove(self._imports)
+
+    def report(self) -> str:
+        """Format the phases and the imports that cost at least MIN_IMPORT_MS."""
+        lines = ["Startup profile", f"  {'phase':<36} {'ms':>6}"]
+        for label, seconds in self.phases:
+            lines.append(f"  {label:<36} {seconds * 1000:6.1f}")
+        lines.append(f"  {'total':<36} {(self._last - self.started) * 1000:6.1f}")
+
+        lines.append(f"  {'imports (inclusive)':<36} {'ms':>6}")
+        for name, depth, seconds in self._imports.entries:
+            if seconds * 1000 >= MIN_IMPORT_MS:
+                label = "  " * depth + name
+                lines.append(f"  {label:<36} {seconds * 1000:6.1f}")
+        return "\n".join(lines)
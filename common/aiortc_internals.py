@@ -0,0 +1,27 @@
+"""Checks for the private aiortc receiver internals the client and SFU replace."""
+
+from typing import Iterable
+from aiortc.rtcrtpreceiver import RTCRtpReceiver
+
+
+def check_receiver_internals(attributes: Iterable[str], methods: Iterable[str] = ()):
+    """
+    Fail if aiortc's ``RTCRtpReceiver`` lacks internals about to be replaced.
+
+    They are private to aiortc (pinned to 1.15.x): on another release an
+    attribute its receiver no longer reads would be replaced silently and
+    audio would bypass our code without any error.
+
+    Args:
+        attributes: Mangled names of instance attributes ``__init__`` assigns
+            (ex: ``_RTCRtpReceiver__decoder_queue``)
+        methods: Names of methods the receiver class defines
+
+    Raises:
+        RuntimeError: If any of them is missing
+    """
+    assigned = RTCRtpReceiver.__init__.__code__.co_names
+    missing = [name for name in attributes if name not in assigned]
+    missing += [name for name in methods if not hasattr(RTCRtpReceiver, name)]
+    if missing:
+        raise RuntimeError(f"Unsupported aiortc version: RTCRtpReceiver lacks {', '.join(missing)} (1.15.x required)")
@@ -14,6 +14,8 @@ class WSMsgType:
     SIGNALING = "signaling"
     ERROR = "error"
     HEARTBEAT = "heartbeat"
+    SESSION = "session"  # Resume token and current sequence number, sent on connect
+    RESYNC = "resync"  # Gap too old for the replay buffer: fetch it from history
 
 # HTTP routes
 class Routes:
@@ -21,9 +23,16 @@ class Routes:
     ROOT = "/"
     WS = "/ws"
     API = "/api"
+    REGISTER = "/api/register"
+    LOGIN = "/api/login"
     UPLOAD = "/api/upload"
+    UPLOAD_CHECK = "/api/upload/check"
     DOWNLOAD = "/api/download"
+    THUMBNAIL = "/api/thumbnail"
+    ROOM_FILES = "/api/rooms/{room}/files"
+    ROOM_MESSAGES = "/api/rooms/{room}/messages"
     USER_INFO = "/api/user"
+    ADMIN_USAGE = "/api/admin/usage"
     HEALTH = "/health"
 
 # Database constants
@@ -37,5 +46,6 @@ SALT_SIZE = 16  # 128 bits for salt
 
 # User limits
 MAX_USERNAME_LENGTH = 32
+MAX_PASSWORD_BYTES = 72  # bcrypt only uses the first 72 bytes of a password
 MAX_ROOM_NAME_LENGTH = 64
 
@@ -25,6 +25,7 @@ class ChatMessage:
     timestamp: Optional[float] = None
     file_url: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
+    seq: Optional[int] = None  # Per-room sequence number stamped by the server
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
@@ -45,11 +46,39 @@ class FileUploadResponse:
 
 @dataclass
 class SignalingMessage:
-    """WebRTC signaling message."""
+    """
+    WebRTC signaling message.
+    
+    ``from_peer`` and ``to_peer`` travel as "from" and "to". The server sets
+    "from" to the sender's peer ID; "to" addresses a single peer (omit it to
+    reach the whole room). Peer IDs come from the "roster", "peer_joined"
+    and "peer_left" messages.
+    """
     type: str  # "offer", "answer", "ice_candidate"
     room: str
     user: str
     data: Dict[str, Any]  # SDP or ICE candidate info
+    from_peer: Optional[str] = None
+    to_peer: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary (wire field names, None values removed)."""
+        data = asdict(self)
+        data['from'] = data.pop('from_peer')
+        data['to'] = data.pop('to_peer')
+        return {k: v for k, v in data.items() if v is not None}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SignalingMessage":
+        """Create from a decoded wire message."""
+        return cls(
+            type=data['type'],
+            room=data.get('room', ''),
+            user=data.get('user', ''),
+            data=data.get('data', {}),
+            from_peer=data.get('from'),
+            to_peer=data.get('to')
+        )
 
 
 @dataclass
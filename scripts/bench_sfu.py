@@ -0,0 +1,204 @@
+"""
+SFU forwarding benchmark.
+
+Runs the server in a child process and connects N synthetic voice peers to
+one room. Every peer publishes a 440 Hz Opus tone and receives the other
+N - 1 streams, so the SFU forwards N * (N - 1) streams. The child's CPU
+time is sampled over a fixed window and reported per forwarded stream.
+Decoding and encoding for the synthetic peers happen in this process and
+are not counted.
+
+Usage:
+    python scripts/bench_sfu.py [--peers 6] [--duration 10]
+"""
+
+import argparse
+import array
+import asyncio
+import fractions
+import math
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path so imports work
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # 20 ms
+
+
+def make_tone_track():
+    """Create an audio track playing a 440 Hz tone in real time."""
+    import av
+    from aiortc.mediastreams import AudioStreamTrack
+
+    period = SAMPLE_RATE // 440 * FRAME_SAMPLES
+    tone = array.array('h', (
+        int(8000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE)) for i in range(period)
+    ))
+
+    class ToneTrack(AudioStreamTrack):
+        """Sine wave source paced like a microphone."""
+
+        def __init__(self):
+            super().__init__()
+            self._pts = 0
+            self._start = None
+
+        async def recv(self):
+            if self._start is None:
+                self._start = time.time()
+            wait = self._start + self._pts / SAMPLE_RATE - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            offset = self._pts % period
+            samples = tone[offset:offset + FRAME_SAMPLES]
+            frame = av.AudioFrame(format='s16', layout='mono', samples=FRAME_SAMPLES)
+            frame.planes[0].update(samples.tobytes())
+            frame.sample_rate = SAMPLE_RATE
+            frame.pts = self._pts
+            frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+            self._pts += FRAME_SAMPLES
+            return frame
+
+    return ToneTrack()
+
+
+def serve(port: int):
+    """Child process: run the chat server with a stats endpoint."""
+    from aiohttp import web
+    from server.main import create_app
+    from server.voice.sfu import get_sfu
+
+    async def handle_stats(request):
+        sfu = get_sfu()
+        return web.json_response({
+            'cpu': time.process_time(),
+            'received': sfu.packets_received,
+            'forwarded': sfu.packets_forwarded,
+        })
+
+    app = create_app()
+    app.router.add_get("/bench/stats", handle_stats)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+class SyntheticPeer:
+    """A voice client publishing a tone and counting the frames it receives."""
+
+    def __init__(self, session, url: str):
+        from client.core.media import VoiceManager
+
+        self.session = session
+        self.url = url
+        self.voice = VoiceManager()
+        self._tasks = []
+
+    async def start(self):
+        """Connect the signaling socket and publish."""
+        self.ws = await self.session.ws_connect(self.url)
+        self._tasks.append(asyncio.create_task(self._read_signaling()))
+        await self.voice.start_voice_chat(self.ws.send_json, make_tone_track())
+
+    async def stop(self):
+        """Hang up."""
+        for task in self._tasks:
+            task.cancel()
+        await self.voice.stop_voice_chat()
+        await self.ws.close()
+
+    async def _read_signaling(self):
+        async for msg in self.ws:
+            await self.voice.handle_signal(msg.json())
+
+    @property
+    def frames_received(self) -> int:
+        """Encoded frames delivered to this peer's playout buffers."""
+        return sum(stream.packets_received for stream in self.voice.playout.values())
+
+
+async def run(args, port: int):
+    """Connect the peers, sample the server's CPU and print a summary."""
+    import aiohttp
+
+    base_url = f"http://127.0.0.1:{port}"
+    streams = args.peers * (args.peers - 1)
+
+    async with aiohttp.ClientSession() as session:
+        # Wait for the child to listen
+        for _ in range(100):
+            try:
+                async with session.get(f"{base_url}/bench/stats"):
+                    break
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+
+        async def stats():
+            async with session.get(f"{base_url}/bench/stats") as response:
+                return await response.json()
+
+        peers = [SyntheticPeer(session, f"{base_url}/voice?room=bench") for _ in range(args.peers)]
+        for peer in peers:
+            await peer.start()
+
+        deadline = time.time() + 30
+        while any(len(p.voice.slot_peers) < args.peers - 1 for p in peers):
+            if time.time() > deadline:
+                raise SystemExit("peers did not finish subscribing")
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1)  # Warm up
+
+        before, frames_before, start = await stats(), sum(p.frames_received for p in peers), time.time()
+        await asyncio.sleep(args.duration)
+        after, frames_after, elapsed = await stats(), sum(p.frames_received for p in peers), time.time() - start
+
+        for peer in peers:
+            await peer.stop()
+
+    cpu_percent = (after['cpu'] - before['cpu']) / elapsed * 100
+    forwarded = (after['forwarded'] - before['forwarded']) / elapsed
+    received = (after['received'] - before['received']) / elapsed
+
+    print(f"peers:               {args.peers} (uplink 1 stream each, mesh would be {args.peers - 1})")
+    print(f"forwarded streams:   {streams}")
+    print(f"packets in/out:      {received:.0f}/s -> {forwarded:.0f}/s")
+    print(f"frames at clients:   {(frames_after - frames_before) / elapsed:.0f}/s")
+    print(f"server CPU:          {cpu_percent:.1f} % of one core")
+    print(f"CPU per stream:      {cpu_percent / streams:.2f} %")
+    if forwarded:
+        print(f"CPU per packet:      {(after['cpu'] - before['cpu']) / (forwarded * elapsed) * 1e6:.1f} us")
+
+
+def main():
+    """Parse arguments, start the server process and run the peers."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--peers", type=int, default=6, help="synthetic peers in the room")
+    parser.add_argument("--duration", type=float, default=10, help="measurement window (seconds)")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = subprocess.Popen([sys.executable, __file__, "--serve", str(port)], stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(run(args, port))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
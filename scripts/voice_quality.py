@@ -0,0 +1,471 @@
+"""
+Voice quality harness.
+
+Runs a scripted call between two aiortc peers on this machine through a
+UDP impairment proxy. The sender publishes a synthetic, speech-like
+signal through the client's microphone pipeline (VAD included); the receiver
+plays it out through the client's jitter buffer on a 20 ms output clock.
+Sent and played audio are then aligned to report mouth-to-ear latency,
+loss, jitter buffer depth and a quality score.
+
+The score is a PESQ-like proxy, not ITU-T P.862: the log-spectral
+distance between sent and played speech frames mapped onto a 1-4.5 MOS
+scale. Use it to compare runs, not as an absolute rating.
+
+Usage:
+    python scripts/voice_quality.py [--loss 0.05] [--delay 40] [--jitter 20]
+        [--reorder 0.02] [--bandwidth 64] [--duration 15] [--seed 1]
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Add project root to path so imports work
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960  # 20 ms
+FRAME_DURATION = FRAME_SAMPLES / SAMPLE_RATE
+
+REORDER_HOLD = 0.03  # Extra delay (s) of a packet picked for reordering
+QUEUE_LIMIT = 0.2  # Bandwidth-capped links tail-drop past this much queueing (s)
+MAX_LATENCY_MS = 2000  # Longest mouth-to-ear delay searched for
+
+# Quality proxy: log-spectral distance (dB) to MOS. Calibrated on the test
+# signal to read about 4.3 on a clean link, 3.2 at 20 % random loss and
+# 1.5 at 40 %
+LSD_MIDPOINT = 3.0
+LSD_SLOPE = 0.6
+SPEECH_FRAME_RMS = 300  # Sent frames quieter than this are not scored
+UTTERANCE_GAP_FRAMES = 10  # Quieter stretches longer than this split utterances
+UTTERANCE_SEARCH_MS = 100  # Each utterance is aligned within this of the call-wide delay
+
+# F1-F3 (Hz) of a few vowels for the test signal
+VOWEL_FORMANTS = [
+    (730, 1090, 2440), (270, 2290, 3010), (300, 870, 2240),
+    (530, 1840, 2480), (570, 840, 2410), (660, 1720, 2410),
+]
+
+CANDIDATE_RE = re.compile(
+    r"^a=candidate:(\S+) (\d+) udp (\d+) (\d+\.\d+\.\d+\.\d+) (\d+) typ host", re.M
+)
+
+
+class _Link:
+    """One direction of the proxy, with its own impairments and counters."""
+
+    def __init__(self, proxy: "ImpairmentProxy"):
+        self.proxy = proxy
+        self.transport: Optional[asyncio.DatagramTransport] = None  # Sends toward the target
+        self.target: Optional[Tuple[str, int]] = None
+        self._busy_until = 0.0
+        self.packets = 0
+        self.lost = 0
+        self.queue_drops = 0
+        self.reordered = 0
+
+    def submit(self, data: bytes):
+        """Schedule delivery of one datagram, or drop it."""
+        if self.transport is None or self.target is None:
+            return
+        loop = asyncio.get_running_loop()
+        proxy = self.proxy
+
+        # STUN and DTLS pass untouched so the call always connects; RTP and
+        # RTCP (first byte 128-191, RFC 7983) are impaired
+        if not 128 <= data[0] <= 191:
+            self.transport.sendto(data, self.target)
+            return
+
+        is_rtp = len(data) > 1 and not 192 <= data[1] <= 223
+        if is_rtp:
+            self.packets += 1
+        if proxy.rng.random() < proxy.loss:
+            self.lost += is_rtp
+            return
+
+        now = loop.time()
+        departure = now
+        if proxy.bandwidth:
+            start = max(now, self._busy_until)
+            departure = start + len(data) * 8 / (proxy.bandwidth * 1000)
+            if departure - now > QUEUE_LIMIT:
+                self.queue_drops += is_rtp
+                return
+            self._busy_until = departure
+
+        latency = proxy.delay + proxy.rng.uniform(-proxy.jitter, proxy.jitter)
+        if proxy.rng.random() < proxy.reorder:
+            latency += REORDER_HOLD
+            self.reordered += is_rtp
+        loop.call_at(departure + max(0.0, latency), self._deliver, data)
+
+    def _deliver(self, data: bytes):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, self.target)
+
+
+class _ProxySide(asyncio.DatagramProtocol):
+    """Socket facing one peer; what it receives goes out on the other side."""
+
+    def __init__(self, link: _Link):
+        self.link = link
+
+    def datagram_received(self, data: bytes, addr):
+        self.link.submit(data)
+
+
+class ImpairmentProxy:
+    """
+    UDP relay between two peers with netem-style impairments.
+
+    Each peer is given one of the proxy's sockets as the other's address
+    (see ``route_sdp``); packets are relayed out of the opposite socket,
+    so both peers see the address they were given. Delays are in seconds,
+    bandwidth in kbit/s per direction.
+    """
+
+    def __init__(self, loss: float = 0.0, delay: float = 0.0, jitter: float = 0.0,
+                 reorder: float = 0.0, bandwidth: Optional[float] = None,
+                 seed: Optional[int] = None):
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.bandwidth = bandwidth
+        self.rng = random.Random(seed)
+        self.a_to_b = _Link(self)
+        self.b_to_a = _Link(self)
+        self.address_a: Optional[Tuple[str, int]] = None  # Given to peer A
+        self.address_b: Optional[Tuple[str, int]] = None  # Given to peer B
+
+    async def start(self, host: str):
+        """Bind both sockets on a local address."""
+        loop = asyncio.get_running_loop()
+        side_a, _ = await loop.create_datagram_endpoint(
+            lambda: _ProxySide(self.a_to_b), local_addr=(host, 0)
+        )
+        side_b, _ = await loop.create_datagram_endpoint(
+            lambda: _ProxySide(self.b_to_a), local_addr=(host, 0)
+        )
+        self.address_a = side_a.get_extra_info("sockname")[:2]
+        self.address_b = side_b.get_extra_info("sockname")[:2]
+        self.a_to_b.transport = side_b
+        self.b_to_a.transport = side_a
+
+    def connect(self, peer_a: Tuple[str, int], peer_b: Tuple[str, int]):
+        """Set the real peer addresses."""
+        self.a_to_b.target = peer_b
+        self.b_to_a.target = peer_a
+
+    def close(self):
+        """Close both sockets."""
+        for link in (self.a_to_b, self.b_to_a):
+            if link.transport is not None:
+                link.transport.close()
+
+
+def route_sdp(sdp: str, address: Tuple[str, int]) -> Tuple[str, Tuple[str, int]]:
+    """
+    Point an SDP's ICE candidates at the proxy.
+
+    Returns:
+        (rewritten SDP with a single candidate at ``address``, the real
+        address of the first IPv4 host candidate)
+    """
+    match = CANDIDATE_RE.search(sdp)
+    if match is None:
+        raise SystemExit("no IPv4 host candidate to route through the proxy")
+    foundation, component, priority, host, port = match.groups()
+    candidate = f"a=candidate:{foundation} {component} udp {priority} {address[0]} {address[1]} typ host"
+
+    lines = []
+    for line in sdp.splitlines():
+        if line.startswith("a=candidate:"):
+            continue
+        if line == "a=end-of-candidates":
+            lines.append(candidate)
+        lines.append(line)
+    return "\r\n".join(lines) + "\r\n", (host, int(port))
+
+
+def make_speech_signal(duration: float, seed: int) -> np.ndarray:
+    """
+    Speech-like test signal: talkspurts of 1-2 s with pauses between them.
+
+    Talkspurts are strings of 60-160 ms "phonemes": voiced ones are
+    harmonics of a wobbling 100-180 Hz pitch shaped by vowel formants,
+    unvoiced ones band-passed noise. The spectrum changes every few
+    frames, as in speech, so concealment cannot simply repeat it.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(duration * SAMPLE_RATE)
+    signal = np.zeros(total, dtype=np.float64)
+
+    pos = int(0.5 * SAMPLE_RATE)
+    while pos < total:
+        end = min(pos + int(rng.uniform(1.0, 2.0) * SAMPLE_RATE), total)
+        f0_base = rng.uniform(100, 180)
+        while pos < end:
+            length = min(int(rng.uniform(0.06, 0.16) * SAMPLE_RATE), end - pos)
+            t = np.arange(length) / SAMPLE_RATE
+            if rng.random() < 0.75:
+                f0 = f0_base * (1 + 0.15 * rng.uniform(-1, 1) + 0.1 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+                phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+                formants = VOWEL_FORMANTS[rng.integers(len(VOWEL_FORMANTS))]
+                segment = np.zeros(length)
+                for k in range(1, int(4000 / f0_base)):
+                    gain = sum(1 / (1 + ((k * f0_base - f) / 90) ** 2) for f in formants) / math.sqrt(k)
+                    segment += gain * np.sin(k * phase)
+            else:
+                spectrum = np.fft.rfft(rng.standard_normal(length))
+                freqs = np.fft.rfftfreq(length, 1 / SAMPLE_RATE)
+                spectrum *= np.exp(-((freqs - rng.uniform(2500, 6000)) / 1200) ** 2)
+                segment = np.fft.irfft(spectrum, length) * 3
+            ramp = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.005)
+            signal[pos:pos + length] = segment * ramp * rng.uniform(0.4, 1.0)
+            pos += length
+        pos = end + int(rng.uniform(0.3, 0.8) * SAMPLE_RATE)
+
+    return (signal / np.abs(signal).max() * 8000).astype(np.int16)
+
+
+class SignalCapture:
+    """Stands in for ``MicrophoneCapture``, delivering a signal in real time."""
+
+    def __init__(self, signal: np.ndarray):
+        self.signal = signal
+        self.on_samples = None
+        self.start_time: Optional[float] = None  # Capture time of sample 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="signal-capture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        self.start_time = time.monotonic()
+        for k in range(len(self.signal) // FRAME_SAMPLES):
+            # A block is delivered once its last sample has been "spoken"
+            wait = self.start_time + (k + 1) * FRAME_DURATION - time.monotonic()
+            if self._stop.wait(max(0.0, wait)):
+                break
+            self.on_samples(self.signal[k * FRAME_SAMPLES:(k + 1) * FRAME_SAMPLES])
+
+
+def envelope(samples: np.ndarray) -> np.ndarray:
+    """Mean absolute amplitude in 1 ms bins."""
+    bin_samples = SAMPLE_RATE // 1000
+    count = len(samples) // bin_samples
+    return np.abs(samples[:count * bin_samples].astype(np.float64)).reshape(count, bin_samples).mean(axis=1)
+
+
+def estimate_latency_ms(sent: np.ndarray, played: np.ndarray, offset_ms: int) -> int:
+    """
+    Find the mouth-to-ear delay by cross-correlating amplitude envelopes.
+
+    Args:
+        sent: Sent samples, sample 0 spoken at time 0
+        played: Played samples, sample 0 played at ``offset_ms``
+    """
+    a, b = envelope(sent), envelope(played)
+    a, b = a - a.mean(), b - b.mean()
+    size = len(a) + len(b)
+    # corr[k] = sum_j a[j] * b[j + k]; played bin j holds sent bin j + offset - latency
+    corr = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size)), size)
+    lags = np.arange(-offset_ms, MAX_LATENCY_MS - offset_ms)
+    best = lags[np.argmax(corr[lags % size])]
+    return int(best + offset_ms)
+
+
+def utterances(sent: np.ndarray) -> list:
+    """Sample ranges of the talkspurts in the sent signal."""
+    count = len(sent) // FRAME_SAMPLES
+    frames = sent[:count * FRAME_SAMPLES].astype(np.float64).reshape(count, -1)
+    speech = np.flatnonzero(np.sqrt(np.mean(frames * frames, axis=1)) > SPEECH_FRAME_RMS)
+    ranges = []
+    for first, last in zip(np.r_[speech[0], speech[1:][np.diff(speech) > UTTERANCE_GAP_FRAMES]],
+                           np.r_[speech[:-1][np.diff(speech) > UTTERANCE_GAP_FRAMES], speech[-1]]):
+        ranges.append((int(first) * FRAME_SAMPLES, (int(last) + 1) * FRAME_SAMPLES))
+    return ranges
+
+
+def align_utterance(sent: np.ndarray, played: np.ndarray, start: int, end: int, shift: int) -> int:
+    """
+    Refine the alignment of one utterance around the call-wide one.
+
+    ``played[m]`` is taken to hold ``sent[m + shift]``; the playout delay
+    changes between talkspurts, so each is aligned on its own, as PESQ does.
+    """
+    search = UTTERANCE_SEARCH_MS * SAMPLE_RATE // 1000
+    lo = start - shift - search
+    window = np.zeros(end - start + 2 * search, dtype=np.int16)
+    src = played[max(0, lo):max(0, lo + len(window))]
+    window[max(0, -lo):max(0, -lo) + len(src)] = src
+
+    a, b = envelope(sent[start:end]), envelope(window)
+    corr = np.correlate(b - b.mean(), a - a.mean(), mode="valid")
+    return shift + (UTTERANCE_SEARCH_MS - int(np.argmax(corr))) * SAMPLE_RATE // 1000
+
+
+def spectral_distance(ref: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Log-spectral distance (dB) of each pair of 20 ms frames."""
+    window = np.hanning(FRAME_SAMPLES)
+    ref_power = np.abs(np.fft.rfft(ref * window, axis=1)) ** 2
+    out_power = np.abs(np.fft.rfft(out * window, axis=1)) ** 2
+    floor = ref_power.max() * 1e-6  # Ignore differences 60 dB below the peak
+    ref_db = 10 * np.log10(ref_power + floor)
+    out_db = 10 * np.log10(out_power + floor)
+    return np.sqrt(np.mean((ref_db - out_db) ** 2, axis=1))
+
+
+def analyse(sent: np.ndarray, played: np.ndarray, offset_ms: int) -> Tuple[list, float]:
+    """
+    Align the played audio with the sent signal, utterance by utterance.
+
+    Returns:
+        (mouth-to-ear delay of each utterance in ms, mean log-spectral
+        distance of the sent speech frames in dB)
+    """
+    base = (offset_ms - estimate_latency_ms(sent, played, offset_ms)) * SAMPLE_RATE // 1000
+    latencies, distances = [], []
+    for start, end in utterances(sent):
+        shift = align_utterance(sent, played, start, end, base)
+        if start - shift < 0 or end - shift > len(played):
+            continue
+        latencies.append(offset_ms - shift * 1000 // SAMPLE_RATE)
+
+        count = (end - start) // FRAME_SAMPLES
+        ref = sent[start:end].astype(np.float64).reshape(count, -1)
+        out = played[start - shift:end - shift].astype(np.float64).reshape(count, -1)
+        speech = np.sqrt(np.mean(ref * ref, axis=1)) > SPEECH_FRAME_RMS
+        distances.append(spectral_distance(ref[speech], out[speech]))
+    return latencies, float(np.mean(np.concatenate(distances)))
+
+
+def mos_estimate(lsd: float) -> float:
+    """Map a log-spectral distance onto a 1-4.5 MOS-like scale."""
+    return 1 + 3.5 / (1 + math.exp((lsd - LSD_MIDPOINT) / LSD_SLOPE))
+
+
+async def play_out(stream, blocks: list, depths: list, stop: asyncio.Event) -> float:
+    """Pull 20 ms from the playout stream on a steady clock; returns the first read time."""
+    start = time.monotonic() + FRAME_DURATION
+    k = 0
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, start + k * FRAME_DURATION - time.monotonic()))
+        blocks.append(stream.read())
+        depths.append(stream.delay_ms)
+        k += 1
+    return start
+
+
+async def run(args):
+    """Run the call and print the report."""
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    from client.core.audio import MicrophoneTrack
+    from client.core.media import attach_playout
+
+    proxy = ImpairmentProxy(loss=args.loss, delay=args.delay / 1000, jitter=args.jitter / 1000,
+                            reorder=args.reorder, bandwidth=args.bandwidth, seed=args.seed)
+    signal = make_speech_signal(args.duration, args.seed)
+    capture = SignalCapture(signal)
+    track = MicrophoneTrack(capture=capture)
+    capture.on_samples = track.feed
+
+    sender, receiver = RTCPeerConnection(), RTCPeerConnection()
+    sender.addTransceiver(track, direction="sendonly")
+    streams = []
+
+    @receiver.on("track")
+    def on_track(remote_track):
+        transceiver = next(t for t in receiver.getTransceivers() if t.receiver.track is remote_track)
+        streams.append(attach_playout(transceiver.receiver))
+
+    await sender.setLocalDescription(await sender.createOffer())
+    host = CANDIDATE_RE.search(sender.localDescription.sdp).group(4)
+    await proxy.start(host)
+
+    offer, sender_address = route_sdp(sender.localDescription.sdp, proxy.address_b)
+    await receiver.setRemoteDescription(RTCSessionDescription(sdp=offer, type="offer"))
+    await receiver.setLocalDescription(await receiver.createAnswer())
+    answer, receiver_address = route_sdp(receiver.localDescription.sdp, proxy.address_a)
+    proxy.connect(sender_address, receiver_address)
+    await sender.setRemoteDescription(RTCSessionDescription(sdp=answer, type="answer"))
+
+    deadline = time.monotonic() + 15
+    while sender.connectionState != "connected" or receiver.connectionState != "connected":
+        if time.monotonic() > deadline:
+            raise SystemExit("call did not connect through the proxy")
+        await asyncio.sleep(0.05)
+
+    stream = streams[0]
+    blocks, depths, stop = [], [], asyncio.Event()
+    player = asyncio.create_task(play_out(stream, blocks, depths, stop))
+    track.start()
+    await asyncio.sleep(args.duration + 1)  # Let the tail play out
+    track.stop()
+    stop.set()
+    play_start = await player
+
+    await sender.close()
+    await receiver.close()
+    proxy.close()
+
+    played = np.concatenate(blocks)
+    offset_ms = round((play_start - capture.start_time) * 1000)
+    latencies, lsd = analyse(signal, played, offset_ms)
+
+    link = proxy.a_to_b
+    dropped = link.lost + link.queue_drops
+    depth = np.array(depths[len(depths) // 10:])  # Skip call setup
+    cap = f"{args.bandwidth:g} kbit/s" if args.bandwidth else "none"
+
+    print(f"network:          loss {args.loss:.1%}, delay {args.delay:g} ms, jitter ±{args.jitter:g} ms, "
+          f"reorder {args.reorder:.1%}, cap {cap}")
+    print(f"packets:          sent {link.packets}, dropped {dropped} "
+          f"({dropped / max(1, link.packets):.1%}, {link.queue_drops} by the cap), reordered {link.reordered}")
+    print(f"receiver:         got {stream.packets_received}, late {stream.packets_late}, "
+          f"concealed {stream.frames_concealed}, underruns {stream.underruns}, "
+          f"accelerated {stream.frames_accelerated}")
+    print(f"mouth-to-ear:     median {np.median(latencies):.0f} ms, max {max(latencies)} ms "
+          f"over {len(latencies)} utterances")
+    print(f"jitter buffer:    mean {depth.mean():.0f} ms, p95 {np.percentile(depth, 95):.0f} ms, "
+          f"target {stream.target_frames} frames")
+    print(f"quality:          LSD {lsd:.1f} dB, MOS estimate {mos_estimate(lsd):.2f} (PESQ-like proxy)")
+
+
+def main():
+    """Parse arguments and run the call."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss probability")
+    parser.add_argument("--delay", type=float, default=0.0, help="one-way delay (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="delay variation, uniform ± (ms)")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability a packet is held back")
+    parser.add_argument("--bandwidth", type=float, help="link capacity (kbit/s)")
+    parser.add_argument("--duration", type=float, default=15, help="call length (seconds)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for signal and impairments")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
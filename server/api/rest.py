@@ -1,16 +1,34 @@
 """REST API endpoints for file uploads and user management."""
 
-from aiohttp import web, MultipartReader
+import asyncio
+import time
+from aiohttp import web
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+from common.constants import MAX_PASSWORD_BYTES, MAX_USERNAME_LENGTH
 from server.config import get_config
-from server.storage import Storage
-from server.auth import get_auth_manager
+from server.storage import QuotaExceededError, Storage, get_storage
+from server.auth import (ANONYMOUS_USER_ID, AuthBusyError, get_auth_manager, get_request_identity,
+                         get_request_user)
+from server.models import UserRole, FileCategory
 from server.utils.logger import get_logger
 
 
 logger = get_logger(__name__)
 
+MAX_PAGE_SIZE = 200
+THUMBNAIL_SIZE = (256, 256)
+
+# Accepted values of the gallery's ?type= filter
+FILE_TYPE_FILTERS = {
+    'image': FileCategory.IMAGE,
+    'images': FileCategory.IMAGE,
+    'document': FileCategory.DOCUMENT,
+    'documents': FileCategory.DOCUMENT,
+    'other': FileCategory.OTHER,
+}
+
 
 async def handle_upload(request: web.Request) -> web.Response:
     """
@@ -19,40 +37,34 @@ async def handle_upload(request: web.Request) -> web.Response:
     Expected multipart/form-data with:
     - file: the file to upload
     - room: target room name
-    - user: username
     
     Returns JSON with file URL and metadata.
     """
     config = get_config()
-    storage = Storage()
-    auth = get_auth_manager()
+    storage = get_storage()
     
     try:
-        # Check authentication
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return web.json_response(
-                {'error': 'Authentication required'},
-                status=401
-            )
-        
-        token = auth.extract_token_from_header(auth_header)
-        user_info = auth.get_user_from_token(token)
+        # Check authentication (anonymous uploads follow allow_anonymous)
+        user_info = get_request_identity(request)
         
         if not user_info:
             return web.json_response(
-                {'error': 'Invalid token'},
+                {'error': 'Authentication required'},
                 status=401
             )
         
         # Parse multipart data
+        # The file part must be read while it is current: moving to the
+        # next part discards its body.
         reader = await request.multipart()
         file_obj = None
+        content = None
         room = None
         
         async for part in reader:
             if part.name == 'file':
                 file_obj = part
+                content = await part.read()
             elif part.name == 'room':
                 room = await part.text()
         
@@ -62,9 +74,7 @@ async def handle_upload(request: web.Request) -> web.Response:
                 status=400
             )
         
-        # Read file content
         filename = file_obj.filename or 'unknown'
-        content = await file_obj.read()
         
         # Check file size
         if len(content) > config.max_file_size:
@@ -74,23 +84,26 @@ async def handle_upload(request: web.Request) -> web.Response:
             )
         
         # Check MIME type
-        mime_type = file_obj.content_type or 'application/octet-stream'
+        mime_type = file_obj.headers.get('Content-Type') or 'application/octet-stream'
         
-        # Save file
-        file_path = await storage.save_file(
-            filename=filename,
-            content=content,
-            uploader_id=user_info['user_id'],
-            uploader_username=user_info['username'],
-            room=room,
-            mime_type=mime_type
-        )
+        # Save file (checks quotas, then evicts old room files if needed)
+        try:
+            file_path = await storage.save_file(
+                filename=filename,
+                content=content,
+                uploader_id=user_info['user_id'],
+                uploader_username=user_info['username'],
+                room=room,
+                mime_type=mime_type
+            )
+        except QuotaExceededError as e:
+            return web.json_response({'error': str(e)}, status=413)
         
         logger.info(f"File uploaded: {filename} by {user_info['username']}")
         
         return web.json_response({
             'success': True,
-            'file_url': f"/api/download/{Path(file_path).name}",
+            'file_url': _download_url(Path(file_path).name, user_info['user_id']),
             'file_name': filename,
             'file_size': len(content)
         })
@@ -103,13 +116,79 @@ async def handle_upload(request: web.Request) -> web.Response:
         )
 
 
+async def handle_upload_check(request: web.Request) -> web.Response:
+    """
+    Upload-by-hash handshake.
+    
+    POST /api/upload/check with JSON:
+    - sha256: hex digest of the file content
+    - file_name: name to record for this share
+    - file_size: size in bytes (must match the stored blob)
+    - room: target room name
+    
+    If the server already stores a blob with this hash, a new file record is
+    created for it and the response matches a normal upload plus
+    ``"exists": true``. Otherwise the client should upload the bytes.
+    """
+    storage = get_storage()
+    
+    user_info = get_request_identity(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    data = await _json_object(request)
+    if data is None:
+        return web.json_response({'error': 'Expected a JSON object'}, status=400)
+    
+    sha256 = str(data.get('sha256', '')).lower()
+    filename = data.get('file_name')
+    room = data.get('room')
+    
+    if len(sha256) != 64 or not filename or not room:
+        return web.json_response({'error': 'Missing sha256, file_name or room'}, status=400)
+    
+    existing = storage.get_file_by_hash(sha256)
+    if not existing or existing.file_size != data.get('file_size'):
+        return web.json_response({'exists': False})
+    
+    if not Path(existing.file_path).exists():
+        logger.warning(f"Blob missing for hash {sha256}, asking for upload")
+        return web.json_response({'exists': False})
+    
+    try:
+        record = storage.link_file(
+            existing,
+            filename=filename,
+            uploader_id=user_info['user_id'],
+            uploader_username=user_info['username'],
+            room=room
+        )
+    except QuotaExceededError as e:
+        return web.json_response({'error': str(e)}, status=413)
+    
+    logger.info(f"File deduplicated: {filename} by {user_info['username']}")
+    
+    return web.json_response({
+        'success': True,
+        'exists': True,
+        'file_url': _download_url(record.filename, user_info['user_id']),
+        'file_name': record.original_filename,
+        'file_size': record.file_size
+    })
+
+
 async def handle_download(request: web.Request) -> web.Response:
     """
     Handle file download endpoint.
     
-    GET /api/download/{filename}
+    GET /api/download/{filename}?exp=<unix time>&uid=<user id>&sig=<hmac>
+    
+    Signed URLs are checked with a single constant-time MAC (no token or
+    database work) and may be cached by a proxy until they expire. Unsigned
+    requests need a Bearer token.
     """
-    config = get_config()
+    storage = get_storage()
     filename = request.match_info.get('filename')
     
     if not filename:
@@ -118,13 +197,359 @@ async def handle_download(request: web.Request) -> web.Response:
     # Sanitize filename
     filename = Path(filename).name
     
-    file_path = Path(config.upload_dir) / filename
+    if get_auth_manager().verify_download_url(request.path, request.query):
+        max_age = max(0, int(request.query['exp']) - int(time.time()))
+        cache_control = f"public, max-age={max_age}"
+    elif _can_read_file(storage, get_request_user(request), filename):
+        cache_control = "private, no-store"
+    else:
+        return web.json_response({'error': 'Invalid or expired download URL'}, status=403)
+    
+    file_path = storage.upload_dir / filename
     
     if not file_path.exists():
         return web.json_response({'error': 'File not found'}, status=404)
     
+    # Record the access for LRU eviction (buffered in memory)
+    storage.touch_file(filename)
+    
     # Serve file
-    return web.FileResponse(file_path)
+    return web.FileResponse(file_path, headers={'Cache-Control': cache_control})
+
+
+async def handle_file_url(request: web.Request) -> web.Response:
+    """
+    Mint a fresh signed download URL for a stored file.
+    
+    GET /api/files/{filename}/url
+    
+    File links in chat history outlive their signature (see
+    ``download_url_ttl``), so clients exchange a link here before
+    downloading it. Only files recorded in a room the caller can read
+    (or uploaded themselves) are signed.
+    """
+    storage = get_storage()
+    
+    user_info = get_request_identity(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    filename = Path(request.match_info.get('filename', '')).name
+    
+    if not filename or not (storage.upload_dir / filename).exists() or not storage.get_files_by_name(filename):
+        return web.json_response({'error': 'File not found'}, status=404)
+    
+    if not _can_read_file(storage, user_info, filename):
+        return web.json_response({'error': 'Access denied'}, status=403)
+    
+    return web.json_response({'file_url': _download_url(filename, user_info['user_id'])})
+
+
+def _can_read_room(storage: Storage, user_info: Optional[Dict[str, Any]], room: str) -> bool:
+    """
+    Whether a caller may see a room's files.
+    
+    Rooms are open unless their record is private, in which case only the
+    owner (never an anonymous caller) has access.
+    """
+    if user_info is None:
+        return False
+    record = storage.get_room(room)
+    if record is None or not record.is_private:
+        return True
+    return user_info['user_id'] != ANONYMOUS_USER_ID and record.owner_id == user_info['user_id']
+
+
+def _can_read_file(storage: Storage, user_info: Optional[Dict[str, Any]], filename: str) -> bool:
+    """Whether a caller uploaded a stored file or can read a room it was shared to."""
+    if user_info is None:
+        return False
+    for record in storage.get_files_by_name(filename):
+        if user_info['user_id'] != ANONYMOUS_USER_ID and record.uploader_id == user_info['user_id']:
+            return True
+        if _can_read_room(storage, user_info, record.room):
+            return True
+    return False
+
+
+def _download_url(filename: str, user_id: Optional[int] = None) -> str:
+    """Mint a short-lived signed URL for a stored file."""
+    return get_auth_manager().sign_download_url(f"/api/download/{filename}", user_id)
+
+
+async def handle_room_files(request: web.Request) -> web.Response:
+    """
+    List a room's attachments, newest first.
+    
+    GET /api/rooms/{room}/files?limit=50&before=<id>&type=image|document|other
+    
+    Pages are keyset-based: pass the previous response's ``next_cursor`` as
+    ``before`` to get the next page. Image entries include a thumbnail URL.
+    """
+    storage = get_storage()
+    
+    user_info = get_request_identity(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    room = request.match_info['room']
+    
+    if not _can_read_room(storage, user_info, room):
+        return web.json_response({'error': 'Access denied'}, status=403)
+    
+    try:
+        limit = min(max(int(request.query.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        before = request.query.get('before')
+        before_id = int(before) if before else None
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit or cursor'}, status=400)
+    
+    category = None
+    file_type = request.query.get('type')
+    if file_type:
+        category = FILE_TYPE_FILTERS.get(file_type.lower())
+        if category is None:
+            return web.json_response({'error': f'Unknown file type: {file_type}'}, status=400)
+    
+    files = storage.list_room_files(room, limit=limit, before_id=before_id, category=category)
+    
+    return web.json_response({
+        'room': room,
+        'files': [
+            {
+                'id': f.id,
+                'file_name': f.original_filename,
+                'file_url': _download_url(f.filename, user_info['user_id']),
+                'thumbnail_url': (
+                    f"/api/thumbnail/{f.filename}" if f.category == FileCategory.IMAGE else None
+                ),
+                'file_size': f.file_size,
+                'mime_type': f.mime_type,
+                'type': f.category.value,
+                'uploader': f.uploader_username,
+                'uploaded_at': f.uploaded_at.timestamp()
+            }
+            for f in files
+        ],
+        'next_cursor': files[-1].id if len(files) == limit else None
+    })
+
+
+async def handle_room_messages(request: web.Request) -> web.Response:
+    """
+    List a room's messages by sequence number, oldest first.
+    
+    GET /api/rooms/{room}/messages?after_seq=<n>&before_seq=<m>&limit=100
+    
+    Used by clients whose resumed session fell outside the server's replay
+    buffer: they page through the gap by passing the previous response's
+    ``next_after_seq`` as ``after_seq``.
+    """
+    storage = get_storage()
+    
+    # Readable by whoever may join the room's chat (anonymous clients included)
+    user_info = get_request_identity(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    room = request.match_info['room']
+    
+    try:
+        limit = min(max(int(request.query.get('limit', 100)), 1), MAX_PAGE_SIZE)
+        after_seq = int(request.query.get('after_seq', 0))
+        before = request.query.get('before_seq')
+        before_seq = int(before) if before else None
+    except ValueError:
+        return web.json_response({'error': 'Invalid limit or sequence number'}, status=400)
+    
+    messages = storage.get_messages_after(room, after_seq, before_seq=before_seq, limit=limit)
+    
+    return web.json_response({
+        'room': room,
+        'messages': [
+            {
+                'type': m.message_type,
+                'room': m.room,
+                'user': m.username,
+                'text': m.content,
+                'timestamp': m.timestamp.timestamp(),
+                'seq': m.seq
+            }
+            for m in messages
+        ],
+        'next_after_seq': messages[-1].seq if len(messages) == limit else None
+    })
+
+
+async def handle_thumbnail(request: web.Request) -> web.Response:
+    """
+    Serve a downscaled JPEG preview of an uploaded image.
+    
+    GET /api/thumbnail/{filename}
+    
+    Thumbnails are generated on first request in a worker thread and cached
+    on disk next to the uploads. Access follows the same rules as the room
+    gallery that links to them.
+    """
+    config = get_config()
+    
+    user_info = get_request_identity(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    filename = Path(request.match_info.get('filename', '')).name
+    
+    if not filename:
+        return web.json_response({'error': 'Filename required'}, status=400)
+    
+    storage = get_storage()
+    if not storage.get_files_by_name(filename):
+        return web.json_response({'error': 'File not found'}, status=404)
+    if not _can_read_file(storage, user_info, filename):
+        return web.json_response({'error': 'Access denied'}, status=403)
+    
+    source = Path(config.upload_dir) / filename
+    thumb_path = Path(config.upload_dir) / "thumbnails" / f"{filename}.jpg"
+    
+    if not thumb_path.exists():
+        if not source.exists():
+            return web.json_response({'error': 'File not found'}, status=404)
+        try:
+            await asyncio.to_thread(_make_thumbnail, source, thumb_path)
+        except Exception as e:
+            logger.error(f"Thumbnail error for {filename}: {e}")
+            return web.json_response({'error': 'Not an image'}, status=415)
+    
+    return web.FileResponse(thumb_path, headers={'Cache-Control': 'private, max-age=86400'})
+
+
+def _make_thumbnail(source: Path, thumb_path: Path):
+    """Downscale an image to THUMBNAIL_SIZE and save it as JPEG (blocking)."""
+    from PIL import Image
+    
+    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(source) as image:
+        image.draft('RGB', THUMBNAIL_SIZE)  # Fast JPEG downscale on decode
+        image.thumbnail(THUMBNAIL_SIZE)
+        tmp_path = thumb_path.with_suffix('.tmp')
+        image.convert('RGB').save(tmp_path, 'JPEG', quality=80)
+    tmp_path.replace(thumb_path)
+
+
+async def handle_register(request: web.Request) -> web.Response:
+    """
+    Register a new user.
+    
+    POST /api/register with JSON {username, password, email?}
+    
+    Returns JSON with the new user's ID and an auth token. Password hashing
+    runs in the bcrypt worker pool; 503 is returned when it is saturated.
+    """
+    storage = get_storage()
+    auth = get_auth_manager()
+    
+    data = await _json_object(request)
+    if data is None:
+        return web.json_response({'error': 'Expected a JSON object'}, status=400)
+    
+    username = str(data.get('username') or '').strip()
+    password = str(data.get('password') or '')
+    email = data.get('email')
+    
+    if not username or len(username) > MAX_USERNAME_LENGTH:
+        return web.json_response({'error': 'Invalid username'}, status=400)
+    
+    if not password or len(password.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        return web.json_response({'error': f'Password must be 1-{MAX_PASSWORD_BYTES} bytes'}, status=400)
+    
+    if storage.get_user_by_username(username):
+        return web.json_response({'error': 'Username already taken'}, status=409)
+    
+    try:
+        password_hash = await auth.hash_password_async(password)
+    except AuthBusyError:
+        return _auth_busy_response()
+    
+    try:
+        user = storage.create_user(username, password_hash, email)
+    except IntegrityError:
+        # Another request registered the same name while we were hashing
+        return web.json_response({'error': 'Username already taken'}, status=409)
+    
+    logger.info(f"User registered: {username}")
+    
+    return web.json_response({
+        'success': True,
+        'user_id': user.id,
+        'username': user.username,
+        'token': auth.create_token(user.id, user.username)
+    }, status=201)
+
+
+async def handle_login(request: web.Request) -> web.Response:
+    """
+    Log in and get an auth token.
+    
+    POST /api/login with JSON {username, password}
+    
+    Password checks run in the bcrypt worker pool; 503 is returned when it
+    is saturated.
+    """
+    storage = get_storage()
+    auth = get_auth_manager()
+    
+    data = await _json_object(request)
+    if data is None:
+        return web.json_response({'error': 'Expected a JSON object'}, status=400)
+    
+    username = str(data.get('username') or '').strip()
+    password = str(data.get('password') or '')
+    
+    # Refused before the lookup, so the answer is the same for every username
+    if len(password.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        return web.json_response({'error': f'Password must be 1-{MAX_PASSWORD_BYTES} bytes'}, status=400)
+    
+    user = storage.get_user_by_username(username) if username else None
+    password_hash = user.password_hash if user and user.is_active else None
+    
+    try:
+        valid = await auth.verify_password_async(password, password_hash)
+    except AuthBusyError:
+        return _auth_busy_response()
+    
+    if not valid:
+        return web.json_response({'error': 'Invalid username or password'}, status=401)
+    
+    logger.info(f"User logged in: {username}")
+    
+    return web.json_response({
+        'success': True,
+        'user_id': user.id,
+        'username': user.username,
+        'token': auth.create_token(user.id, user.username)
+    })
+
+
+async def _json_object(request: web.Request) -> Optional[Dict[str, Any]]:
+    """Parse a request body that must be a JSON object (None if it is not)."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _auth_busy_response() -> web.Response:
+    """Response for when the bcrypt pool queue is full."""
+    return web.json_response(
+        {'error': 'Server busy, try again shortly'},
+        status=503,
+        headers={'Retry-After': '1'}
+    )
 
 
 async def handle_user_info(request: web.Request) -> web.Response:
@@ -133,14 +558,11 @@ async def handle_user_info(request: web.Request) -> web.Response:
     
     GET /api/user
     """
-    auth = get_auth_manager()
-    
     auth_header = request.headers.get('Authorization')
     if not auth_header:
         return web.json_response({'error': 'Authentication required'}, status=401)
     
-    token = auth.extract_token_from_header(auth_header)
-    user_info = auth.get_user_from_token(token)
+    user_info = get_request_user(request)
     
     if not user_info:
         return web.json_response({'error': 'Invalid token'}, status=401)
@@ -151,6 +573,34 @@ async def handle_user_info(request: web.Request) -> web.Response:
     })
 
 
+async def handle_admin_usage(request: web.Request) -> web.Response:
+    """
+    Report storage usage per user and per room (admins only).
+    
+    GET /api/admin/usage
+    """
+    config = get_config()
+    storage = get_storage()
+    
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+    
+    user_info = get_request_user(request)
+    
+    if not user_info:
+        return web.json_response({'error': 'Invalid token'}, status=401)
+    
+    user = storage.get_user_by_id(user_info['user_id'])
+    if not user or user.role != UserRole.ADMIN:
+        return web.json_response({'error': 'Admin access required'}, status=403)
+    
+    usage = storage.list_usage()
+    usage['user_quota'] = config.user_quota
+    usage['room_quota'] = config.room_quota
+    return web.json_response(usage)
+
+
 async def handle_health(request: web.Request) -> web.Response:
     """Health check endpoint."""
     return web.json_response({'status': 'healthy', 'service': 'BaraChat'})
@@ -158,8 +608,16 @@ async def handle_health(request: web.Request) -> web.Response:
 
 def setup_routes(app: web.Application):
     """Set up REST API routes."""
+    app.router.add_post('/api/register', handle_register)
+    app.router.add_post('/api/login', handle_login)
     app.router.add_post('/api/upload', handle_upload)
+    app.router.add_post('/api/upload/check', handle_upload_check)
     app.router.add_get('/api/download/{filename}', handle_download)
+    app.router.add_get('/api/files/{filename}/url', handle_file_url)
+    app.router.add_get('/api/thumbnail/{filename}', handle_thumbnail)
+    app.router.add_get('/api/rooms/{room:.+}/files', handle_room_files)
+    app.router.add_get('/api/rooms/{room:.+}/messages', handle_room_messages)
     app.router.add_get('/api/user', handle_user_info)
+    app.router.add_get('/api/admin/usage', handle_admin_usage)
     app.router.add_get('/health', handle_health)
 
@@ -0,0 +1,154 @@
+"""Resumable chat sessions: per-room sequence numbers and replay buffers."""
+
+import json
+import secrets
+import time
+import jwt
+from collections import deque, OrderedDict
+from typing import Optional, Callable, Dict, Any, List, Tuple
+from server.config import get_config
+
+
+# Changes on every server start; tokens and sequence numbers from another
+# run cannot be resumed (the client falls back to a history fetch)
+SERVER_EPOCH = secrets.token_hex(8)
+
+
+class RoomLog:
+    """
+    Sequence counter and bounded replay buffer for one room.
+
+    Every broadcast message gets the next sequence number and is kept,
+    already serialized, in a ring buffer so reconnecting clients can be
+    sent just the messages they missed.
+
+    The IDs clients give their messages are remembered too (the newest
+    ``id_window`` of them), so a message resent after a lost
+    acknowledgement is recognized instead of broadcast twice.
+    """
+
+    def __init__(self, size: int, seq: int = 0, id_window: int = 0):
+        self.seq = seq
+        self.idle = False  # No subscribers left; may be evicted
+        self.buffer: deque = deque(maxlen=size)  # (seq, json string)
+        self.id_window = id_window
+        self.ids: OrderedDict = OrderedDict()  # (user, client ID) -> seq
+
+    def append(self, payload: Dict[str, Any]) -> str:
+        """Stamp a payload with the next sequence number and return its JSON."""
+        self.seq += 1
+        payload['seq'] = self.seq
+        data = json.dumps(payload)
+        self.buffer.append((self.seq, data))
+        if payload.get('id'):
+            self.remember(payload.get('user', ''), payload['id'], self.seq)
+        return data
+
+    def remember(self, user: str, client_id: str, seq: int):
+        """Record the sequence number given to a client's message."""
+        self.ids[(user, client_id)] = seq
+        while len(self.ids) > self.id_window:
+            self.ids.popitem(last=False)
+
+    def seq_of(self, user: str, client_id: str) -> Optional[int]:
+        """Sequence number of a message already received with this ID, if any."""
+        return self.ids.get((user, client_id))
+
+    @property
+    def oldest_seq(self) -> int:
+        """Sequence number of the oldest buffered message."""
+        return self.buffer[0][0] if self.buffer else self.seq + 1
+
+    def since(self, last_seq: int) -> Optional[List[str]]:
+        """
+        Get buffered messages newer than ``last_seq``.
+
+        Returns:
+            Serialized messages in order, or None if some of the gap has
+            already been dropped from the buffer
+        """
+        if last_seq >= self.seq:
+            return []
+        if last_seq + 1 < self.oldest_seq:
+            return None
+        return [data for seq, data in self.buffer if seq > last_seq]
+
+
+# Room logs by room name; idle ones in the order they became idle
+ROOM_LOGS: Dict[str, RoomLog] = {}
+
+
+def get_room_log(room: str, last_seq: Optional[Callable[[], int]] = None,
+                 recent_ids: Optional[Callable[[int], List[Tuple[str, str, int]]]] = None) -> RoomLog:
+    """
+    Get (or create) the log of a room.
+
+    Args:
+        room: Room name
+        last_seq: Called once, when the log is created, for the last
+            sequence number already stored; numbering continues from it so
+            clients can keep history across server restarts
+        recent_ids: Called once, when the log is created, with the ID window
+            size for the (user, client ID, seq) of the newest stored
+            messages, newest first; resent messages are then recognized
+            across restarts too
+    """
+    log = ROOM_LOGS.get(room)
+    if log is None:
+        config = get_config()
+        log = ROOM_LOGS[room] = RoomLog(config.replay_buffer_size, last_seq() if last_seq else 0,
+                                        config.message_id_window)
+        if recent_ids:
+            for user, client_id, seq in reversed(recent_ids(config.message_id_window)):
+                log.remember(user, client_id, seq)
+    log.idle = False
+    return log
+
+
+def release_room_log(room: str):
+    """
+    Mark a room's log idle once its last subscriber has left.
+
+    Idle logs still serve reconnecting clients, but beyond the configured
+    limit the ones idle the longest are dropped; a dropped log is created
+    again from storage (sequence number and recent IDs) when next used.
+    """
+    log = ROOM_LOGS.pop(room, None)
+    if log is None:
+        return
+    log.idle = True
+    ROOM_LOGS[room] = log  # Most recently idle last
+
+    excess = len(ROOM_LOGS) - get_config().room_log_limit
+    if excess > 0:
+        for name in [name for name, log in ROOM_LOGS.items() if log.idle][:excess]:
+            del ROOM_LOGS[name]
+
+
+def create_resume_token(room: str, user: str) -> str:
+    """Create a signed token that lets a client resume its session in a room."""
+    config = get_config()
+    payload = {
+        'room': room,
+        'user': user,
+        'epoch': SERVER_EPOCH,
+        'exp': int(time.time()) + config.resume_token_ttl
+    }
+    return jwt.encode(payload, config.jwt_secret, algorithm='HS256')
+
+
+def verify_resume_token(token: str, room: str) -> Optional[Dict[str, Any]]:
+    """
+    Verify a resume token for a room.
+
+    Returns:
+        Token payload, or None if invalid, expired, for another room or
+        issued before the last server restart
+    """
+    try:
+        payload = jwt.decode(token, get_config().jwt_secret, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    if payload.get('room') != room or payload.get('epoch') != SERVER_EPOCH:
+        return None
+    return payload
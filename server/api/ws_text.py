@@ -5,8 +5,7 @@ from aiohttp import web
 from datetime import datetime
 from typing import Set
 from server.config import get_config
-from server.storage import Storage
-from server.auth import get_auth_manager
+from server.auth import get_request_user
 from server.utils.logger import get_logger
 from common.protocol import ChatMessage
 
@@ -32,10 +31,15 @@ async def handle_text_websocket(request: web.Request) -> web.WebSocketResponse:
         "timestamp": 1234567890.0
     }
     
-    Broadcasts messages to all clients in the same room.
+    Broadcasts messages to all clients in the same room. The sender is the
+    identity verified at the handshake; the "user" field is only used for
+    anonymous connections (when allowed).
     """
     config = get_config()
-    storage = Storage()
+    
+    identity = get_request_user(request)
+    if identity is None and not config.allow_anonymous:
+        return web.json_response({'error': 'Authentication required'}, status=401)
     
     ws = web.WebSocketResponse()
     await ws.prepare(request)
@@ -58,7 +62,7 @@ async def handle_text_websocket(request: web.Request) -> web.WebSocketResponse:
                     data = json.loads(msg.data)
                     
                     # Extract message fields
-                    user = data.get("user", "unknown")
+                    user = identity['username'] if identity else data.get("user", "unknown")
                     text = data.get("text", "")
                     msg_type = data.get("type", "text")
                     timestamp = datetime.now().timestamp()
@@ -1,11 +1,23 @@
 """Authentication and authorization."""
 
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
 import jwt
 import bcrypt
+from aiohttp import web
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Mapping
+from urllib.parse import quote, urlencode
 from server.config import get_config
-from server.models import User
+
+
+class AuthBusyError(Exception):
+    """Raised when too many password hashing jobs are already pending."""
 
 
 class AuthManager:
@@ -14,20 +26,93 @@ class AuthManager:
     def __init__(self):
         self.config = get_config()
         self.secret = self.config.jwt_secret
+        
+        # bcrypt runs in a bounded thread pool so it never blocks the event loop
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._dummy_hash: Optional[str] = None
+        
+        # LRU of verified token payloads keyed by SHA-256 of the token
+        self._token_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        
+        # Separate key for download URLs, derived so a URL signature can
+        # never be mistaken for a JWT signature
+        self._url_key = hmac.new(self.secret.encode('utf-8'), b"download-url", hashlib.sha256).digest()
     
     def hash_password(self, password: str) -> str:
-        """Hash a password using bcrypt."""
-        salt = bcrypt.gensalt()
+        """Hash a password using bcrypt (blocking - see hash_password_async)."""
+        salt = bcrypt.gensalt(rounds=self.config.bcrypt_rounds)
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed.decode('utf-8')
     
     def verify_password(self, password: str, password_hash: str) -> bool:
-        """Verify a password against a hash."""
+        """Verify a password against a hash (blocking - see verify_password_async)."""
         return bcrypt.checkpw(
             password.encode('utf-8'),
             password_hash.encode('utf-8')
         )
     
+    async def hash_password_async(self, password: str) -> str:
+        """
+        Hash a password in the bcrypt worker pool.
+        
+        Raises:
+            AuthBusyError: If the pool queue is full
+        """
+        return await self._run_in_pool(self.hash_password, password)
+    
+    async def verify_password_async(self, password: str,
+                                    password_hash: Optional[str]) -> bool:
+        """
+        Verify a password in the bcrypt worker pool.
+        
+        When ``password_hash`` is None (unknown user) a dummy hash is checked
+        so the response time does not reveal whether the account exists.
+        
+        Raises:
+            AuthBusyError: If the pool queue is full
+        """
+        if password_hash is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = await self.hash_password_async("dummy-password")
+            try:
+                await self._run_in_pool(self.verify_password, password, self._dummy_hash)
+            except ValueError:
+                pass  # Same outcome as for a known user
+            return False
+        
+        try:
+            return await self._run_in_pool(self.verify_password, password, password_hash)
+        except ValueError:
+            return False  # Malformed hash or overlong password
+    
+    async def _run_in_pool(self, func: Callable, *args):
+        """Run a blocking bcrypt call in the worker pool, refusing work when saturated."""
+        if self._pending >= self.config.auth_workers + self.config.auth_queue_size:
+            raise AuthBusyError("Too many pending authentication requests")
+        
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.config.auth_workers,
+                thread_name_prefix="bcrypt"
+            )
+        
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        job = self._executor.submit(func, *args)
+        # Count the job until the thread is really done, even if the caller gives up
+        job.add_done_callback(lambda _: self._job_done(loop))
+        return await asyncio.wrap_future(job)
+    
+    def _job_done(self, loop: asyncio.AbstractEventLoop):
+        """Release a pool slot (called from the worker thread)."""
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._release_slot)
+    
+    def _release_slot(self):
+        """Decrement the pending job count on the event loop thread."""
+        self._pending -= 1
+    
     def create_token(self, user_id: int, username: str, 
                     expires_in: int = 24 * 60 * 60) -> str:
         """
@@ -54,19 +139,35 @@ class AuthManager:
         """
         Verify and decode a JWT token.
         
+        Tokens that verified before are served from a small LRU cache until
+        their ``exp`` passes, so repeat requests skip the HMAC and JSON decode.
+        
         Args:
             token: JWT token string
             
         Returns:
             Decoded payload or None if invalid
         """
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        
+        cached = self._token_cache.get(key)
+        if cached is not None:
+            if cached.get('exp', 0) > time.time():
+                self._token_cache.move_to_end(key)
+                return cached
+            del self._token_cache[key]
+        
         try:
             payload = jwt.decode(token, self.secret, algorithms=['HS256'])
-            return payload
         except jwt.ExpiredSignatureError:
             return None
         except jwt.InvalidTokenError:
             return None
+        
+        self._token_cache[key] = payload
+        if len(self._token_cache) > self.config.token_cache_size:
+            self._token_cache.popitem(last=False)
+        return payload
     
     def extract_token_from_header(self, auth_header: Optional[str]) -> Optional[str]:
         """
@@ -91,6 +192,48 @@ class AuthManager:
                 'username': payload.get('username')
             }
         return None
+    
+    def sign_download_url(self, path: str, user_id: Optional[int] = None,
+                          expires_in: Optional[int] = None) -> str:
+        """
+        Create a short-lived signed URL for a download path.
+        
+        The URL carries its own expiry and an HMAC over path, expiry and user,
+        so serving it needs no token check or database lookup.
+        
+        Args:
+            path: Unquoted download path (e.g. "/api/download/name.png")
+            user_id: User the URL is minted for (kept for attribution)
+            expires_in: Lifetime in seconds (default: config.download_url_ttl)
+            
+        Returns:
+            Quoted path with ``exp``, ``uid`` and ``sig`` query parameters
+        """
+        expires = int(time.time()) + (expires_in or self.config.download_url_ttl)
+        uid = "" if user_id is None else str(user_id)
+        params = {'exp': str(expires), 'uid': uid, 'sig': self._url_signature(path, str(expires), uid)}
+        return f"{quote(path)}?{urlencode(params)}"
+    
+    def verify_download_url(self, path: str, query: Mapping[str, str]) -> bool:
+        """
+        Check the signature and expiry of a signed download URL.
+        
+        Args:
+            path: Unquoted request path
+            query: Request query parameters
+        """
+        expires = query.get('exp', '')
+        signature = query.get('sig', '')
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        expected = self._url_signature(path, expires, query.get('uid', ''))
+        return hmac.compare_digest(expected, signature)
+    
+    def _url_signature(self, path: str, expires: str, uid: str) -> str:
+        """URL-safe HMAC-SHA256 of a download path, expiry and user."""
+        message = f"{path}\n{expires}\n{uid}".encode('utf-8')
+        digest = hmac.new(self._url_key, message, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
 
 
 # Global auth manager instance
@@ -104,3 +247,61 @@ def get_auth_manager() -> AuthManager:
         _auth_manager = AuthManager()
     return _auth_manager
 
+
+
+REQUEST_USER_KEY = "user"
+
+
+def get_request_user(request: web.Request) -> Optional[Dict[str, Any]]:
+    """
+    Get the authenticated user of a request, verifying its token at most once.
+    
+    The token comes from the ``Authorization: Bearer`` header. WebSocket
+    upgrade requests may pass it as a ``?token=`` query parameter instead.
+    
+    Returns:
+        User info dict ({user_id, username}) or None if unauthenticated
+    """
+    if REQUEST_USER_KEY not in request:
+        auth = get_auth_manager()
+        token = auth.extract_token_from_header(request.headers.get('Authorization'))
+        if not token and request.headers.get('Upgrade', '').lower() == 'websocket':
+            token = request.query.get('token')
+        request[REQUEST_USER_KEY] = auth.get_user_from_token(token) if token else None
+    return request[REQUEST_USER_KEY]
+
+
+ANONYMOUS_USER_ID = 0  # Owner of files and messages from clients without a token
+ANONYMOUS_USERNAME = "anonymous"
+
+
+def get_request_identity(request: web.Request) -> Optional[Dict[str, Any]]:
+    """
+    Get who a REST request acts as.
+
+    Same policy as the WebSocket endpoints: the authenticated user, or,
+    when ``allow_anonymous`` is set and no token was sent, an anonymous
+    identity (user ID ANONYMOUS_USER_ID, which shares one storage quota).
+
+    Returns:
+        User info dict ({user_id, username}) or None if the request must be
+        refused (invalid token, or anonymous access disabled)
+    """
+    user = get_request_user(request)
+    if user is not None:
+        return user
+    if request.headers.get('Authorization') or not get_config().allow_anonymous:
+        return None
+    return {'user_id': ANONYMOUS_USER_ID, 'username': ANONYMOUS_USERNAME}
+
+
+@web.middleware
+async def auth_middleware(request: web.Request, handler):
+    """
+    Resolve the caller's identity once per request.
+    
+    For WebSockets this runs once at the handshake; handlers bind the result
+    to the connection instead of trusting the ``user`` field of each message.
+    """
+    get_request_user(request)
+    return await handler(request)
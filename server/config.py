@@ -23,10 +23,24 @@ class ServerConfig:
     
     # Security
     jwt_secret: str = "change-me-in-production"
+    bcrypt_rounds: int = 12  # bcrypt cost factor (2^rounds iterations)
+    auth_workers: int = 4  # Threads running bcrypt
+    auth_queue_size: int = 64  # Pending bcrypt jobs before answering 503
+    token_cache_size: int = 1024  # Verified JWTs kept in memory
+    allow_anonymous: bool = True  # Accept WebSocket clients without a token
+    download_url_ttl: int = 15 * 60  # seconds a signed download URL stays valid
     max_file_size: int = 50 * 1024 * 1024  # 50 MB
     
+    # Storage quotas in bytes (0 = unlimited)
+    user_quota: int = 1024 * 1024 * 1024  # 1 GB per uploader
+    room_quota: int = 5 * 1024 * 1024 * 1024  # 5 GB per room, LRU-evicted
+    
     # WebSocket
     ws_timeout: int = 30  # seconds
+    replay_buffer_size: int = 500  # Recent messages kept per room for resumed sessions
+    resume_token_ttl: int = 3600  # seconds a disconnected client may resume
+    message_id_window: int = 2000  # Client message IDs remembered per room to drop resent messages
+    room_log_limit: int = 1000  # Room logs kept in memory; the oldest idle ones beyond it are dropped
 
 
 # Global configuration instance
@@ -47,7 +61,19 @@ def load_config() -> ServerConfig:
             cert_file=os.getenv("BARA_CERT_FILE"),
             key_file=os.getenv("BARA_KEY_FILE"),
             jwt_secret=os.getenv("BARA_JWT_SECRET", "change-me-in-production"),
+            bcrypt_rounds=int(os.getenv("BARA_BCRYPT_ROUNDS", "12")),
+            auth_workers=int(os.getenv("BARA_AUTH_WORKERS", "4")),
+            auth_queue_size=int(os.getenv("BARA_AUTH_QUEUE_SIZE", "64")),
+            token_cache_size=int(os.getenv("BARA_TOKEN_CACHE_SIZE", "1024")),
+            allow_anonymous=os.getenv("BARA_ALLOW_ANONYMOUS", "true").lower() == "true",
+            download_url_ttl=int(os.getenv("BARA_DOWNLOAD_URL_TTL", str(15 * 60))),
             max_file_size=int(os.getenv("BARA_MAX_FILE_SIZE", str(50 * 1024 * 1024))),
+            user_quota=int(os.getenv("BARA_USER_QUOTA", str(1024 * 1024 * 1024))),
+            room_quota=int(os.getenv("BARA_ROOM_QUOTA", str(5 * 1024 * 1024 * 1024))),
+            replay_buffer_size=int(os.getenv("BARA_REPLAY_BUFFER_SIZE", "500")),
+            resume_token_ttl=int(os.getenv("BARA_RESUME_TOKEN_TTL", "3600")),
+            message_id_window=int(os.getenv("BARA_MESSAGE_ID_WINDOW", "2000")),
+            room_log_limit=int(os.getenv("BARA_ROOM_LOG_LIMIT", "1000")),
         )
         
         # Create upload directory if it doesn't exist
@@ -5,32 +5,78 @@
 # It handles WebSocket connections, broadcasts messages to all connected clients,
 # and listens on port 8765 (localhost only by default).
 # ===============================
-import asyncio    # pyright: ignore[reportUnusedImport]
+import asyncio
 import json
+import sys
+import time
+from pathlib import Path
 from aiohttp import web  # async web framework
 
+# Add project root to path so "server.*" imports work when run from server/
+project_root = Path(__file__).parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from server.api.rest import (  # account, file and history endpoints
+    handle_admin_usage, handle_download, handle_file_url, handle_login, handle_register,
+    handle_room_files, handle_room_messages, handle_thumbnail, handle_upload, handle_upload_check
+)
+from server.auth import ANONYMOUS_USER_ID, auth_middleware, get_request_user  # token verified once per connection
+from server.config import get_config
+from server.api.sessions import get_room_log, release_room_log, create_resume_token, verify_resume_token
+from server.storage import get_storage
+from server.voice.sfu import get_sfu  # forwards voice without decoding
+from server.voice.signaling import join_signaling, leave_signaling, route_signal  # peer-addressed signaling
+
 # -------------------------------
-# 🔸 Global dictionary that keeps the list of WebSockets by "room"
-# Structure : { "room_name": set(websockets) }
+# 🔸 Global dictionaries of the chat connections
+# Structure : { "room_name": set(websockets) } and { websocket: set(room names) }
+# One connection can be subscribed to any number of rooms; the second index
+# lets a disconnect clean up only the rooms it was in
 ROOMS = {}
+CONNECTION_ROOMS = {}
+
+CONTROL_TYPES = ("subscribe", "unsubscribe", "batch")  # Frames that are not chat messages
+MAX_CLIENT_ID_LENGTH = 64
 
 # -------------------------------
 # 🔹 Main WebSocket handling function
 async def handle_ws(request):
     """
     This function is called when a client connects to /ws.
-    It handles receiving and broadcasting messages.
+    It handles room subscriptions, receiving and broadcasting messages.
+
+    Frames from the client:
+    - {"type": "subscribe", "room", "resume"?, "last_seq"?} starts receiving a room
+    - {"type": "unsubscribe", "room"} stops it
+    - chat messages carry the "room" they are sent to, and optionally an
+      "id" chosen by the client: a message resent with an ID already seen
+      is not broadcast again, the sender just gets an "ack" with its seq
+    - {"type": "batch", "messages": [...]} carries several chat messages
+      (a reconnecting client flushing what it queued while offline)
+    Every frame from the server is tagged with its "room".
     """
+    # The identity was verified once at the handshake by auth_middleware;
+    # messages are attributed to it instead of their "user" field
+    identity = get_request_user(request)
+    if identity is None and not get_config().allow_anonymous:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+
     ws = web.WebSocketResponse()   # creates a WebSocket object for this connection
     await ws.prepare(request)      # establishes the WS connection on the server side
 
-    # Gets the room name from the URL parameters (ex: ?room=general)
-    room = request.query.get("room", "general")
+    username = identity["username"] if identity else ""
+    CONNECTION_ROOMS[ws] = set()
 
-    # Adds the WS to the list of connections for this room
-    ROOMS.setdefault(room, set()).add(ws)
+    # The URL can name a first room to subscribe to (ex: ?room=general), with
+    # the resume token and last sequence number of a reconnecting client
+    # (ex: ?room=general&resume=<token>&last_seq=42)
+    default_room = request.query.get("room")
+    if default_room:
+        await subscribe(ws, default_room, username,
+                        request.query.get("resume", ""), request.query.get("last_seq"))
 
-    print(f"[+] New connection in room '{room}'")
+    print("[+] New connection" + (f" in room '{default_room}'" if default_room else ""))
 
     # Main receiving loop
     try:
@@ -39,70 +85,220 @@ async def handle_ws(request):
             if msg.type == web.WSMsgType.TEXT:
                 # Converts the received JSON text to a Python object
                 data = json.loads(msg.data)
+                msg_type = data.get("type", "text")
+                if msg_type == "batch":
+                    # Messages a client queued while offline, flushed in one frame
+                    messages = data.get("messages", [])
+                    if not isinstance(messages, list):
+                        await ws.send_str(json.dumps({"type": "error", "error": "Invalid batch"}))
+                        continue
+                    for message in messages:
+                        if isinstance(message, dict) and message.get("type", "text") not in CONTROL_TYPES:
+                            await post_message(ws, identity, message, message.get("room") or default_room)
+                    continue
+                room = data.get("room") or default_room
+                if not isinstance(room, str) or not room:
+                    await ws.send_str(json.dumps({"type": "error", "error": "No room"}))
+                    continue
 
-                # Prepares an output message to broadcast to everyone
-                import time
-                payload = {
-                    "type": data.get("type", "text"),
-                    "room": room,
-                    "user": data.get("user", "unknown"),
-                    "text": data.get("text", ""),
-                    "timestamp": time.time(),
-                }
-                
-                # Add file info if it's a file message
-                if data.get("type") == "file":
-                    payload["file_info"] = data.get("file_info", {})
-
-                # Sends this message to all clients connected to the same room
-                for peer in list(ROOMS[room]):
-                    if not peer.closed:
-                        await peer.send_str(json.dumps(payload))
+                if msg_type == "subscribe":
+                    last_seq = data.get("last_seq")
+                    if last_seq is not None and (not isinstance(last_seq, int) or isinstance(last_seq, bool)):
+                        await ws.send_str(json.dumps({"type": "error", "room": room, "error": "Invalid last_seq"}))
+                        continue
+                    await subscribe(ws, room, username, data.get("resume", ""), last_seq)
+                    continue
+                if msg_type == "unsubscribe":
+                    unsubscribe(ws, room)
+                    await ws.send_str(json.dumps({"type": "unsubscribed", "room": room}))
+                    continue
+                await post_message(ws, identity, data, room)
 
             elif msg.type == web.WSMsgType.ERROR:
                 print(f"[!] WS Error : {ws.exception()}")
 
     finally:
-        # When the client disconnects, we remove them from the room
-        ROOMS[room].discard(ws)
-        print(f"[-] Disconnection from room '{room}'")
+        # When the client disconnects, we remove it from its rooms
+        rooms = CONNECTION_ROOMS.get(ws, set())
+        print(f"[-] Disconnection from {len(rooms)} room(s)")
+        for room in list(rooms):
+            unsubscribe(ws, room)
+        CONNECTION_ROOMS.pop(ws, None)
 
     return ws  # We return the WebSocketResponse (required for aiohttp)
 
 
+async def post_message(ws, identity, data, room):
+    """Broadcast a chat message from a connection to the room, unless it was already received."""
+    if not isinstance(room, str) or room not in CONNECTION_ROOMS[ws]:
+        await ws.send_str(json.dumps({"type": "error", "room": room, "error": "Not subscribed"}))
+        return
+
+    msg_type = data.get("type", "text")
+    user = identity["username"] if identity else data.get("user", "unknown")
+    log = room_log(room)
+
+    # A resent message (its acknowledgement was lost with the connection)
+    # is only acknowledged again
+    client_id = data.get("id")
+    if client_id is not None:
+        client_id = str(client_id)[:MAX_CLIENT_ID_LENGTH]
+        seq = log.seq_of(user, client_id)
+        if seq is not None:
+            await ws.send_str(json.dumps({"type": "ack", "room": room, "id": client_id, "seq": seq}))
+            return
+
+    # Prepares an output message to broadcast to everyone
+    payload = {
+        "type": msg_type,
+        "room": room,
+        "user": user,
+        "text": data.get("text", ""),
+        "timestamp": time.time(),
+    }
+    if client_id is not None:
+        payload["id"] = client_id  # Acknowledges the message to its sender
+    
+    # Add file info if it's a file message
+    if msg_type == "file":
+        payload["file_info"] = data.get("file_info", {})
+
+    # Stamps the next sequence number and keeps it for replay
+    message = log.append(payload)
+
+    # Sends this message to all clients subscribed to the room
+    for peer in list(ROOMS[room]):
+        if not peer.closed:
+            await peer.send_str(message)
+
+    # Kept for history backfill (anonymous messages under the reserved anonymous user ID)
+    await save_message(room, identity or {"user_id": ANONYMOUS_USER_ID, "username": user}, payload)
+
+
+async def subscribe(ws, room, username, resume_token="", last_seq=None):
+    """
+    Subscribe a connection to a room, replaying what it missed first.
+
+    The connection is sent a "session" frame for the room, then the gap
+    after ``last_seq`` if it resumes a session with a valid token.
+    """
+    log = room_log(room)
+    session = verify_resume_token(resume_token or "", room)
+    if session is not None and username and session.get("user") != username:
+        session = None  # Token issued to someone else
+    try:
+        last_seq = int(last_seq if last_seq is not None else log.seq) if session else log.seq
+    except ValueError:
+        last_seq = log.seq
+
+    await ws.send_str(json.dumps({
+        "type": "session",
+        "room": room,
+        "resume_token": create_resume_token(room, username),
+        "seq": log.seq,
+        "resumed": session is not None,
+    }))
+
+    # Replay only the gap; messages that already left the replay buffer are
+    # announced with a "resync" so the client fetches them from history.
+    # The connection joins the room once caught up, with no await in
+    # between, so live broadcasts never overtake the replay.
+    while last_seq < log.seq:
+        missed = log.since(last_seq)
+        if missed is None:
+            await ws.send_str(json.dumps({
+                "type": "resync",
+                "room": room,
+                "after_seq": last_seq,
+                "before_seq": log.oldest_seq,
+            }))
+            last_seq = log.oldest_seq - 1
+            continue
+        for data in missed:
+            await ws.send_str(data)
+        last_seq += len(missed)
+
+    ROOMS.setdefault(room, set()).add(ws)
+    CONNECTION_ROOMS.setdefault(ws, set()).add(room)
+
+
+def unsubscribe(ws, room):
+    """Stop sending a room's messages to a connection."""
+    CONNECTION_ROOMS.get(ws, set()).discard(room)
+    members = ROOMS.get(room)
+    if members is not None:
+        members.discard(ws)
+        if not members:
+            del ROOMS[room]
+            release_room_log(room)
+
+
+def room_log(room):
+    """Get the log of a room, loading its state from storage if it is not in memory."""
+    # The first use of a room since startup (or since its idle log was
+    # dropped) reads its last stored sequence number (one indexed lookup)
+    return get_room_log(room, lambda: get_storage().get_last_seq(room),
+                        lambda limit: get_storage().get_recent_client_ids(room, limit))
+
+
+async def save_message(room, identity, payload):
+    """Persist a broadcast message (in a thread, so SQLite never blocks the loop)."""
+    try:
+        await asyncio.to_thread(
+            get_storage().save_message,
+            room, identity["user_id"], identity["username"], payload["text"],
+            message_type=payload["type"], seq=payload["seq"], client_id=payload.get("id"),
+        )
+    except Exception as e:
+        print(f"[!] Could not save message: {e}")
+
+
 # -------------------------------
 # 🔹 Voice signaling WebSocket handler
-SIGNALING_ROOMS = {}
-
 async def handle_voice_signaling(request):
     """
     WebSocket handler for WebRTC voice signaling.
     Handles SDP offers/answers and ICE candidates.
+    Messages with a "to" peer ID go only to that peer.
     """
+    identity = get_request_user(request)
+    if identity is None and not get_config().allow_anonymous:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+
     ws = web.WebSocketResponse()
     await ws.prepare(request)
     
     room = request.query.get("room", "general")
+    user = identity["username"] if identity else request.query.get("user", "unknown")
+    
+    # Gets a peer ID and the room roster; the others hear "peer_joined"
+    peer_id = await join_signaling(room, user, ws)
     
-    if room not in SIGNALING_ROOMS:
-        SIGNALING_ROOMS[room] = set()
-    SIGNALING_ROOMS[room].add(ws)
+    # Each connection is also a potential SFU participant
+    sfu = get_sfu()
+    await sfu.join(room, peer_id, ws.send_json)
     
-    print(f"[Voice] New signaling connection in room '{room}'")
+    print(f"[Voice] New signaling connection in room '{room}' (peer {peer_id})")
     
     try:
         async for msg in ws:
             if msg.type == web.WSMsgType.TEXT:
-                # Broadcast signaling message to other peers in room
-                for peer in list(SIGNALING_ROOMS.get(room, set())):
-                    if peer != ws and not peer.closed:
-                        try:
-                            await peer.send_str(msg.data)
-                        except Exception as e:
-                            print(f"[Voice] Error forwarding signal: {e}")
+                try:
+                    data = json.loads(msg.data)
+                except json.JSONDecodeError:
+                    continue
+
+                # SFU negotiation is answered by the server itself
+                if str(data.get("type", "")).startswith("sfu_"):
+                    await sfu.handle_message(peer_id, data)
+                    continue
+
+                # Delivers to the addressed peer (or the whole room)
+                await route_signal(peer_id, data)
     
     finally:
-        SIGNALING_ROOMS[room].discard(ws)
+        await leave_signaling(peer_id)
+        await sfu.leave(peer_id)
         print(f"[Voice] Disconnected from room '{room}'")
     
     return ws
@@ -114,76 +310,26 @@ async def handle_root(request):
     return web.Response(text="LocalCord Server Active ✅")
 
 
-# -------------------------------
-# 🔹 Main function that starts the server
-# Simple in-memory file storage
-UPLOADED_FILES = {}  # {filename: (content, mime_type)}
-
-async def handle_upload(request):
-    """Handle file upload."""
-    data = await request.post()
-    file_obj = data.get('file')
-    room = data.get('room', 'general')
-    
-    if not file_obj:
-        return web.json_response({'error': 'No file provided'}, status=400)
-    
-    filename = file_obj.filename
-    file_content = file_obj.file.read()
-    
-    # Store file
-    UPLOADED_FILES[filename] = (file_content, file_obj.content_type or 'application/octet-stream')
-    
-    file_url = f"/download/{filename}"
-    
-    print(f"[Upload] File uploaded: {filename} ({len(file_content)} bytes) in room '{room}'")
-    
-    return web.json_response({
-        'success': True,
-        'file_url': file_url,
-        'filename': filename,
-        'file_size': len(file_content)
-    })
-
-async def handle_download(request):
-    """Handle file download."""
-    from urllib.parse import unquote
-    
-    filename = request.match_info.get('filename')
-    
-    # Decode URL-encoded filename
-    decoded_filename = unquote(filename)
-    
-    # Try both encoded and decoded versions
-    file_key = None
-    if decoded_filename in UPLOADED_FILES:
-        file_key = decoded_filename
-    elif filename in UPLOADED_FILES:
-        file_key = filename
-    
-    if not file_key:
-        print(f"[Download] File not found: {decoded_filename}")
-        return web.json_response({'error': 'File not found'}, status=404)
-    
-    content, mime_type = UPLOADED_FILES[file_key]
-    
-    print(f"[Download] Serving file: {file_key} ({len(content)} bytes)")
-    
-    return web.Response(
-        body=content,
-        content_type=mime_type,
-        headers={
-            'Content-Disposition': f'attachment; filename="{file_key}"'
-        }
-    )
+async def stop_sfu(app):
+    await get_sfu().stop()
+
 
 def create_app():
-    app = web.Application()               # Creates the aiohttp application
+    app = web.Application(middlewares=[auth_middleware])  # Creates the aiohttp application
     app.router.add_get("/", handle_root)  # GET route for /
     app.router.add_get("/ws", handle_ws)  # GET route for text chat WebSocket
     app.router.add_get("/voice", handle_voice_signaling)  # GET route for voice signaling
-    app.router.add_post("/api/upload", handle_upload)  # POST route for file upload
-    app.router.add_get("/download/{filename}", handle_download)  # GET route for file download
+    app.router.add_post("/api/upload", handle_upload)  # POST route for file upload (stored on disk, deduplicated)
+    app.router.add_post("/api/upload/check", handle_upload_check)  # POST route for upload-by-hash
+    app.router.add_get("/api/download/{filename}", handle_download)  # GET route for file download (signed URL)
+    app.router.add_get("/api/files/{filename}/url", handle_file_url)  # GET route for a fresh signed URL
+    app.router.add_get("/api/thumbnail/{filename}", handle_thumbnail)  # GET route for image previews
+    app.router.add_get("/api/rooms/{room:.+}/files", handle_room_files)  # GET route for the room gallery
+    app.router.add_post("/api/register", handle_register)  # POST route for account creation
+    app.router.add_post("/api/login", handle_login)  # POST route for login (returns a JWT)
+    app.router.add_get("/api/rooms/{room:.+}/messages", handle_room_messages)  # GET route for history backfill
+    app.router.add_get("/api/admin/usage", handle_admin_usage)  # GET route for storage usage (admins only)
+    app.on_shutdown.append(stop_sfu)  # closes voice peer connections
     return app
 
 
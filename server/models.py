@@ -3,6 +3,7 @@
 from datetime import datetime
 from typing import Optional
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import Index
 from enum import Enum
 
 
@@ -28,6 +29,11 @@ class User(SQLModel, table=True):
 
 class Message(SQLModel, table=True):
     """Chat message model."""
+    __table_args__ = (
+        # History backfill after a resumed session: messages of a room by sequence
+        Index("ix_message_room_seq", "room", "seq"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     room: str = Field(index=True)
     user_id: int = Field(foreign_key="user.id")
@@ -37,6 +43,8 @@ class Message(SQLModel, table=True):
     file_url: Optional[str] = None
     file_size: Optional[int] = None
     timestamp: datetime = Field(default_factory=datetime.now, index=True)
+    seq: Optional[int] = None  # Per-room sequence number stamped by the server
+    client_id: Optional[str] = None  # ID given by the sending client, to drop resent copies
     is_encrypted: bool = False
 
 
@@ -51,17 +59,69 @@ class Room(SQLModel, table=True):
     member_count: int = 0
 
 
+class FileCategory(str, Enum):
+    """Coarse file type used for gallery filtering."""
+    IMAGE = "image"
+    DOCUMENT = "document"
+    OTHER = "other"
+
+
+DOCUMENT_MIME_TYPES = {
+    "application/pdf",
+    "application/msword",
+    "application/rtf",
+    "application/vnd.oasis.opendocument.text",
+    "application/vnd.oasis.opendocument.spreadsheet",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+}
+
+
+def file_category(mime_type: str) -> FileCategory:
+    """Classify a MIME type for gallery filtering."""
+    mime_type = (mime_type or "").lower()
+    if mime_type.startswith("image/"):
+        return FileCategory.IMAGE
+    if mime_type.startswith("text/") or mime_type in DOCUMENT_MIME_TYPES:
+        return FileCategory.DOCUMENT
+    return FileCategory.OTHER
+
+
 class File(SQLModel, table=True):
     """Uploaded file model."""
+    __table_args__ = (
+        # Room gallery: keyset pages by id, optionally filtered by category
+        Index("ix_file_room_id", "room", "id"),
+        Index("ix_file_room_category_id", "room", "category", "id"),
+        # Per-uploader listings
+        Index("ix_file_uploader_uploaded_at", "uploader_id", "uploaded_at"),
+        # LRU eviction scans a room's files by last access
+        Index("ix_file_room_last_accessed", "room", "last_accessed"),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str
     original_filename: str
     file_path: str
     file_size: int
     mime_type: str
+    category: FileCategory = FileCategory.OTHER
+    sha256: Optional[str] = Field(default=None, index=True)  # Content hash for dedup
     uploader_id: int = Field(foreign_key="user.id")
     uploader_username: str
     room: str
     uploaded_at: datetime = Field(default_factory=datetime.now)
+    last_accessed: datetime = Field(default_factory=datetime.now)  # Last download
     is_encrypted: bool = False
 
+
+class StorageUsage(SQLModel, table=True):
+    """Running byte totals for quota checks, updated on every file add/remove."""
+    scope: str = Field(primary_key=True)  # "user" or "room"
+    owner: str = Field(primary_key=True)  # User ID or room name
+    bytes_used: int = 0
+    file_count: int = 0
+
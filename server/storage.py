@@ -1,21 +1,41 @@
 """Database storage and file handling."""
 
 import aiofiles
+import hashlib
+import threading
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
+from sqlalchemy import func, update
 from sqlmodel import SQLModel, create_engine, Session, select
-from server.models import User, Message, Room, File, UserRole
+from server.models import (
+    User, Message, Room, File, FileCategory, StorageUsage, UserRole, file_category
+)
 from server.config import get_config
+from server.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class QuotaExceededError(Exception):
+    """Raised when a file does not fit in its uploader's or its room's storage quota."""
 
 
 class Storage:
     """Database and file storage manager."""
     
-    def __init__(self):
+    def __init__(self, db_path: Optional[str] = None, upload_dir: Optional[str] = None):
         self.config = get_config()
-        self.engine = create_engine(f"sqlite:///{self.config.db_path}")
+        self.upload_dir = Path(upload_dir or self.config.upload_dir)
+        self.engine = create_engine(f"sqlite:///{db_path or self.config.db_path}")
         self._initialized = False
+        
+        # Download times not yet written to the database, by filename
+        self._touched: Dict[str, datetime] = {}
+        
+        # Quota check, file record and eviction run as one step
+        self._quota_lock = threading.Lock()
     
     def initialize(self):
         """Initialize database tables."""
@@ -58,7 +78,9 @@ class Storage:
     def save_message(self, room: str, user_id: int, username: str, 
                     content: str, message_type: str = "text",
                     file_url: Optional[str] = None,
-                    file_size: Optional[int] = None) -> Message:
+                    file_size: Optional[int] = None,
+                    seq: Optional[int] = None,
+                    client_id: Optional[str] = None) -> Message:
         """Save a message to the database."""
         with self.get_session() as session:
             message = Message(
@@ -68,7 +90,9 @@ class Storage:
                 content=content,
                 message_type=message_type,
                 file_url=file_url,
-                file_size=file_size
+                file_size=file_size,
+                seq=seq,
+                client_id=client_id
             )
             session.add(message)
             session.commit()
@@ -83,6 +107,43 @@ class Storage:
             ).order_by(Message.timestamp.desc()).limit(limit)
             return list(session.exec(statement).all())
     
+    def get_messages_after(self, room: str, after_seq: int,
+                           before_seq: Optional[int] = None,
+                           limit: int = 100) -> List[Message]:
+        """
+        Get a room's messages with a sequence number above ``after_seq``, oldest first.
+        
+        Args:
+            room: Room name
+            after_seq: Exclusive lower bound (the last sequence number seen)
+            before_seq: Exclusive upper bound, if any
+            limit: Maximum number of messages
+        """
+        with self.get_session() as session:
+            statement = select(Message).where(
+                Message.room == room,
+                Message.seq > after_seq
+            )
+            if before_seq is not None:
+                statement = statement.where(Message.seq < before_seq)
+            statement = statement.order_by(Message.seq).limit(limit)
+            return list(session.exec(statement).all())
+    
+    def get_last_seq(self, room: str) -> int:
+        """Get the highest sequence number stored for a room (0 if none)."""
+        with self.get_session() as session:
+            statement = select(func.max(Message.seq)).where(Message.room == room)
+            return session.exec(statement).one() or 0
+    
+    def get_recent_client_ids(self, room: str, limit: int) -> List[tuple]:
+        """Get the (username, client ID, seq) of a room's newest messages sent with an ID, newest first."""
+        with self.get_session() as session:
+            statement = select(Message.username, Message.client_id, Message.seq).where(
+                Message.room == room,
+                Message.client_id.is_not(None)
+            ).order_by(Message.seq.desc()).limit(limit)
+            return list(session.exec(statement).all())
+    
     # Room operations
     def create_room(self, name: str, owner_id: int, 
                    description: Optional[str] = None) -> Room:
@@ -108,31 +169,284 @@ class Storage:
     async def save_file(self, filename: str, content: bytes,
                        uploader_id: int, uploader_username: str,
                        room: str, mime_type: str) -> str:
-        """Save uploaded file and return its path."""
+        """
+        Save uploaded file and return its path.
+        
+        The blob is written before the quotas are charged, so the room's
+        old files are only evicted for a file that is really stored.
+        
+        Raises:
+            QuotaExceededError: If the file does not fit (nothing is kept)
+        """
+        # Reuse the blob if identical content is already stored
+        sha256 = hashlib.sha256(content).hexdigest()
+        existing = self.get_file_by_hash(sha256)
+        if existing:
+            self.link_file(existing, filename, uploader_id, uploader_username, room)
+            return existing.file_path
+        
+        # Cheap early rejection; the authoritative check runs with the record
+        self.check_quota(uploader_id, room, len(content))
+        
         # Create unique filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         safe_filename = Path(filename).name
         unique_filename = f"{timestamp}_{safe_filename}"
-        file_path = Path(self.config.upload_dir) / unique_filename
+        file_path = self.upload_dir / unique_filename
         
         # Write file asynchronously
         async with aiofiles.open(file_path, 'wb') as f:
             await f.write(content)
         
         # Save file metadata to database
-        with self.get_session() as session:
-            file_record = File(
+        try:
+            self._record_file(File(
                 filename=unique_filename,
                 original_filename=safe_filename,
                 file_path=str(file_path),
                 file_size=len(content),
                 mime_type=mime_type,
+                category=file_category(mime_type),
+                sha256=sha256,
                 uploader_id=uploader_id,
                 uploader_username=uploader_username,
                 room=room
-            )
-            session.add(file_record)
-            session.commit()
+            ))
+        except QuotaExceededError:
+            file_path.unlink(missing_ok=True)
+            raise
         
         return str(file_path)
+    
+    def get_file_by_hash(self, sha256: str) -> Optional[File]:
+        """Get a stored file with the given content hash."""
+        with self.get_session() as session:
+            statement = select(File).where(File.sha256 == sha256.lower()).limit(1)
+            return session.exec(statement).first()
+    
+    def link_file(self, existing: File, filename: str,
+                  uploader_id: int, uploader_username: str, room: str) -> File:
+        """
+        Create a file record that shares the blob of an existing file.
+        
+        Used for upload-by-hash: no bytes are written, the new record points
+        at the same path on disk. The share is still charged its full size
+        to the uploader and the room, as if it were a copy: a quota limits
+        what a user or room references, so usage does not depend on who
+        else happens to share a blob, and evicting one share never changes
+        anyone else's usage.
+        
+        Raises:
+            QuotaExceededError: If the share does not fit
+        """
+        return self._record_file(File(
+            filename=existing.filename,
+            original_filename=Path(filename).name,
+            file_path=existing.file_path,
+            file_size=existing.file_size,
+            mime_type=existing.mime_type,
+            category=existing.category,
+            sha256=existing.sha256,
+            uploader_id=uploader_id,
+            uploader_username=uploader_username,
+            room=room
+        ))
+    
+    def get_files_by_name(self, filename: str) -> List[File]:
+        """Get the records of a stored file (one per room it was shared to)."""
+        with self.get_session() as session:
+            return list(session.exec(select(File).where(File.filename == filename)).all())
+    
+    def list_room_files(self, room: str, limit: int = 50,
+                        before_id: Optional[int] = None,
+                        category: Optional[FileCategory] = None) -> List[File]:
+        """
+        List a room's files, newest first, using keyset pagination.
+        
+        Args:
+            room: Room name
+            limit: Maximum number of files
+            before_id: Only return files with a smaller ID (the previous page's last ID)
+            category: Optional file category filter
+            
+        Returns:
+            Files ordered by descending ID
+        """
+        with self.get_session() as session:
+            statement = select(File).where(File.room == room)
+            if category is not None:
+                statement = statement.where(File.category == category)
+            if before_id is not None:
+                statement = statement.where(File.id < before_id)
+            statement = statement.order_by(File.id.desc()).limit(limit)
+            return list(session.exec(statement).all())
+    
+    def touch_file(self, filename: str):
+        """
+        Mark a stored file as just downloaded (for LRU eviction).
+        
+        Only recorded in memory so downloads stay free of database writes;
+        the times are written in one batch before the next eviction.
+        """
+        self._touched[filename] = datetime.now()
+    
+    def flush_touches(self):
+        """Write buffered download times to the database."""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        with self.get_session() as session:
+            for filename, accessed in touched.items():
+                session.execute(
+                    update(File).where(File.filename == filename).values(last_accessed=accessed)
+                )
+            session.commit()
+    
+    # Quota operations
+    def _add_file(self, session: Session, file_record: File):
+        """Add a file record and charge its size to the uploader and room."""
+        session.add(file_record)
+        self._add_usage(session, "user", str(file_record.uploader_id), file_record.file_size, 1)
+        self._add_usage(session, "room", file_record.room, file_record.file_size, 1)
+    
+    def _add_usage(self, session: Session, scope: str, owner: str, size: int, count: int):
+        """Adjust the running totals for one quota owner."""
+        usage = session.get(StorageUsage, (scope, owner))
+        if usage is None:
+            usage = StorageUsage(scope=scope, owner=owner)
+        usage.bytes_used = max(0, usage.bytes_used + size)
+        usage.file_count = max(0, usage.file_count + count)
+        session.add(usage)
+    
+    def get_usage(self, scope: str, owner: str) -> int:
+        """Get bytes used by a user ID or room name."""
+        with self.get_session() as session:
+            usage = session.get(StorageUsage, (scope, str(owner)))
+            return usage.bytes_used if usage else 0
+    
+    def check_quota(self, uploader_id: int, room: str, size: int):
+        """
+        Check that ``size`` more bytes fit for an uploader and a room.
+        
+        A full user quota rejects the file; the room quota only rejects
+        files larger than the whole quota, since older files are evicted
+        to make room.
+        
+        Raises:
+            QuotaExceededError: If the file does not fit
+        """
+        with self.get_session() as session:
+            self._check_quota(session, uploader_id, room, size)
+    
+    def _check_quota(self, session: Session, uploader_id: int, room: str, size: int):
+        """Quota check on an open session (see check_quota)."""
+        user_quota = self.config.user_quota
+        usage = session.get(StorageUsage, ("user", str(uploader_id)))
+        if user_quota and (usage.bytes_used if usage else 0) + size > user_quota:
+            raise QuotaExceededError(f"User storage quota exceeded (max {user_quota} bytes)")
+        
+        room_quota = self.config.room_quota
+        if room_quota and size > room_quota:
+            raise QuotaExceededError(f"File exceeds room quota (max {room_quota} bytes)")
+    
+    def _record_file(self, file_record: File) -> File:
+        """
+        Add the record of a stored file, charging quotas and evicting if needed.
+        
+        The quota check, the usage update and the eviction of the room's
+        least-recently-downloaded files run under one lock and commit as one
+        transaction, so two uploads cannot both pass the same check and
+        nothing is evicted for a file that is rejected. Blobs are deleted
+        from disk after the commit, once no file record references them.
+        
+        Raises:
+            QuotaExceededError: If the file does not fit (nothing is changed)
+        """
+        with self._quota_lock:
+            self.flush_touches()
+            
+            with self.get_session() as session:
+                self._check_quota(session, file_record.uploader_id, file_record.room,
+                                  file_record.file_size)
+                self._add_file(session, file_record)
+                session.flush()
+                
+                evicted = self._evict_lru(session, file_record.room, keep_id=file_record.id)
+                
+                # Blobs can be shared (upload-by-hash), only drop unreferenced ones
+                orphaned = {
+                    evicted_record.file_path for evicted_record in evicted
+                    if session.exec(
+                        select(File.id).where(File.file_path == evicted_record.file_path).limit(1)
+                    ).first() is None
+                }
+                evicted_names = [evicted_record.original_filename for evicted_record in evicted]
+                session.commit()
+                session.refresh(file_record)
+        
+        for file_path in orphaned:
+            Path(file_path).unlink(missing_ok=True)
+        if evicted_names:
+            logger.info(f"Evicted {len(evicted_names)} file(s) from room '{file_record.room}': {evicted_names}")
+        
+        return file_record
+    
+    def _evict_lru(self, session: Session, room: str, keep_id: int) -> List[File]:
+        """Delete a room's least-recently-downloaded files until it is back within its quota."""
+        quota = self.config.room_quota
+        evicted: List[File] = []
+        if not quota:
+            return evicted
+        
+        usage = session.get(StorageUsage, ("room", room))
+        overflow = (usage.bytes_used if usage else 0) - quota
+        
+        while overflow > 0:
+            statement = select(File).where(
+                File.room == room,
+                File.id != keep_id
+            ).order_by(File.last_accessed).limit(50)
+            batch = list(session.exec(statement).all())
+            if not batch:
+                break
+            
+            for file_record in batch:
+                if overflow <= 0:
+                    break
+                session.delete(file_record)
+                self._add_usage(session, "user", str(file_record.uploader_id),
+                                -file_record.file_size, -1)
+                self._add_usage(session, "room", room, -file_record.file_size, -1)
+                overflow -= file_record.file_size
+                evicted.append(file_record)
+            session.flush()
+        
+        return evicted
+    
+    def list_usage(self) -> dict:
+        """Get usage totals for all users and rooms."""
+        with self.get_session() as session:
+            rows = session.exec(
+                select(StorageUsage).order_by(StorageUsage.bytes_used.desc())
+            ).all()
+            usage = {'users': [], 'rooms': []}
+            for row in rows:
+                usage[f"{row.scope}s"].append({
+                    'owner': row.owner,
+                    'bytes_used': row.bytes_used,
+                    'file_count': row.file_count
+                })
+            return usage
+
+
+# Global storage instance
+_storage: Optional[Storage] = None
+
 
+def get_storage() -> Storage:
+    """Get the global storage instance (tables are created on first use)."""
+    global _storage
+    if _storage is None:
+        _storage = Storage()
+        _storage.initialize()
+    return _storage
@@ -0,0 +1,461 @@
+"""SFU (Selective Forwarding Unit) relaying voice between peers with aiortc."""
+
+import asyncio
+import fractions
+import queue
+import time
+import av
+from aiortc import RTCConfiguration, RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
+from typing import Optional, Callable, Awaitable, Dict, List, Set
+from common.aiortc_internals import check_receiver_internals
+from server.utils.logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Encoded packets buffered per subscriber slot before the oldest is dropped (20 ms each)
+FORWARD_QUEUE_SIZE = 10
+NEGOTIATION_TIMEOUT = 10  # seconds to wait for a client's answer
+
+OPUS_TIME_BASE = fractions.Fraction(1, 48000)
+OPUS_FRAME_SAMPLES = 960  # 20 ms at 48 kHz
+
+# Active speakers, from the RFC 6464 audio level header extension
+SPEAKER_UPDATE_INTERVAL = 0.25  # seconds between checks (at most one update per room each)
+SPEAKER_SMOOTHING = 0.2  # Weight of each packet's level in the running average
+SPEAKER_THRESHOLD_DBOV = -45.0  # Smoothed level above which a peer is speaking
+SPEAKER_HYSTERESIS_DB = 6.0  # Active speakers stay active down to threshold minus this
+SPEAKER_TIMEOUT = 0.3  # seconds without audio after which a peer is silent
+MAX_ACTIVE_SPEAKERS = 3
+SILENCE_DBOV = -127.0
+
+
+# Receiver internals replaced on publishing connections
+RECEIVER_INTERNALS = ('_RTCRtpReceiver__decoder_queue',)
+RECEIVER_METHODS = ('_handle_rtp_packet',)
+
+
+class ForwardedTrack(MediaStreamTrack):
+    """
+    Outgoing audio slot of a subscriber, fed with another peer's encoded packets.
+
+    ``recv`` returns ``av.Packet`` objects, which aiortc packetizes as they
+    are instead of encoding. A slot can be pointed at another publisher
+    without renegotiation; timestamps are rebased so the stream stays
+    continuous across switches.
+    """
+
+    kind = "audio"
+
+    def __init__(self):
+        super().__init__()
+        self.source: Optional[str] = None
+        self.mid: Optional[str] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=FORWARD_QUEUE_SIZE)
+        self._offset: Optional[int] = None
+        self._last_pts = 0
+
+    def attach(self, source: str):
+        """Start forwarding the given publisher."""
+        self._drain()
+        self.source = source
+        self._offset = None
+
+    def detach(self):
+        """Stop forwarding; the slot can be reused."""
+        self._drain()
+        self.source = None
+
+    def push(self, data: bytes, timestamp: int):
+        """Queue one encoded frame, dropping the oldest if the subscriber lags."""
+        if self._offset is None:
+            self._offset = self._last_pts + OPUS_FRAME_SAMPLES - timestamp
+        packet = av.Packet(data)
+        packet.pts = self._last_pts = timestamp + self._offset
+        packet.time_base = OPUS_TIME_BASE
+
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(packet)
+
+    async def recv(self) -> av.Packet:
+        """Wait for the next forwarded packet."""
+        return await self._queue.get()
+
+    def _drain(self):
+        """Drop queued packets."""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+class _ForwardingQueue(queue.Queue):
+    """
+    Stands in for the decoder queue of an aiortc receiver.
+
+    The receiver puts each reassembled encoded frame on this queue (from the
+    event loop); instead of reaching the decoder thread, frames go straight
+    to the SFU. Only the stop sentinel is passed through.
+    """
+
+    def __init__(self, on_frame: Callable):
+        super().__init__()
+        self._on_frame = on_frame
+
+    def put(self, item, block=True, timeout=None):
+        if item is None:
+            super().put(item, block, timeout)
+        else:
+            _codec, frame = item
+            self._on_frame(frame)
+
+
+class SfuPeer:
+    """A voice participant: one upstream track, any number of downstream slots."""
+
+    def __init__(self, peer_id: str, room: str, send: Callable[[dict], Awaitable]):
+        self.peer_id = peer_id
+        self.room = room
+        self.send = send
+        self.pc: Optional[RTCPeerConnection] = None
+        self.publishing = False
+        self.slots: List[ForwardedTrack] = []  # Downstream tracks of this peer
+        self.subscribers: Set[ForwardedTrack] = set()  # Slots fed by this peer
+        self.negotiation = asyncio.Lock()
+        self.answer: Optional[asyncio.Future] = None
+        self.level = SILENCE_DBOV  # Smoothed audio level (dBov)
+        self.heard_at = 0.0  # Monotonic time of the last audio level
+
+    def slot_for(self, publisher_id: str) -> Optional[ForwardedTrack]:
+        """Get the slot currently forwarding a publisher."""
+        for slot in self.slots:
+            if slot.source == publisher_id:
+                return slot
+        return None
+
+
+class SFU:
+    """
+    Selective Forwarding Unit for voice rooms.
+
+    Each client publishes a single Opus track to the server, so its uplink
+    does not grow with the room. Encoded packets are forwarded to the
+    subscribers' slots without decoding or re-encoding. Peers are
+    subscribed to everyone else in the room automatically; subscriptions
+    can also be changed with ``subscribe``/``unsubscribe``.
+
+    Signaling messages (JSON, over the voice signaling WebSocket):
+    - client -> server: sfu_offer, sfu_answer, sfu_subscribe, sfu_unsubscribe
+    - server -> client: sfu_answer, sfu_offer (renegotiation when slots are
+      added), sfu_subscribed / sfu_unsubscribed (publisher of a slot's mid),
+      sfu_speakers (active speakers of the room, loudest first)
+
+    Active speakers are found from the audio level each client already puts
+    in its RTP header extension, so clients never signal "I'm speaking".
+    Levels are checked at a fixed rate and an update is sent to a room only
+    when its set of speakers changed.
+    """
+
+    def __init__(self, configuration: Optional[RTCConfiguration] = None):
+        """Initialize the SFU."""
+        # No STUN by default: the server is expected to be directly reachable
+        self.configuration = configuration or RTCConfiguration(iceServers=[])
+        self.peers: Dict[str, SfuPeer] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+        self.packets_received = 0
+        self.packets_forwarded = 0
+        self.speakers: Dict[str, List[str]] = {}  # Last announced speakers by room
+        self._tasks: Set[asyncio.Task] = set()
+        self._speaker_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the SFU server."""
+        logger.info("SFU: Started")
+
+    async def stop(self):
+        """Stop the SFU server."""
+        logger.info("SFU: Stopping")
+        for peer_id in list(self.peers):
+            await self.leave(peer_id)
+        if self._speaker_task is not None:
+            self._speaker_task.cancel()
+            self._speaker_task = None
+
+    async def join(self, room: str, peer_id: str, send: Callable[[dict], Awaitable]):
+        """
+        Register a signaling connection.
+
+        Args:
+            room: Voice room name
+            peer_id: Unique ID of the connection
+            send: Coroutine function sending a JSON message to the client
+        """
+        peer = self.peers[peer_id] = SfuPeer(peer_id, room, send)
+        self.rooms.setdefault(room, set()).add(peer_id)
+        if self.speakers.get(room):
+            await self._notify(peer, {'type': 'sfu_speakers', 'peers': self.speakers[room]})
+        if self._speaker_task is None or self._speaker_task.done():
+            self._speaker_task = asyncio.ensure_future(self._run_speakers())
+
+    async def leave(self, peer_id: str):
+        """Close a peer's connection and free the slots it was feeding."""
+        peer = self.peers.pop(peer_id, None)
+        if peer is None:
+            return
+
+        members = self.rooms.get(peer.room, set())
+        members.discard(peer_id)
+        if not members:
+            self.rooms.pop(peer.room, None)
+            self.speakers.pop(peer.room, None)
+
+        for other_id in list(members):
+            other = self.peers[other_id]
+            other.subscribers.difference_update(peer.slots)
+            slot = other.slot_for(peer_id)
+            if slot is not None:
+                slot.detach()
+                await self._notify(other, {'type': 'sfu_unsubscribed', 'peer': peer_id})
+
+        if peer.answer is not None and not peer.answer.done():
+            peer.answer.cancel()
+        if peer.pc is not None:
+            await peer.pc.close()
+        logger.info(f"SFU: Peer {peer_id} left room '{peer.room}'")
+
+    async def handle_message(self, peer_id: str, data: dict):
+        """
+        Handle an ``sfu_*`` signaling message from a client.
+
+        Work that waits on the same client (renegotiation) runs in background
+        tasks so the caller can keep reading its WebSocket.
+        """
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            return
+
+        msg_type = data.get('type')
+        if msg_type == 'sfu_offer':
+            await self._handle_offer(peer, data['sdp'])
+            self._spawn(self._subscribe_to_room(peer))
+        elif msg_type == 'sfu_answer':
+            if peer.answer is not None and not peer.answer.done():
+                peer.answer.set_result(data['sdp'])
+        elif msg_type == 'sfu_subscribe':
+            self._spawn(self.subscribe(peer_id, data['peer']))
+        elif msg_type == 'sfu_unsubscribe':
+            await self.unsubscribe(peer_id, data['peer'])
+        else:
+            logger.warning(f"SFU: Unknown message type {msg_type!r}")
+
+    async def subscribe(self, subscriber_id: str, publisher_id: str) -> bool:
+        """
+        Start forwarding a publisher to a subscriber.
+
+        Returns:
+            True if the subscription exists afterwards
+        """
+        subscriber = self.peers.get(subscriber_id)
+        publisher = self.peers.get(publisher_id)
+        if subscriber is None or publisher is None or subscriber is publisher:
+            return False
+        if subscriber.room != publisher.room or subscriber.pc is None:
+            return False
+        await self._subscribe_many(subscriber, [publisher])
+        return subscriber.slot_for(publisher_id) is not None
+
+    async def unsubscribe(self, subscriber_id: str, publisher_id: str):
+        """Stop forwarding a publisher to a subscriber (the slot is kept for reuse)."""
+        subscriber = self.peers.get(subscriber_id)
+        publisher = self.peers.get(publisher_id)
+        if subscriber is None:
+            return
+        slot = subscriber.slot_for(publisher_id)
+        if slot is None:
+            return
+        slot.detach()
+        if publisher is not None:
+            publisher.subscribers.discard(slot)
+        await self._notify(subscriber, {'type': 'sfu_unsubscribed', 'peer': publisher_id})
+
+    async def _handle_offer(self, peer: SfuPeer, sdp: str):
+        """Answer a client's offer, hooking its audio track into the forwarder."""
+        async with peer.negotiation:
+            if peer.pc is None:
+                peer.pc = self._create_connection(peer)
+
+            await peer.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type='offer'))
+            await peer.pc.setLocalDescription(await peer.pc.createAnswer())
+            await self._notify(peer, {'type': 'sfu_answer', 'sdp': peer.pc.localDescription.sdp})
+
+    def _create_connection(self, peer: SfuPeer) -> RTCPeerConnection:
+        """Create the server side of a peer's connection."""
+        check_receiver_internals(RECEIVER_INTERNALS, RECEIVER_METHODS)  # Fails the offer, not the first packet
+        pc = RTCPeerConnection(self.configuration)
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind != "audio" or peer.publishing:
+                return
+            receiver = next(t.receiver for t in pc.getTransceivers() if t.receiver.track is track)
+            # Take encoded frames before the decoder thread sees them
+            receiver._RTCRtpReceiver__decoder_queue = _ForwardingQueue(
+                lambda frame: self._forward(peer, frame)
+            )
+            # Read audio levels off the packets on their way in
+            handle_rtp_packet = receiver._handle_rtp_packet
+
+            async def measure_and_handle(packet, arrival_time_ms):
+                self._measure(peer, packet)
+                await handle_rtp_packet(packet, arrival_time_ms)
+
+            receiver._handle_rtp_packet = measure_and_handle
+            peer.publishing = True
+            logger.info(f"SFU: Peer {peer.peer_id} publishing in room '{peer.room}'")
+            self._spawn(self._publish_to_room(peer))
+
+        @pc.on("connectionstatechange")
+        async def on_connection_state():
+            if pc.connectionState == "failed":
+                await self.leave(peer.peer_id)
+
+        return pc
+
+    def _forward(self, publisher: SfuPeer, frame):
+        """Fan one encoded frame out to the publisher's subscribers."""
+        self.packets_received += 1
+        for slot in publisher.subscribers:
+            slot.push(frame.data, frame.timestamp)
+        self.packets_forwarded += len(publisher.subscribers)
+
+    def _measure(self, publisher: SfuPeer, packet):
+        """Fold a packet's audio level into the publisher's running level."""
+        audio_level = packet.extensions.audio_level
+        if audio_level is None:
+            return
+        _voice, level = audio_level
+        now = time.monotonic()
+        if now - publisher.heard_at > SPEAKER_TIMEOUT:
+            publisher.level = SILENCE_DBOV  # Start over after a pause
+        publisher.level += SPEAKER_SMOOTHING * (-level - publisher.level)
+        publisher.heard_at = now
+
+    def _active_speakers(self, room: str) -> List[str]:
+        """Peers of a room currently speaking, loudest first."""
+        now = time.monotonic()
+        previous = set(self.speakers.get(room, ()))
+        levels = {}
+        for peer_id in self.rooms.get(room, ()):
+            peer = self.peers[peer_id]
+            threshold = SPEAKER_THRESHOLD_DBOV
+            if peer_id in previous:
+                threshold -= SPEAKER_HYSTERESIS_DB
+            if now - peer.heard_at <= SPEAKER_TIMEOUT and peer.level > threshold:
+                levels[peer_id] = peer.level
+        return sorted(levels, key=levels.get, reverse=True)[:MAX_ACTIVE_SPEAKERS]
+
+    async def update_speakers(self):
+        """Announce the active speakers of every room whose set changed."""
+        for room in list(self.rooms):
+            speakers = self._active_speakers(room)
+            if set(speakers) == set(self.speakers.get(room, ())):
+                continue
+            self.speakers[room] = speakers
+            for peer_id in list(self.rooms.get(room, ())):
+                peer = self.peers.get(peer_id)
+                if peer is not None:
+                    await self._notify(peer, {'type': 'sfu_speakers', 'peers': speakers})
+
+    async def _run_speakers(self):
+        """Check active speakers at a fixed rate while any room is open."""
+        while self.rooms:
+            await asyncio.sleep(SPEAKER_UPDATE_INTERVAL)
+            await self.update_speakers()
+
+    async def _publish_to_room(self, publisher: SfuPeer):
+        """Subscribe everyone else in the room to a new publisher."""
+        # Wait for the offer that announced the track to be answered
+        async with publisher.negotiation:
+            pass
+        for peer_id in list(self.rooms.get(publisher.room, ())):
+            peer = self.peers.get(peer_id)
+            if peer is not None and peer is not publisher and peer.pc is not None:
+                self._spawn(self._subscribe_many(peer, [publisher]))
+
+    async def _subscribe_to_room(self, subscriber: SfuPeer):
+        """Subscribe a newly connected peer to every publisher of its room."""
+        publishers = [
+            self.peers[peer_id] for peer_id in self.rooms.get(subscriber.room, ())
+            if peer_id != subscriber.peer_id and self.peers[peer_id].publishing
+        ]
+        if publishers:
+            await self._subscribe_many(subscriber, publishers)
+
+    async def _subscribe_many(self, subscriber: SfuPeer, publishers: List[SfuPeer]):
+        """Attach publishers to free slots, adding slots with a single renegotiation."""
+        async with subscriber.negotiation:
+            if subscriber.peer_id not in self.peers:
+                return
+
+            added = []
+            for publisher in publishers:
+                if publisher.peer_id not in self.peers or subscriber.slot_for(publisher.peer_id):
+                    continue
+                slot = next((s for s in subscriber.slots if s.source is None), None)
+                if slot is None:
+                    slot = ForwardedTrack()
+                    subscriber.pc.addTransceiver(slot, direction="sendonly")
+                    subscriber.slots.append(slot)
+                slot.attach(publisher.peer_id)
+                publisher.subscribers.add(slot)
+                added.append(slot)
+
+            if any(slot.mid is None for slot in added):
+                try:
+                    await self._renegotiate(subscriber)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    logger.warning(f"SFU: Peer {subscriber.peer_id} did not answer renegotiation")
+                    return
+
+            for slot in added:
+                await self._notify(subscriber, {
+                    'type': 'sfu_subscribed', 'peer': slot.source, 'mid': slot.mid
+                })
+
+    async def _renegotiate(self, peer: SfuPeer):
+        """Offer the peer its new slots and wait for the answer."""
+        peer.answer = asyncio.get_running_loop().create_future()
+        await peer.pc.setLocalDescription(await peer.pc.createOffer())
+        await self._notify(peer, {'type': 'sfu_offer', 'sdp': peer.pc.localDescription.sdp})
+
+        sdp = await asyncio.wait_for(peer.answer, NEGOTIATION_TIMEOUT)
+        await peer.pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type='answer'))
+
+        for transceiver in peer.pc.getTransceivers():
+            if isinstance(transceiver.sender.track, ForwardedTrack):
+                transceiver.sender.track.mid = transceiver.mid
+
+    async def _notify(self, peer: SfuPeer, message: dict):
+        """Send a signaling message, ignoring peers that already went away."""
+        try:
+            await peer.send(message)
+        except Exception as e:
+            logger.error(f"SFU: Could not signal peer {peer.peer_id}: {e}")
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until it ends."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+# Global SFU instance
+_sfu: Optional[SFU] = None
+
+
+def get_sfu() -> SFU:
+    """Get the global SFU instance."""
+    global _sfu
+    if _sfu is None:
+        _sfu = SFU()
+    return _sfu
@@ -1,59 +1,172 @@
 """WebRTC signaling for voice chat."""
 
 import json
+import uuid
 from aiohttp import web
-from typing import Set
+from dataclasses import dataclass
+from typing import Optional, Set
+from server.auth import get_request_user
+from server.config import get_config
+from server.voice.sfu import get_sfu
 from server.utils.logger import get_logger
 
 
 logger = get_logger(__name__)
 
 
-# WebSocket connections for signaling
-SIGNALING_WEBSOCKETS: dict[str, Set[web.WebSocketResponse]] = {}
+@dataclass
+class SignalingPeer:
+    """A signaling connection."""
+    peer_id: str
+    room: str
+    user: str
+    ws: web.WebSocketResponse
+
+
+# Signaling connections by peer ID: addressed messages are delivered with
+# one lookup instead of being broadcast to the whole room
+SIGNALING_PEERS: dict[str, SignalingPeer] = {}
+
+# Peer IDs by room
+SIGNALING_ROOMS: dict[str, Set[str]] = {}
+
+
+async def join_signaling(room: str, user: str, ws: web.WebSocketResponse) -> str:
+    """
+    Register a signaling connection and exchange rosters.
+
+    The new peer receives ``{"type": "roster", "peer_id", "peers"}`` with
+    everyone already in the room; they receive ``peer_joined``.
+
+    The roster is taken and the peer registered with no await in between,
+    so of two peers joining at once, the later one has the earlier one in
+    its roster and the earlier one gets ``peer_joined``.
+
+    Returns:
+        Peer ID assigned to the connection
+    """
+    peer_id = uuid.uuid4().hex
+    members = SIGNALING_ROOMS.setdefault(room, set())
+    roster = [{'peer': p, 'user': SIGNALING_PEERS[p].user} for p in members]
+
+    SIGNALING_PEERS[peer_id] = SignalingPeer(peer_id, room, user, ws)
+    members.add(peer_id)
+
+    await _send(ws, {'type': 'roster', 'peer_id': peer_id, 'peers': roster})
+    await _broadcast(room, {'type': 'peer_joined', 'peer': peer_id, 'user': user}, exclude=peer_id)
+    return peer_id
+
+
+async def leave_signaling(peer_id: str):
+    """Unregister a signaling connection and tell the rest of the room."""
+    peer = SIGNALING_PEERS.pop(peer_id, None)
+    if peer is None:
+        return
+
+    members = SIGNALING_ROOMS.get(peer.room, set())
+    members.discard(peer_id)
+    if not members:
+        SIGNALING_ROOMS.pop(peer.room, None)
+
+    await _broadcast(peer.room, {'type': 'peer_left', 'peer': peer_id})
+
+
+async def route_signal(peer_id: str, data: dict):
+    """
+    Deliver a signaling message from a peer.
+
+    The sender is stamped into ``from``. Messages with a ``to`` peer ID go
+    to that peer only (if it is in the same room); others are broadcast to
+    the room.
+    """
+    sender = SIGNALING_PEERS.get(peer_id)
+    if sender is None:
+        return
+
+    data['from'] = peer_id
+    target_id = data.get('to')
+
+    if target_id is None:
+        await _broadcast(sender.room, data, exclude=peer_id)
+        return
+
+    target = SIGNALING_PEERS.get(target_id)
+    if target is None or target.room != sender.room:
+        await _send(sender.ws, {'type': 'error', 'error': 'Unknown peer', 'to': target_id})
+        return
+    await _send(target.ws, data)
+
+
+async def _broadcast(room: str, data: dict, exclude: Optional[str] = None):
+    """Send a message to every peer of a room."""
+    message = json.dumps(data)
+    for peer_id in list(SIGNALING_ROOMS.get(room, ())):
+        peer = SIGNALING_PEERS.get(peer_id)
+        if peer is not None and peer_id != exclude:
+            await _send(peer.ws, message)
+
+
+async def _send(ws: web.WebSocketResponse, message):
+    """Send a JSON string or object, ignoring sockets that already closed."""
+    if ws.closed:
+        return
+    try:
+        if isinstance(message, str):
+            await ws.send_str(message)
+        else:
+            await ws.send_json(message)
+    except Exception as e:
+        logger.error(f"Error forwarding signal: {e}")
 
 
 async def handle_signaling_websocket(request: web.Request) -> web.WebSocketResponse:
     """
     WebSocket handler for WebRTC signaling.
-    
+
     Handles SDP offers/answers and ICE candidates for voice chat.
     """
+    identity = get_request_user(request)
+    if identity is None and not get_config().allow_anonymous:
+        return web.json_response({'error': 'Authentication required'}, status=401)
+
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    
+
     room = request.query.get("room", "general")
-    
-    if room not in SIGNALING_WEBSOCKETS:
-        SIGNALING_WEBSOCKETS[room] = set()
-    SIGNALING_WEBSOCKETS[room].add(ws)
-    
-    logger.info(f"[Signaling] New connection in room '{room}'")
-    
+    user = identity['username'] if identity else request.query.get("user", "unknown")
+
+    peer_id = await join_signaling(room, user, ws)
+
+    # Each connection is also a potential SFU participant
+    sfu = get_sfu()
+    await sfu.join(room, peer_id, ws.send_json)
+
+    logger.info(f"[Signaling] New connection in room '{room}' (peer {peer_id})")
+
     try:
         async for msg in ws:
             if msg.type == web.WSMsgType.TEXT:
                 try:
                     # Parse signaling message
                     data = json.loads(msg.data)
-                    
-                    # Broadcast signaling message to other peers in the room
-                    for peer in list(SIGNALING_WEBSOCKETS.get(room, set())):
-                        if peer != ws and not peer.closed:
-                            try:
-                                await peer.send_str(msg.data)
-                            except Exception as e:
-                                logger.error(f"Error forwarding signal: {e}")
-                
+
+                    # SFU negotiation is answered by the server itself
+                    if str(data.get("type", "")).startswith("sfu_"):
+                        await sfu.handle_message(peer_id, data)
+                        continue
+
+                    # Deliver to the addressed peer (or the room)
+                    await route_signal(peer_id, data)
+
                 except json.JSONDecodeError:
                     logger.error("Invalid JSON in signaling message")
-    
+
     except Exception as e:
         logger.error(f"Signaling error in room '{room}': {e}")
-    
+
     finally:
-        SIGNALING_WEBSOCKETS[room].discard(ws)
+        await leave_signaling(peer_id)
+        await sfu.leave(peer_id)
         logger.info(f"[Signaling] Disconnected from room '{room}'")
-    
-    return ws
 
+    return ws
@@ -1,6 +1,7 @@
 """Tests for client functionality."""
 
 import pytest
+import aiohttp
 from client.core.network import NetworkClient
 from client.core.crypto import CryptoManager
 
@@ -51,3 +52,1141 @@ def test_auth_token(network_client):
     assert 'Authorization' in headers
     assert headers['Authorization'] == 'Bearer test_token_123'
 
+
+
+async def _serve_file(tmp_path, content: bytes):
+    """Start a test server that serves ``content`` with range support."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    
+    source = tmp_path / "source.bin"
+    source.write_bytes(content)
+    
+    async def handle(request):
+        return web.FileResponse(source)
+    
+    app = web.Application()
+    app.router.add_get("/download/source.bin", handle)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def test_download_segmented(tmp_path):
+    """Test that large files are fetched as parallel ranges."""
+    content = bytes(range(256)) * 4096  # 1 MB
+    server = await _serve_file(tmp_path, content)
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    client.downloads.segment_threshold = 64 * 1024
+    client.downloads.chunk_size = 16 * 1024
+    
+    try:
+        dest = tmp_path / "out.bin"
+        result = await client.downloads.download(
+            f"{client.base_url}/download/source.bin", dest
+        )
+        assert result == dest
+        assert dest.read_bytes() == content
+        assert not (tmp_path / "out.bin.part").exists()
+    finally:
+        await client.disconnect()
+        await server.close()
+
+
+async def test_download_resumes_part_file(tmp_path):
+    """Test that an existing .part file is resumed with a Range request."""
+    content = b"0123456789" * 1000
+    server = await _serve_file(tmp_path, content)
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    
+    try:
+        url = f"{client.base_url}/download/source.bin"
+        async with aiohttp.ClientSession() as session, session.head(url) as response:
+            last_modified = response.headers["Last-Modified"]
+        dest = tmp_path / "out.bin"
+        # A marker prefix shows the partial data was kept rather than refetched
+        (tmp_path / "out.bin.part").write_bytes(b"x" * 4000)
+        (tmp_path / "out.bin.part.validator").write_text(last_modified)
+        
+        progress = []
+        client.downloads.on_progress = lambda _id, received, total: progress.append(received)
+        await client.downloads.download(url, dest)
+        
+        assert dest.read_bytes() == b"x" * 4000 + content[4000:]
+        assert progress[-1] == len(content)
+        assert not (tmp_path / "out.bin.part.validator").exists()
+        
+        # A .part file from a different version of the file is not appended to
+        (tmp_path / "out.bin.part").write_bytes(b"x" * 4000)
+        (tmp_path / "out.bin.part.validator").write_text("Thu, 01 Jan 1970 00:00:00 GMT")
+        await client.downloads.download(url, dest)
+        assert dest.read_bytes() == content
+    finally:
+        await client.disconnect()
+        await server.close()
+
+
+async def test_download_discards_interrupted_segmented_part(tmp_path):
+    """Test that a preallocated segmented .part is not mistaken for a complete one."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    
+    content = bytes(range(256)) * 40
+    source = tmp_path / "source.bin"
+    source.write_bytes(content)
+    
+    async def handle(request):
+        if request.method == "HEAD":
+            return web.Response(status=503)  # Probe fails, forcing a streamed fetch
+        return web.FileResponse(source)
+    
+    app = web.Application()
+    app.router.add_get("/download/source.bin", handle)
+    server = TestServer(app)
+    await server.start_server()
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    
+    try:
+        dest = tmp_path / "out.bin"
+        (tmp_path / "out.bin.part").write_bytes(bytes(len(content)))
+        (tmp_path / "out.bin.part.json").write_text(
+            '{"total": %d, "validator": null, "segments": [[0, %d, 0]]}' % (len(content), len(content) - 1)
+        )
+        
+        await client.downloads.download(f"{client.base_url}/download/source.bin", dest)
+        
+        assert dest.read_bytes() == content
+        assert not (tmp_path / "out.bin.part.json").exists()
+    finally:
+        await client.disconnect()
+        await server.close()
+
+
+async def test_upload_file_streams_from_disk(tmp_path):
+    """Test that uploads send metadata and stream the file body."""
+    import hashlib
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    
+    content = b"x" * (600 * 1024 + 17)
+    source = tmp_path / "report.pdf"
+    source.write_bytes(content)
+    received = {}
+    
+    async def handle_upload(request):
+        reader = await request.multipart()
+        async for part in reader:
+            received[part.name] = await part.read()
+        return web.json_response({'success': True, 'file_url': '/download/report.pdf'})
+    
+    app = web.Application()
+    app.router.add_post("/api/upload", handle_upload)
+    server = TestServer(app)
+    await server.start_server()
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    
+    try:
+        progress = []
+        result = await client.upload_file(
+            str(source), "general",
+            on_progress=lambda sent, total: progress.append((sent, total))
+        )
+        
+        assert result['success']
+        assert list(received) == ['room', 'sha256', 'file']
+        assert received['file'] == content
+        assert received['sha256'].decode() == hashlib.sha256(content).hexdigest()
+        assert progress[-1] == (len(content), len(content))
+    finally:
+        await client.disconnect()
+        await server.close()
+
+
+async def test_file_links_are_signed_again_before_download(tmp_path, monkeypatch):
+    """Test that a file link from an old message still downloads after its signature expired."""
+    import aiohttp
+    from aiohttp.test_utils import TestServer
+    from server import main
+    from server.api import rest
+    from server.auth import get_auth_manager
+    from server.storage import Storage
+
+    storage = Storage(db_path=str(tmp_path / "server.db"), upload_dir=str(tmp_path))
+    storage.initialize()
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    source = tmp_path / "notes.txt"
+    source.write_bytes(b"old notes")
+
+    server = TestServer(main.create_app())
+    await server.start_server()
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+
+    try:
+        uploaded = await client.upload_file(str(source), "general")
+        path = uploaded['file_url'].partition('?')[0]
+        expired = get_auth_manager().sign_download_url(path, expires_in=-1)
+
+        with pytest.raises(aiohttp.ClientResponseError):
+            await client.fetch_bytes(f"{client.base_url}{expired}", 1024)
+
+        for link in (expired, f"{client.base_url}{path}"):
+            renewed = await client.sign_file_url(link)
+            assert await client.fetch_bytes(renewed, 1024) == b"old notes"
+
+        other = "https://example.com/cat.png"
+        assert await client.sign_file_url(other) == other
+    finally:
+        await client.disconnect()
+        await server.close()
+
+
+async def test_websocket_resumes_after_drop(monkeypatch):
+    """Test that a dropped chat connection is resumed and only the gap is delivered."""
+    import asyncio
+    from aiohttp.test_utils import TestServer
+    from client.core import network
+    from server.main import create_app
+    
+    monkeypatch.setattr(network, "RECONNECT_BASE_DELAY", 0.2)
+    server = TestServer(create_app())
+    await server.start_server()
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    sender = NetworkClient(client.base_url)
+    received = []
+    
+    async def on_message(data):
+        received.append(data['text'])
+    
+    try:
+        assert await client.connect_websocket("resume-client", on_message=on_message)
+        assert await sender.connect_websocket("resume-client")
+        await sender.send_message("resume-client", "bob", "live")
+        while received != ["live"]:
+            await asyncio.sleep(0.01)
+        
+        await client.websocket.close()  # Connection drops, client is not closing
+        for text in ("missed-1", "missed-2"):
+            await sender.send_message("resume-client", "bob", text)
+        
+        for _ in range(200):
+            if len(received) == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert received == ["live", "missed-1", "missed-2"]
+    finally:
+        await sender.disconnect()
+        await client.disconnect()
+        await server.close()
+
+
+async def test_outbox_delivers_queued_messages_once(tmp_path, monkeypatch):
+    """Test that messages sent while disconnected are persisted, flushed on reconnect and not duplicated."""
+    import asyncio
+    import json
+    import uuid
+    from aiohttp.test_utils import TestServer
+    from client.core import network
+    from client.core.cache import MessageCache
+    from server import main
+    from server.api import rest, sessions
+    from server.storage import Storage
+    
+    # Delivered IDs are persisted: a shared database would acknowledge the leftover without sending it
+    storage = Storage(db_path=str(tmp_path / "server.db"), upload_dir=str(tmp_path))
+    storage.initialize()
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(sessions, "ROOM_LOGS", {})
+    monkeypatch.setattr(network, "reconnect_delay", lambda attempt: 0.3)
+    server = TestServer(main.create_app())
+    await server.start_server()
+    cache = MessageCache(tmp_path / "cache.db")
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    client.use_cache(cache)
+    watcher = NetworkClient(client.base_url)
+    received = []
+    
+    async def on_message(data):
+        received.append(data['text'])
+    
+    async def wait_for(count):
+        for _ in range(300):
+            if len(received) >= count:
+                break
+            await asyncio.sleep(0.01)
+    
+    try:
+        assert await watcher.connect_websocket("outbox-room", on_message=on_message)
+        assert await client.connect_websocket("outbox-room")
+        await client.websocket.close()  # Drops; the supervisor reconnects
+        assert not await client.send_message("outbox-room", "amy", "offline-1")
+        assert not await client.send_message("outbox-room", "amy", "offline-2")
+        sent_id = next(iter(client.outbox))
+        cache.flush()
+        assert [frame['text'] for frame in cache.load_outbox()] == ["offline-1", "offline-2"]
+        
+        await wait_for(2)
+        assert received == ["offline-1", "offline-2"]
+        assert not client.outbox
+        
+        # A copy resent after a lost acknowledgement is not broadcast again
+        await client.websocket.send(json.dumps(
+            {'type': 'text', 'room': 'outbox-room', 'user': 'amy', 'text': 'offline-1', 'id': sent_id}
+        ))
+        await client.send_message("outbox-room", "amy", "after")
+        await wait_for(3)
+        assert received == ["offline-1", "offline-2", "after"]
+        await client.disconnect()
+        
+        # Messages left unsent by a previous run go out on the next connection
+        cache.flush()
+        assert cache.load_outbox() == []
+        cache.queue_outgoing({'type': 'text', 'room': 'outbox-room', 'user': 'amy',
+                              'text': 'left over', 'id': uuid.uuid4().hex})
+        cache.flush()
+        client = NetworkClient(client.base_url)
+        client.use_cache(cache)
+        assert await client.connect_websocket("outbox-room")
+        await wait_for(4)
+        assert received[-1] == "left over"
+    finally:
+        await client.disconnect()
+        await watcher.disconnect()
+        await server.close()
+        cache.close()
+
+
+def test_reconnect_delays_back_off_with_jitter():
+    """Test that reconnect waits grow to a cap and are spread out rather than in sync."""
+    from client.core.network import RECONNECT_BASE_DELAY, RECONNECT_MAX_DELAY, reconnect_delay
+    
+    first = [reconnect_delay(0) for _ in range(200)]
+    assert max(first) <= RECONNECT_BASE_DELAY
+    assert len(set(first)) > 100
+    late = [reconnect_delay(100) for _ in range(200)]
+    assert RECONNECT_MAX_DELAY / 2 < max(late) <= RECONNECT_MAX_DELAY
+
+
+async def test_websocket_switches_rooms_without_reconnecting():
+    """Test that rooms are subscribed over the one connection and frames are routed by room."""
+    import asyncio
+    from aiohttp.test_utils import TestServer
+    from server.main import create_app
+    
+    server = TestServer(create_app())
+    await server.start_server()
+    client = NetworkClient(str(server.make_url("")).rstrip('/'))
+    sender = NetworkClient(client.base_url)
+    received = []
+    
+    async def on_message(data):
+        received.append((data['room'], data['text']))
+    
+    try:
+        assert await client.connect_websocket("switch-a", on_message=on_message)
+        connection = client.websocket
+        assert await client.connect_websocket("switch-b")
+        assert client.websocket is connection
+        
+        assert await sender.connect_websocket("switch-a")
+        assert await sender.subscribe_room("switch-b")
+        for _ in range(200):
+            if all(s.last_seq is not None for s in sender.subscriptions.values()):
+                break
+            await asyncio.sleep(0.01)
+        await sender.send_message("switch-a", "bob", "to a")
+        await sender.send_message("switch-b", "bob", "to b")
+        
+        for _ in range(200):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert received == [("switch-a", "to a"), ("switch-b", "to b")]
+        
+        await client.unsubscribe_room("switch-a")
+        await sender.send_message("switch-a", "bob", "ignored")
+        await sender.send_message("switch-b", "bob", "still here")
+        for _ in range(200):
+            if len(received) == 3:
+                break
+            await asyncio.sleep(0.01)
+        assert received[-1] == ("switch-b", "still here")
+    finally:
+        await sender.disconnect()
+        await client.disconnect()
+        await server.close()
+
+
+async def test_failed_backfill_keeps_the_gap(tmp_path, monkeypatch):
+    """Test that history that could not be fetched is fetched later instead of skipped."""
+    import asyncio
+    from aiohttp.test_utils import TestServer
+    from client.core import network
+    from server import main
+    from server.api import rest
+    from server.auth import AuthManager
+    from server.storage import Storage
+    
+    storage = Storage(db_path=str(tmp_path / "server.db"), upload_dir=str(tmp_path))
+    storage.initialize()
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(network, "reconnect_delay", lambda attempt: 0)
+    user = storage.create_user("bob", "hash")
+    
+    server = TestServer(main.create_app())
+    await server.start_server()
+    sender = NetworkClient(str(server.make_url("")).rstrip('/'))
+    sender.set_auth_token(AuthManager().create_token(user.id, "bob"))
+    client = NetworkClient(sender.base_url)  # No token: history is readable anonymously
+    received = []
+    
+    async def on_message(data):
+        received.append(data['text'])
+    
+    try:
+        assert await sender.connect_websocket("gap-room")
+        for text in ("one", "two", "three"):
+            await sender.send_message("gap-room", "bob", text)
+        while storage.get_last_seq("gap-room") < 3:
+            await asyncio.sleep(0.01)
+        
+        fetch_history = client.fetch_room_messages
+        failures = []
+        
+        async def unreachable_history(*args, **kwargs):
+            failures.append(args)
+            return {'error': 'HTTP 503'}
+        
+        client.fetch_room_messages = unreachable_history
+        client._high_water["gap-room"] = 0  # Cached before the three messages
+        assert await client.connect_websocket("gap-room", on_message=on_message)
+        session = client.subscriptions["gap-room"]
+        while not session.gaps:
+            await asyncio.sleep(0.01)
+        assert len(failures) == network.HISTORY_ATTEMPTS
+        assert session.last_seq == 0 and received == []
+        
+        # The next session frame fetches the gap
+        client.fetch_room_messages = fetch_history
+        assert await client.subscribe_room("gap-room")
+        while len(received) < 3:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        assert received == ["one", "two", "three"]
+        assert session.gaps == [] and session.last_seq == 3
+    finally:
+        await client.disconnect()
+        await sender.disconnect()
+        await server.close()
+
+
+async def test_message_cache_syncs_only_newer_messages(tmp_path, monkeypatch):
+    """Test that a client starting from its cache fetches only the messages it lacks."""
+    import asyncio
+    from aiohttp.test_utils import TestServer
+    from client.core.cache import MessageCache
+    from server import main
+    from server.api import rest
+    from server.auth import AuthManager
+    from server.storage import Storage
+    
+    storage = Storage(db_path=str(tmp_path / "server.db"), upload_dir=str(tmp_path))
+    storage.initialize()
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    user = storage.create_user("bob", "hash")
+    token = AuthManager().create_token(user.id, "bob")
+    
+    server = TestServer(main.create_app())
+    await server.start_server()
+    base_url = str(server.make_url("")).rstrip('/')
+    sender = NetworkClient(base_url)
+    sender.set_auth_token(token)
+    
+    async def wait_for(condition):
+        for _ in range(300):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+    
+    async def session(cache):
+        client = NetworkClient(base_url)
+        client.set_auth_token(token)
+        client.use_cache(cache)
+        received = []
+        
+        async def on_message(data):
+            received.append(data['text'])
+        
+        assert await client.connect_websocket("cache-room", on_message=on_message)
+        await wait_for(lambda: client.subscriptions["cache-room"].resume_token)
+        return client, received
+    
+    try:
+        assert await sender.connect_websocket("cache-room")
+        cache = MessageCache.for_account(base_url, "bob", cache_dir=tmp_path / "cache")
+        client, received = await session(cache)
+        await sender.send_message("cache-room", "bob", "one")
+        await wait_for(lambda: received == ["one"])
+        assert received == ["one"]
+        await client.disconnect()
+        cache.close()
+        
+        for text in ("two", "three"):
+            await sender.send_message("cache-room", "bob", text)
+        await wait_for(lambda: storage.get_last_seq("cache-room") == 3)
+        
+        cache = MessageCache.for_account(base_url, "bob", cache_dir=tmp_path / "cache")
+        assert cache.high_water_marks() == {"cache-room": 1}
+        client, received = await session(cache)
+        await wait_for(lambda: len(received) == 2)
+        assert received == ["two", "three"]
+        await client.disconnect()
+        cache.flush()
+        
+        cached = cache.load_room("cache-room")
+        assert [m['text'] for m in cached] == ["one", "two", "three"]
+        assert [m['seq'] for m in cached] == [1, 2, 3]
+        assert [m['text'] for m in cache.load_room("cache-room", until_seq=2)] == ["one", "two"]
+        cache.close()
+    finally:
+        await sender.disconnect()
+        await server.close()
+
+
+async def test_cache_high_water_waits_for_complete_history(tmp_path, monkeypatch):
+    """Test that a live message after a failed sync does not hide the gap from the next launch (no tokens)."""
+    import asyncio
+    from aiohttp.test_utils import TestServer
+    from client.core import network
+    from client.core.cache import MessageCache
+    from server import main
+    from server.api import rest
+    from server.storage import Storage
+    
+    storage = Storage(db_path=str(tmp_path / "server.db"), upload_dir=str(tmp_path))
+    storage.initialize()
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(network, "reconnect_delay", lambda attempt: 0)
+    
+    server = TestServer(main.create_app())
+    await server.start_server()
+    base_url = str(server.make_url("")).rstrip('/')
+    sender = NetworkClient(base_url)
+    cache = MessageCache.for_account(base_url, "bob", cache_dir=tmp_path / "cache")
+    cache.set_high_water("anon-room", 0)
+    cache.flush()
+    received = []
+    
+    async def on_message(data):
+        received.append(data['text'])
+    
+    async def unreachable_history(*args, **kwargs):
+        return {'error': 'HTTP 503'}
+    
+    try:
+        assert await sender.connect_websocket("anon-room")
+        for text in ("one", "two"):
+            await sender.send_message("anon-room", "alice", text)
+        while storage.get_last_seq("anon-room") < 2:
+            await asyncio.sleep(0.01)  # Anonymous messages are stored too
+        
+        client = NetworkClient(base_url)
+        client.use_cache(cache)
+        client.fetch_room_messages = unreachable_history
+        assert await client.connect_websocket("anon-room", on_message=on_message)
+        while not client.subscriptions["anon-room"].gaps:
+            await asyncio.sleep(0.01)
+        await sender.send_message("anon-room", "alice", "three")
+        while received != ["three"]:
+            await asyncio.sleep(0.01)
+        await client.disconnect()
+        cache.flush()
+        assert cache.high_water_marks() == {"anon-room": 0}
+        
+        received.clear()
+        client = NetworkClient(base_url)
+        client.use_cache(cache)
+        assert await client.connect_websocket("anon-room", on_message=on_message)
+        while len(received) < 3:
+            await asyncio.sleep(0.01)
+        await client.disconnect()
+        cache.flush()
+        assert received == ["one", "two", "three"]
+        assert cache.high_water_marks() == {"anon-room": 3}
+        assert [m['text'] for m in cache.load_room("anon-room")] == ["one", "two", "three"]
+    finally:
+        cache.close()
+        await sender.disconnect()
+        await server.close()
+
+
+def test_message_cache_searches_all_rooms(tmp_path):
+    """Test that cached messages are found by word and prefix, and old caches get indexed."""
+    import sqlite3
+    from client.core.cache import MessageCache
+    
+    cache = MessageCache(tmp_path / "cache.db")
+    texts = ["Lunch at noon?", "the deploy failed again", "Déploiement done", "noon works"]
+    for seq, text in enumerate(texts, 1):
+        cache.add({'room': f"room-{seq % 2}", 'seq': seq, 'user': 'amy', 'text': text, 'timestamp': seq})
+    cache.add({'room': 'room-1', 'seq': 1, 'user': 'amy', 'text': texts[0], 'timestamp': 1})  # Again
+    cache.flush()
+    
+    assert [m['seq'] for m in cache.search("noon")] == [4, 1]  # Newest first, across rooms
+    assert [m['text'] for m in cache.search("depl")] == ["Déploiement done", "the deploy failed again"]
+    assert cache.search("deploy fail")[0]['snippet'] == "the deploy failed again"
+    assert cache.search('" OR *') == []  # Not FTS syntax
+    cache.clear_room("room-0")
+    cache.flush()
+    assert [m['seq'] for m in cache.search("noon")] == [1]
+    cache.close()
+    
+    # A cache written before the index existed is indexed when opened
+    connection = sqlite3.connect(tmp_path / "cache.db")
+    connection.execute("DROP TABLE message_search")
+    connection.commit()
+    connection.close()
+    cache = MessageCache(tmp_path / "cache.db")
+    cache.flush()
+    assert [m['room'] for m in cache.search("lunch")] == ["room-1"]
+    cache.close()
+
+
+def test_qt_event_loop_runs_asyncio_on_gui_thread():
+    """Test that sockets, timers and thread wake-ups are served from Qt's event loop."""
+    import asyncio
+    import os
+    import threading
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    from client.gui.event_loop import QtEventLoop
+    
+    app = QApplication.instance() or QApplication([])
+    loop = QtEventLoop()
+    ticks = []
+    timer = QTimer()
+    timer.timeout.connect(lambda: ticks.append(threading.current_thread()))
+    timer.start(10)
+    
+    async def echo(reader, writer):
+        writer.write(await reader.read(5))
+        await writer.drain()
+        writer.close()
+    
+    async def main():
+        server = await asyncio.start_server(echo, '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(b"hello")
+        assert await reader.read(5) == b"hello"
+        writer.close()
+        server.close()
+        
+        woken = loop.create_future()
+        threading.Timer(0.05, loop.call_soon_threadsafe, (woken.set_result, True)).start()
+        assert await asyncio.wait_for(woken, 2)
+        
+        await asyncio.sleep(0.1)  # Qt keeps handling its own events meanwhile
+        worker = await asyncio.to_thread(threading.current_thread)
+        return worker
+    
+    try:
+        worker = loop.run_until_complete(main())
+    finally:
+        timer.stop()
+        loop.close()
+    assert worker is not threading.main_thread()
+    assert len(ticks) >= 5
+    assert set(ticks) == {threading.main_thread()}
+
+
+def test_qt_event_loop_stops_when_last_window_closes():
+    """Test that closing the last window ends run_forever, so shutdown code runs."""
+    import asyncio
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication, QWidget
+    from client.gui.event_loop import QtEventLoop
+    
+    app = QApplication.instance() or QApplication([])
+    loop = QtEventLoop()
+    window = QWidget()
+    window.show()
+    timed_out = []
+    loop.call_later(0.05, window.close)
+    loop.call_later(5, lambda: (timed_out.append(True), loop.stop()))
+    try:
+        loop.run_forever()
+        assert not timed_out
+        # Shutdown coroutines still run after Qt quit
+        assert loop.run_until_complete(asyncio.sleep(0.01, result="shut down")) == "shut down"
+    finally:
+        loop.close()
+
+
+def test_window_import_defers_network_voice_and_crypto():
+    """Test that the GUI starts without importing the network, voice or crypto stacks."""
+    import subprocess
+    import sys
+    
+    code = ("import sys, client.gui.app_window, client.gui.voice_panel, client.core.crypto; "
+            "print(sorted({'aiohttp', 'websockets', 'aiortc', 'av', 'nacl'} & set(sys.modules)))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_startup_profile_times_imports(tmp_path, monkeypatch):
+    """Test that the startup profile reports phases and slow imports."""
+    import importlib
+    from client.utils.startup_profile import StartupProfile
+    
+    (tmp_path / "slow_startup_module.py").write_text("import time\ntime.sleep(0.01)\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    profile = StartupProfile()
+    try:
+        importlib.import_module("slow_startup_module")
+        profile.mark("imports")
+    finally:
+        profile.stop()
+    
+    report = profile.report()
+    assert "imports" in report and "total" in report
+    line = next(l for l in report.splitlines() if "slow_startup_module" in l)
+    assert float(line.split()[-1]) >= 10
+
+
+def test_message_model_windows_long_history():
+    """Test that the chat model exposes a bounded window that pages both ways."""
+    from client.gui.chat_view import (MessageListModel, HISTORY_LIMIT, MAX_LOADED_ROWS, PAGE_ROWS,
+                                      WINDOW_LIMIT, _message_key)
+    
+    history = [{'user': 'a', 'text': str(i), 'seq': i} for i in range(100_000)]
+    model = MessageListModel(room="general")
+    model.set_messages(list(history))
+    assert model.rowCount() == MAX_LOADED_ROWS
+    assert model.index(MAX_LOADED_ROWS - 1).data() == "99999"
+    
+    model.append({'user': 'a', 'text': 'new'})
+    assert model.rowCount() == MAX_LOADED_ROWS
+    assert model.index(MAX_LOADED_ROWS - 1).data() == "new"
+    # Messages far above the window are let go
+    assert len(model.messages) == HISTORY_LIMIT
+    
+    # A burst is inserted in one go
+    inserted = []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+    model.extend([{'user': 'a', 'text': f'burst {i}'} for i in range(50)])
+    assert inserted == [(MAX_LOADED_ROWS, MAX_LOADED_ROWS + 49)]
+    assert model.rowCount() == MAX_LOADED_ROWS
+    assert len(model.messages) == HISTORY_LIMIT
+    
+    while model.load_older():
+        assert model.rowCount() <= WINDOW_LIMIT
+    oldest = model.messages[0]['seq']
+    assert model.index(0).data() == str(oldest)
+    
+    # Older pages come back from the cache
+    model.fetch_older = lambda seq: history[max(0, seq - PAGE_ROWS):seq]
+    assert model.load_older() == PAGE_ROWS
+    assert model.index(0).data() == str(oldest - PAGE_ROWS)
+    assert model.rowCount() == WINDOW_LIMIT
+    
+    # New messages wait outside the window until the view comes back down
+    model.append({'user': 'a', 'text': 'newer'}, follow=False)
+    assert model.rowCount() == WINDOW_LIMIT
+    assert model.canFetchMore()
+    while model.canFetchMore():
+        model.fetchMore()
+    assert model.index(model.rowCount() - 1).data() == "newer"
+    assert model.rowCount() == WINDOW_LIMIT
+    assert len(model.messages) == HISTORY_LIMIT
+    
+    # A cached room's list grows while another room is shown
+    model.messages.append({'user': 'b', 'text': 'while away'})
+    model.catch_up()
+    assert model.index(model.rowCount() - 1).data() == "while away"
+    
+    # Row heights are cached by message identity, not by dict address
+    assert _message_key("general", {'seq': 5}) == ("general", 5)
+    assert _message_key("general", {'seq': 5, 'id': 'abc'}) == 'abc'
+    assert _message_key("general", {'text': 'system'}) is None
+
+
+def test_search_jump_shows_a_detached_page_of_old_history(tmp_path):
+    """Test that jumping to an old search hit loads a page around it, not everything since."""
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from client.core.cache import MessageCache
+    from client.gui.app_window import AppWindow
+    from client.gui.chat_view import HISTORY_LIMIT, PAGE_ROWS
+    
+    app = QApplication.instance() or QApplication([])
+    window = AppWindow()
+    room = window.current_room
+    window.message_cache = MessageCache(tmp_path / "cache.db")
+    for seq in range(1, 10_001):
+        window.message_cache.add({'room': room, 'seq': seq, 'user': 'amy', 'text': str(seq), 'timestamp': seq})
+    window.message_cache.flush()
+    live = window.room_histories[room]
+    live.extend({'user': 'amy', 'text': str(seq), 'seq': seq} for seq in range(9_951, 10_001))
+    window.chat_view.show_room(room, live)
+    
+    window._open_search_result(room, 500)
+    chat = window.chat_view
+    model = chat.message_model
+    assert chat.detached_room == room
+    assert len(model.messages) == 2 * PAGE_ROWS + 1
+    assert model.message(chat.message_list.currentIndex())['seq'] == 500
+    assert len(window.room_histories[room]) == 50  # The live list is untouched
+    
+    # Received messages go to the live list meanwhile
+    chat.add_messages([{'user': 'bob', 'text': 'live', 'seq': 10_001}])
+    assert live[-1]['text'] == 'live' and model.messages[-1]['seq'] != 10_001
+    
+    # Paging down stops where the live list starts
+    while model.canFetchMore():
+        model.fetchMore()
+        assert len(model.messages) <= HISTORY_LIMIT
+    assert model.messages[-1]['seq'] == 9_950
+    chat._return_to_live()
+    assert chat.detached_room is None and chat.message_model.messages is live
+    
+    # A replaced room list takes its old model with it
+    from PySide6.QtCore import QCoreApplication, QEvent
+    from client.gui.chat_view import MessageListModel
+    old_model = chat.message_model
+    window.room_histories[room] = live = list(live)
+    chat.show_room(room, live)
+    QCoreApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    assert old_model not in chat.findChildren(MessageListModel)
+    
+    # A hit inside the live list just scrolls there
+    window._open_search_result(room, 9_990)
+    assert chat.message_model.message(chat.message_list.currentIndex())['seq'] == 9_990
+    window.message_cache.close()
+    window.message_cache = None
+    window.close()
+
+
+async def test_image_previews_load_in_background_and_cache(tmp_path):
+    """Test that previews are downscaled off the GUI thread, kept in a bounded LRU and on disk."""
+    import asyncio
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QImage, QPixmap
+    from PySide6.QtWidgets import QApplication
+    from client.gui.previews import PixmapCache, PreviewLoader, PREVIEW_WIDTH, PREVIEW_HEIGHT
+    
+    app = QApplication.instance() or QApplication([])
+    image = QImage(2000, 1000, QImage.Format_RGB32)
+    image.fill(0x3366cc)
+    path = tmp_path / "photo.png"
+    assert image.save(str(path))
+    
+    loader = PreviewLoader(cache_dir=tmp_path)
+    ready = asyncio.Event()
+    loader.preview_ready.connect(ready.set)
+    assert loader.preview(str(path)) is None  # Loads in the background
+    await asyncio.wait_for(ready.wait(), 5)
+    pixmap = loader.preview(str(path))
+    assert (pixmap.width(), pixmap.height()) == (PREVIEW_WIDTH, PREVIEW_WIDTH // 2)
+    
+    # Another loader finds it in the disk cache, without the original
+    path.unlink()
+    reloaded = PreviewLoader(cache_dir=tmp_path)
+    reloaded.preview_ready.connect(ready.set)
+    ready.clear()
+    reloaded.preview(str(path))
+    await asyncio.wait_for(ready.wait(), 5)
+    assert reloaded.preview(str(path)).width() == PREVIEW_WIDTH
+    loader.close()
+    reloaded.close()
+    
+    cache = PixmapCache(budget=2 * PREVIEW_WIDTH * PREVIEW_HEIGHT * 4)
+    for key in "abc":
+        cache.put(key, QPixmap(PREVIEW_WIDTH, PREVIEW_HEIGHT))
+    assert "a" not in cache and len(cache) == 2
+    assert cache.size <= cache.budget
+
+
+async def test_image_previews_are_bounded(tmp_path, monkeypatch):
+    """Test that previews refuse decompression bombs, cap the disk cache and retry failures later."""
+    import asyncio
+    import os
+    import struct
+    import zlib
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QImage
+    from PySide6.QtWidgets import QApplication
+    from client.gui import previews
+    
+    app = QApplication.instance() or QApplication([])
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    
+    # A PNG claiming 100000 x 100000 pixels is refused from its header
+    bomb = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 100_000, 100_000, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b""))
+    with pytest.raises(ValueError, match="too large"):
+        previews.decode_preview(bomb)
+    
+    image = QImage(previews.PREVIEW_WIDTH, previews.PREVIEW_HEIGHT, QImage.Format_RGB32)
+    image.fill(0x3366cc)
+    disk = previews.DiskCache(tmp_path / "previews", budget=1)
+    disk.put("a", image)
+    disk.put("b", image)
+    assert disk.get("a") is None and disk.get("b") is not None
+    assert len(list((tmp_path / "previews").iterdir())) == 1
+    # The index is rebuilt from the files on disk
+    assert previews.DiskCache(tmp_path / "previews").get("b") is not None
+    
+    attempts = []
+    
+    async def failing_fetch(url):
+        attempts.append(url)
+        raise ValueError("link expired")
+    
+    loader = previews.PreviewLoader(cache_dir=tmp_path)
+    loader.fetch = failing_fetch
+    url = "http://server/api/download/photo.png?sig=1"
+    loader.preview(url)
+    while loader._loading:
+        await asyncio.sleep(0.01)
+    loader.preview(url)
+    assert len(attempts) == 1  # Not retried on every paint
+    
+    monkeypatch.setattr(previews, "FAILED_RETRY_SECONDS", 0)
+    loader.preview(url)
+    while loader._loading:
+        await asyncio.sleep(0.01)
+    assert len(attempts) == 2
+    loader.close()
+
+
+def _tone(frames, amplitude=8000):
+    """Int16 440 Hz tone lasting a number of 20 ms frames."""
+    import numpy as np
+    from client.core.audio import FRAME_SAMPLES, SAMPLE_RATE
+    
+    t = np.arange(frames * FRAME_SAMPLES) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+
+
+def test_voice_activity_detector():
+    """Test that VAD passes speech, rejects silence and holds over word ends."""
+    import numpy as np
+    from client.core.audio import FRAME_SAMPLES, VoiceActivityDetector
+    
+    vad = VoiceActivityDetector(hangover=3)
+    levels, voiced = vad.process(np.zeros(10 * FRAME_SAMPLES, dtype=np.int16))
+    assert not voiced.any() and not levels.any()
+    
+    levels, voiced = vad.process(_tone(4))
+    assert voiced.all()
+    assert levels[0] == pytest.approx(8000 / 32768 / np.sqrt(2), rel=0.01)
+    
+    _, voiced = vad.process(np.zeros(5 * FRAME_SAMPLES, dtype=np.int16))
+    assert voiced.tolist() == [True, True, True, False, False]
+
+
+def test_level_ring_wraps():
+    """Test that the level ring keeps the most recent levels in order."""
+    from client.core.audio import LevelRing
+    
+    ring = LevelRing(size=4)
+    assert ring.peak() == 0.0
+    for level in range(6):
+        ring.push(level / 10)
+    assert ring.latest(10).tolist() == pytest.approx([0.2, 0.3, 0.4, 0.5])
+    assert ring.peak(2) == pytest.approx(0.5)
+
+
+async def test_microphone_track_drops_silence():
+    """Test that only voiced, unmuted frames reach the encoder."""
+    import asyncio
+    import threading
+    import numpy as np
+    from client.core.audio import FRAME_SAMPLES, MicrophoneTrack
+    
+    class FakeCapture:
+        def start(self):
+            pass
+        
+        def stop(self):
+            pass
+    
+    track = MicrophoneTrack(capture=FakeCapture())
+    track.vad.hangover = 0
+    blocks = [np.zeros(3 * FRAME_SAMPLES, dtype=np.int16), _tone(2)]
+    
+    def capture_thread():
+        for block in blocks:
+            track.feed(block)
+        track.muted = True
+        track.feed(_tone(2))
+    
+    thread = threading.Thread(target=capture_thread)
+    thread.start()
+    thread.join()
+    
+    lead = await asyncio.wait_for(track.recv(), 1)
+    first = await asyncio.wait_for(track.recv(), 1)
+    second = await asyncio.wait_for(track.recv(), 1)
+    # The silent frame before the onset leads the speech
+    assert (lead.pts, first.pts, second.pts) == (2 * FRAME_SAMPLES, 3 * FRAME_SAMPLES, 4 * FRAME_SAMPLES)
+    assert first.samples == FRAME_SAMPLES
+    assert track._queue.empty()  # Other silent and muted frames were never queued
+    assert track.levels.peak() > 0.1
+    track.stop()
+
+
+async def test_voice_panel_drives_the_microphone_track():
+    """Test that the voice panel meters the microphone and its mute button mutes the track."""
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from client.core.audio import MicrophoneTrack
+    from client.core.media import VoiceManager
+    from client.gui.voice_panel import VoicePanel
+    
+    class FakeCapture:
+        def start(self):
+            pass
+        
+        def stop(self):
+            pass
+    
+    app = QApplication.instance() or QApplication([])
+    manager = VoiceManager()
+    manager.audio_track = track = MicrophoneTrack(capture=FakeCapture())
+    panel = VoicePanel()
+    panel.set_voice_manager(manager)
+    panel.start_voice()
+    assert panel.level_ring is track.levels
+    
+    track.feed(_tone(2))
+    assert panel._current_level() > 0
+    
+    panel._toggle_mute()
+    assert track.muted and manager.is_muted
+    panel._toggle_mute()
+    assert not track.muted
+    
+    panel.stop_voice()
+    assert panel._current_level() == 0
+    track.stop()
+
+
+async def test_voice_panel_shows_announced_speakers():
+    """Test that the SFU's active speaker announcements reach the panel by name."""
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from client.core.media import VoiceManager
+    from client.gui.voice_panel import VoicePanel
+    
+    app = QApplication.instance() or QApplication([])
+    manager = VoiceManager()
+    panel = VoicePanel()
+    panel.set_voice_manager(manager)
+    
+    await manager.handle_signal({'type': 'roster', 'peer_id': 'me', 'peers': [{'peer': 'p1', 'user': 'alice'}]})
+    await manager.handle_signal({'type': 'peer_joined', 'peer': 'p2', 'user': 'bob'})
+    # Announced on joining the SFU, before voice negotiation
+    await manager.handle_signal({'type': 'sfu_speakers', 'peers': ['p2', 'me', 'p1']})
+    assert manager.active_speakers == ['p2', 'me', 'p1']
+    assert panel.speakers_label.text() == "🗣️ bob, You, alice"
+    
+    await manager.stop_voice_chat()
+    assert panel.speakers_label.text() == ""
+
+
+def _opus_frames(count):
+    """Opus-encode a tone into ``count`` 20 ms (payload, timestamp) pairs."""
+    import fractions
+    import av
+    from aiortc.codecs.opus import OpusEncoder
+    from client.core.audio import FRAME_SAMPLES
+    
+    encoder = OpusEncoder()
+    samples = _tone(count + 1)
+    packets = []
+    for i in range(count + 1):
+        frame = av.AudioFrame.from_ndarray(
+            samples[i * FRAME_SAMPLES:(i + 1) * FRAME_SAMPLES].reshape(1, -1), format='s16', layout='mono'
+        )
+        frame.sample_rate = 48000
+        frame.pts = i * FRAME_SAMPLES
+        frame.time_base = fractions.Fraction(1, 48000)
+        payloads, timestamp = encoder.encode(frame)
+        packets += [(payload, timestamp) for payload in payloads]
+    return packets[:count]
+
+
+async def test_playout_refuses_unsupported_aiortc(monkeypatch):
+    """Test that voice chat checks for the aiortc receiver internals playout replaces."""
+    from client.core import media
+    from common.aiortc_internals import check_receiver_internals
+    
+    check_receiver_internals(media.RECEIVER_INTERNALS)
+    monkeypatch.setattr(media, "RECEIVER_INTERNALS", media.RECEIVER_INTERNALS + ('_RTCRtpReceiver__gone',))
+    voice = media.VoiceManager()
+    sent = []
+    
+    async def send(message):
+        sent.append(message)
+    
+    with pytest.raises(RuntimeError, match="__gone"):
+        await voice.start_voice_chat(send)
+    assert voice.peer_connection is None and not sent
+
+
+def test_playout_conceals_loss_and_reorders():
+    """Test that reordered frames play in order and a lost frame is concealed."""
+    import numpy as np
+    from client.core.media import PlayoutStream
+    
+    packets = _opus_frames(20)
+    order = list(range(20))
+    order[6], order[7] = order[7], order[6]  # Reordered
+    order.remove(12)  # Lost
+    
+    stream = PlayoutStream()
+    output = []
+    for step, index in enumerate(order):
+        payload, timestamp = packets[index]
+        stream.push(payload, timestamp, arrival=step * 0.02)
+        if step >= 2:  # The output clock runs two frames behind
+            output.append(stream.read())
+    
+    assert stream.target_frames == 1
+    assert (stream.packets_late, stream.frames_concealed) == (0, 1)
+    levels = [np.sqrt(np.mean(frame.astype(np.float32) ** 2)) for frame in output[1:]]
+    assert min(levels) > 1000  # No silent gap where the frame was lost
+
+
+def test_playout_adapts_to_jitter():
+    """Test that the playout delay grows with jitter and built-up latency is drained."""
+    import random
+    from client.core.media import MAX_DELAY_FRAMES, PlayoutStream
+    
+    packets = _opus_frames(60)
+    rng = random.Random(7)
+    jittery = PlayoutStream()
+    for i, (payload, timestamp) in enumerate(packets[:40]):
+        jittery.push(payload, timestamp, arrival=i * 0.02 + rng.uniform(0, 0.06))
+    assert 2 <= jittery.target_frames <= MAX_DELAY_FRAMES
+    
+    # A burst arrives at once on a clean link: playback catches up by time-stretching
+    burst = PlayoutStream()
+    for payload, timestamp in packets[:20]:
+        burst.push(payload, timestamp, arrival=0.0)
+    start_delay = burst.delay_ms
+    for _ in range(10):
+        burst.read()
+    assert burst.frames_accelerated > 0
+    assert burst.delay_ms < start_delay - 10 * 20
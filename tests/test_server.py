@@ -1,16 +1,19 @@
 """Tests for server functionality."""
 
+import asyncio
+import hashlib
+import json
 import pytest
+from pathlib import Path
 from server.storage import Storage
 from server.models import User
 from server.auth import AuthManager
 
 
 @pytest.fixture
-def storage():
+def storage(tmp_path):
     """Create a test storage instance."""
-    storage = Storage()
-    storage.config.db_path = ":memory:"  # Use in-memory DB for tests
+    storage = Storage(db_path=str(tmp_path / "test.db"), upload_dir=str(tmp_path))
     storage.initialize()
     return storage
 
@@ -94,3 +97,752 @@ def test_get_recent_messages(storage):
     assert len(messages) == 5
     assert messages[0].content == "Message 9"
 
+
+
+async def test_save_file_reuses_blob(storage):
+    """Test that identical content is stored once."""
+    user = storage.create_user("testuser", "hash")
+    
+    first = await storage.save_file("a.txt", b"same bytes", user.id, "testuser",
+                                    "general", "text/plain")
+    second = await storage.save_file("b.txt", b"same bytes", user.id, "testuser",
+                                     "room-1", "text/plain")
+    
+    assert first == second
+    assert len(list(storage.upload_dir.iterdir())) == 2  # test.db + one blob
+    assert storage.get_file_by_hash(hashlib.sha256(b"same bytes").hexdigest()) is not None
+
+
+async def test_upload_check_links_existing_blob(storage, auth, monkeypatch):
+    """Test the upload-by-hash handshake."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    from server.api import rest
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    user = storage.create_user("testuser", "hash")
+    await storage.save_file("a.txt", b"shared", user.id, "testuser", "general", "text/plain")
+    
+    app = web.Application()
+    rest.setup_routes(app)
+    headers = {'Authorization': f'Bearer {auth.create_token(user.id, "testuser")}'}
+    
+    async with TestClient(TestServer(app)) as client:
+        known = await client.post('/api/upload/check', headers=headers, json={
+            'sha256': hashlib.sha256(b"shared").hexdigest(),
+            'file_name': 'copy.txt',
+            'file_size': 6,
+            'room': 'room-1'
+        })
+        result = await known.json()
+        assert result['exists']
+        assert result['file_name'] == 'copy.txt'
+        
+        unknown = await client.post('/api/upload/check', headers=headers, json={
+            'sha256': hashlib.sha256(b"other").hexdigest(),
+            'file_name': 'other.txt',
+            'file_size': 5,
+            'room': 'room-1'
+        })
+        assert not (await unknown.json())['exists']
+
+
+async def test_server_app_stores_and_deduplicates_uploads(storage, monkeypatch):
+    """Test that the chat server's upload endpoints store files and skip known content."""
+    from aiohttp import FormData
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+
+    async with TestClient(TestServer(main.create_app())) as client:
+        form = FormData()
+        form.add_field('room', 'general')
+        form.add_field('file', b"picture bytes", filename='cat.png', content_type='image/png')
+        uploaded = await (await client.post('/api/upload', data=form)).json()
+        assert uploaded['success']
+
+        check = await client.post('/api/upload/check', json={
+            'sha256': hashlib.sha256(b"picture bytes").hexdigest(),
+            'file_name': 'same-cat.png',
+            'file_size': 13,
+            'room': 'room-1'
+        })
+        linked = await check.json()
+        assert linked['exists']
+
+        response = await client.get(linked['file_url'])
+        assert response.status == 200
+        assert await response.read() == b"picture bytes"
+
+    assert len([p for p in storage.upload_dir.iterdir() if p.suffix == '.png']) == 1
+
+
+async def test_storage_usage_accounting(storage):
+    """Test that usage totals follow uploads."""
+    user = storage.create_user("testuser", "hash")
+    
+    await storage.save_file("a.txt", b"a" * 10, user.id, "testuser", "general", "text/plain")
+    await storage.save_file("b.txt", b"b" * 5, user.id, "testuser", "room-1", "text/plain")
+    
+    assert storage.get_usage("user", user.id) == 15
+    assert storage.get_usage("room", "general") == 10
+    assert storage.get_usage("room", "room-1") == 5
+
+
+async def test_room_quota_evicts_least_recently_downloaded(storage, monkeypatch):
+    """Test LRU eviction when a room goes over its quota."""
+    monkeypatch.setattr(storage.config, "room_quota", 25)
+    user = storage.create_user("testuser", "hash")
+    
+    old = await storage.save_file("old.txt", b"o" * 10, user.id, "testuser", "general", "text/plain")
+    new = await storage.save_file("new.txt", b"n" * 10, user.id, "testuser", "general", "text/plain")
+    storage.touch_file(Path(old).name)  # "old" was downloaded most recently
+    
+    latest = await storage.save_file("latest.txt", b"l" * 10, user.id, "testuser", "general", "text/plain")
+    
+    assert Path(old).exists()
+    assert not Path(new).exists()
+    assert Path(latest).exists()
+    assert [f.original_filename for f in storage.list_room_files("general")] == ["latest.txt", "old.txt"]
+    assert storage.get_usage("room", "general") == 20
+    assert storage.get_usage("user", user.id) == 20
+
+
+async def test_rejected_upload_evicts_nothing(storage, monkeypatch):
+    """Test that a file over the user quota is not kept and frees no room space."""
+    from server.storage import QuotaExceededError
+    
+    monkeypatch.setattr(storage.config, "room_quota", 25)
+    monkeypatch.setattr(storage.config, "user_quota", 25)
+    user = storage.create_user("testuser", "hash")
+    
+    first = await storage.save_file("a.txt", b"a" * 10, user.id, "testuser", "general", "text/plain")
+    second = await storage.save_file("b.txt", b"b" * 10, user.id, "testuser", "general", "text/plain")
+    
+    with pytest.raises(QuotaExceededError):
+        await storage.save_file("c.txt", b"c" * 10, user.id, "testuser", "general", "text/plain")
+    with pytest.raises(QuotaExceededError):
+        storage.link_file(storage.get_file_by_hash(hashlib.sha256(b"a" * 10).hexdigest()),
+                          "copy.txt", user.id, "testuser", "room-1")
+    
+    assert Path(first).exists() and Path(second).exists()
+    assert sorted(p.name for p in storage.upload_dir.iterdir() if p.suffix == '.txt') == sorted(
+        [Path(first).name, Path(second).name])
+    assert storage.get_usage("user", user.id) == 20
+    assert storage.get_usage("room", "room-1") == 0
+
+
+async def test_server_app_reports_usage_to_admins(storage, auth, monkeypatch):
+    """Test the chat server's admin usage endpoint."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+    from server.models import UserRole
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    user = storage.create_user("testuser", "hash")
+    admin_id = storage.create_user("admin", "hash").id
+    with storage.get_session() as session:
+        session.get(User, admin_id).role = UserRole.ADMIN
+        session.commit()
+    await storage.save_file("a.txt", b"a" * 10, user.id, "testuser", "general", "text/plain")
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        as_user = {'Authorization': f'Bearer {auth.create_token(user.id, "testuser")}'}
+        assert (await client.get('/api/admin/usage', headers=as_user)).status == 403
+        
+        as_admin = {'Authorization': f'Bearer {auth.create_token(admin_id, "admin")}'}
+        usage = await (await client.get('/api/admin/usage', headers=as_admin)).json()
+        assert usage['rooms'] == [{'owner': 'general', 'bytes_used': 10, 'file_count': 1}]
+
+
+async def test_room_files_keyset_pagination(storage, auth, monkeypatch):
+    """Test the room gallery endpoint pages and filters by type."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    user = storage.create_user("testuser", "hash")
+    for i in range(5):
+        await storage.save_file(f"pic{i}.png", f"image {i}".encode(), user.id, "testuser",
+                                "general/General Text", "image/png")
+    await storage.save_file("notes.pdf", b"pdf", user.id, "testuser",
+                            "general/General Text", "application/pdf")
+    
+    app = main.create_app()
+    headers = {'Authorization': f'Bearer {auth.create_token(user.id, "testuser")}'}
+    url = '/api/rooms/general%2FGeneral%20Text/files'
+    
+    async with TestClient(TestServer(app)) as client:
+        first = await (await client.get(url, headers=headers,
+                                        params={'type': 'images', 'limit': 3})).json()
+        assert [f['file_name'] for f in first['files']] == ['pic4.png', 'pic3.png', 'pic2.png']
+        assert first['files'][0]['thumbnail_url'].startswith('/api/thumbnail/')
+        
+        second = await (await client.get(url, headers=headers, params={
+            'type': 'images', 'limit': 3, 'before': first['next_cursor']
+        })).json()
+        assert [f['file_name'] for f in second['files']] == ['pic1.png', 'pic0.png']
+        assert second['next_cursor'] is None
+        
+        documents = await (await client.get(url, headers=headers,
+                                            params={'type': 'documents'})).json()
+        assert [f['file_name'] for f in documents['files']] == ['notes.pdf']
+        assert documents['files'][0]['thumbnail_url'] is None
+        
+        for bad_type in ('imagesss', 'thing'):
+            response = await client.get(url, headers=headers, params={'type': bad_type})
+            assert response.status == 400
+
+
+async def test_register_and_login(storage, monkeypatch):
+    """Test account endpoints with bcrypt in the worker pool."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    from server.api import rest
+    
+    auth = AuthManager()
+    monkeypatch.setattr(auth.config, "bcrypt_rounds", 4)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_auth_manager", lambda: auth)
+    
+    app = web.Application()
+    rest.setup_routes(app)
+    
+    async with TestClient(TestServer(app)) as client:
+        credentials = {'username': 'alice', 'password': 'secret'}
+        
+        registered = await client.post('/api/register', json=credentials)
+        assert registered.status == 201
+        assert (await client.post('/api/register', json=credentials)).status == 409
+        
+        login = await client.post('/api/login', json=credentials)
+        assert login.status == 200
+        token = (await login.json())['token']
+        assert auth.verify_token(token)['username'] == 'alice'
+        
+        wrong = await client.post('/api/login', json={'username': 'alice', 'password': 'nope'})
+        assert wrong.status == 401
+        unknown = await client.post('/api/login', json={'username': 'bob', 'password': 'x'})
+        assert unknown.status == 401
+        
+        # Overlong passwords get the same answer whether the account exists or not
+        for name in ('alice', 'bob'):
+            overlong = await client.post('/api/login', json={'username': name, 'password': 'x' * 100})
+            assert overlong.status == 400
+        assert not await auth.verify_password_async('x' * 100, None)
+        
+        for body in (['alice'], "alice", 42):
+            for path in ('/api/register', '/api/login'):
+                assert (await client.post(path, json=body)).status == 400
+
+
+async def test_auth_pool_rejects_when_saturated(auth, monkeypatch):
+    """Test that a full bcrypt queue raises AuthBusyError."""
+    from server.auth import AuthBusyError
+    
+    monkeypatch.setattr(auth.config, "auth_workers", 1)
+    monkeypatch.setattr(auth.config, "auth_queue_size", 0)
+    monkeypatch.setattr(auth.config, "bcrypt_rounds", 4)
+    
+    first = asyncio.ensure_future(auth.hash_password_async("one"))
+    await asyncio.sleep(0)
+    with pytest.raises(AuthBusyError):
+        await auth.hash_password_async("two")
+    assert await first
+
+
+def test_verified_token_cache(auth, monkeypatch):
+    """Test that repeat verifications are served from the token cache."""
+    import jwt
+    import server.auth
+    
+    token = auth.create_token(user_id=1, username="testuser")
+    calls = []
+    real_decode = jwt.decode
+    monkeypatch.setattr(server.auth.jwt, "decode",
+                        lambda *args, **kwargs: calls.append(1) or real_decode(*args, **kwargs))
+    
+    assert auth.verify_token(token)['username'] == "testuser"
+    assert auth.verify_token(token)['username'] == "testuser"
+    assert len(calls) == 1
+    
+    # Cached entries are dropped once they expire
+    next(iter(auth._token_cache.values()))['exp'] = 0
+    assert auth.verify_token(token) is not None
+    assert len(calls) == 2
+
+
+async def test_websocket_identity_bound_at_handshake(storage, auth, monkeypatch):
+    """Test that WebSocket messages carry the handshake identity, not the claimed user."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    token = auth.create_token(user_id=7, username="alice")
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        ws = await client.ws_connect('/ws', params={'room': 'general', 'token': token})
+        assert (await ws.receive_json())['type'] == 'session'
+        await ws.send_json({'type': 'text', 'user': 'mallory', 'text': 'hi'})
+        message = await ws.receive_json()
+        assert message['user'] == 'alice'
+        await ws.close()
+
+
+def test_room_log_replays_only_the_gap(monkeypatch):
+    """Test that the replay buffer returns missed messages or None once they aged out."""
+    from server.api.sessions import RoomLog
+    
+    log = RoomLog(size=3)
+    for i in range(5):
+        log.append({'text': f'm{i}'})
+    
+    assert log.seq == 5
+    assert [json.loads(m)['text'] for m in log.since(3)] == ['m3', 'm4']
+    assert log.since(5) == []
+    assert log.since(1) is None  # seq 2 was dropped from the buffer
+
+
+async def test_websocket_session_resume(storage, auth, monkeypatch):
+    """Test that a resumed connection gets only the gap, or a resync when it aged out."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+    from server.config import get_config
+    
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(get_config(), "replay_buffer_size", 3)
+    user = storage.create_user("bob", "hash")
+    token = auth.create_token(user.id, "bob")
+    params = {'room': 'resume-room', 'token': token}
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        ws = await client.ws_connect('/ws', params=params)
+        session = await ws.receive_json()
+        await ws.send_json({'type': 'text', 'text': 'before'})
+        last_seq = (await ws.receive_json())['seq']
+        await ws.close()
+        
+        sender = await client.ws_connect('/ws', params=params)
+        await sender.receive_json()
+        for text in ('gap-1', 'gap-2'):
+            await sender.send_json({'type': 'text', 'text': text})
+            await sender.receive_json()
+        
+        resume = {**params, 'resume': session['resume_token'], 'last_seq': str(last_seq)}
+        ws = await client.ws_connect('/ws', params=resume)
+        assert (await ws.receive_json())['resumed']
+        replayed = [await ws.receive_json() for _ in range(2)]
+        assert [m['text'] for m in replayed] == ['gap-1', 'gap-2']
+        await ws.close()
+        
+        # Push the first missed message out of the 3-message buffer
+        for text in ('gap-3', 'gap-4'):
+            await sender.send_json({'type': 'text', 'text': text})
+            await sender.receive_json()
+        
+        ws = await client.ws_connect('/ws', params=resume)
+        await ws.receive_json()
+        resync = await ws.receive_json()
+        assert resync['type'] == 'resync'
+        assert (resync['after_seq'], resync['before_seq']) == (last_seq, last_seq + 2)
+        assert [(await ws.receive_json())['text'] for _ in range(3)] == ['gap-2', 'gap-3', 'gap-4']
+        
+        # The aged-out message is served from history
+        history = await client.get('/api/rooms/resume-room/messages', params={
+            'after_seq': str(resync['after_seq']), 'before_seq': str(resync['before_seq'])
+        }, headers={'Authorization': f'Bearer {token}'})
+        assert [m['text'] for m in (await history.json())['messages']] == ['gap-1']
+        await ws.close()
+        await sender.close()
+
+
+async def test_websocket_multiplexes_rooms(storage, auth, monkeypatch):
+    """Test that one connection subscribes to several rooms and gets tagged frames."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    user = storage.create_user("carol", "hash")
+    token = auth.create_token(user.id, "carol")
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        ws = await client.ws_connect('/ws', params={'token': token})
+        for room in ('mux-a', 'mux-b'):
+            await ws.send_json({'type': 'subscribe', 'room': room})
+            session = await ws.receive_json()
+            assert (session['type'], session['room']) == ('session', room)
+        
+        for room in ('mux-a', 'mux-b'):
+            await ws.send_json({'type': 'text', 'room': room, 'text': f'hi {room}'})
+            message = await ws.receive_json()
+            assert (message['room'], message['text']) == (room, f'hi {room}')
+        
+        await ws.send_json({'type': 'unsubscribe', 'room': 'mux-a'})
+        assert await ws.receive_json() == {'type': 'unsubscribed', 'room': 'mux-a'}
+        await ws.send_json({'type': 'text', 'room': 'mux-a', 'text': 'lost'})
+        assert (await ws.receive_json())['error'] == 'Not subscribed'
+        assert 'mux-a' not in main.ROOMS
+        
+        # Malformed frames get an error instead of dropping the connection
+        await ws.send_json({'type': 'subscribe', 'room': 'mux-a', 'last_seq': 'x'})
+        assert (await ws.receive_json())['error'] == 'Invalid last_seq'
+        await ws.send_json({'type': 'batch', 'messages': 'x'})
+        assert (await ws.receive_json())['error'] == 'Invalid batch'
+        await ws.send_json({'type': 'text', 'room': 'mux-b', 'text': 'still here'})
+        assert (await ws.receive_json())['text'] == 'still here'
+        
+        await ws.close()
+        for _ in range(100):
+            if 'mux-b' not in main.ROOMS:
+                break
+            await asyncio.sleep(0.01)
+        assert 'mux-b' not in main.ROOMS
+        assert not main.CONNECTION_ROOMS
+
+
+def test_room_seq_continues_after_restart(storage, monkeypatch):
+    """Test that a room's numbering continues from its stored messages."""
+    from server import main
+    from server.api import sessions
+    
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(sessions, "ROOM_LOGS", {})
+    user = storage.create_user("bob", "hash")
+    for seq in (1, 2, 3):
+        storage.save_message("restart-room", user.id, "bob", "text", f"m{seq}", seq=seq)
+    assert storage.get_last_seq("restart-room") == 3
+    assert storage.get_last_seq("empty-room") == 0
+    
+    log = sessions.get_room_log("restart-room", lambda: storage.get_last_seq("restart-room"))
+    assert json.loads(log.append({'text': 'm4'}))['seq'] == 4
+
+
+def test_room_log_remembers_client_message_ids(storage, monkeypatch):
+    """Test that resent messages are recognized by client ID, also after a restart."""
+    from server.api import sessions
+    
+    monkeypatch.setattr(sessions, "ROOM_LOGS", {})
+    log = sessions.get_room_log("dedup-room")
+    log.append({'user': 'bob', 'text': 'hi', 'id': 'm1'})
+    assert log.seq_of('bob', 'm1') == 1
+    assert log.seq_of('eve', 'm1') is None  # IDs are per sender
+    
+    user = storage.create_user("bob", "hash")
+    storage.save_message("dedup-room", user.id, "bob", "hi", seq=1, client_id="m1")
+    monkeypatch.setattr(sessions, "ROOM_LOGS", {})
+    log = sessions.get_room_log("dedup-room", lambda: storage.get_last_seq("dedup-room"),
+                                lambda limit: storage.get_recent_client_ids("dedup-room", limit))
+    assert (log.seq, log.seq_of('bob', 'm1')) == (1, 1)
+
+
+def test_idle_room_logs_are_evicted(storage, monkeypatch):
+    """Test that logs of rooms nobody is subscribed to are dropped beyond the limit."""
+    from server import main
+    from server.api import sessions
+    from server.config import get_config
+    
+    monkeypatch.setattr(main, "get_storage", lambda: storage)
+    monkeypatch.setattr(sessions, "ROOM_LOGS", {})
+    monkeypatch.setattr(get_config(), "room_log_limit", 2)
+    user = storage.create_user("bob", "hash")
+    
+    ws = object()
+    for room in ("idle-a", "idle-b", "idle-c"):
+        main.ROOMS.setdefault(room, set()).add(ws)
+        main.room_log(room).append({'user': 'bob', 'text': 'hi'})
+        storage.save_message(room, user.id, "bob", "hi", seq=1)
+    
+    main.unsubscribe(ws, "idle-a")
+    main.unsubscribe(ws, "idle-b")
+    assert list(sessions.ROOM_LOGS) == ["idle-c", "idle-b"]  # Rooms in use are kept
+    
+    main.unsubscribe(ws, "idle-c")
+    assert list(sessions.ROOM_LOGS) == ["idle-b", "idle-c"]
+    
+    # A dropped log picks its numbering up from storage
+    assert json.loads(main.room_log("idle-a").append({'text': 'again'}))['seq'] == 2
+
+
+def test_signed_download_url(auth):
+    """Test that download URL signatures bind path and expiry."""
+    from urllib.parse import urlsplit, parse_qsl
+    
+    url = auth.sign_download_url("/api/download/a b.png", user_id=3)
+    path, query = urlsplit(url).path, dict(parse_qsl(urlsplit(url).query))
+    assert path == "/api/download/a%20b.png"
+    assert query['uid'] == '3'
+    
+    assert auth.verify_download_url("/api/download/a b.png", query)
+    assert not auth.verify_download_url("/api/download/other.png", query)
+    assert not auth.verify_download_url("/api/download/a b.png", {**query, 'uid': '4'})
+    assert not auth.verify_download_url("/api/download/a b.png", {**query, 'exp': str(int(query['exp']) + 1)})
+    
+    expired = dict(parse_qsl(urlsplit(auth.sign_download_url("/x", expires_in=-1)).query))
+    assert not auth.verify_download_url("/x", expired)
+
+
+async def test_download_requires_signed_url(storage, auth, monkeypatch):
+    """Test that the gallery hands out signed URLs that download without a token."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    from server.api import rest
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    user = storage.create_user("testuser", "hash")
+    await storage.save_file("report.pdf", b"report", user.id, "testuser", "general", "application/pdf")
+    
+    app = web.Application()
+    rest.setup_routes(app)
+    headers = {'Authorization': f'Bearer {auth.create_token(user.id, "testuser")}'}
+    
+    async with TestClient(TestServer(app)) as client:
+        listing = await (await client.get('/api/rooms/general/files', headers=headers)).json()
+        file_url = listing['files'][0]['file_url']
+        
+        response = await client.get(file_url)
+        assert response.status == 200
+        assert await response.read() == b"report"
+        assert response.headers['Cache-Control'].startswith('public, max-age=')
+        
+        unsigned = file_url.split('?')[0]
+        assert (await client.get(unsigned)).status == 403
+        assert (await client.get(file_url.replace('sig=', 'sig=x'))).status == 403
+        assert (await client.get(unsigned, headers=headers)).status == 200
+
+
+async def test_thumbnails_require_access_to_the_gallery(storage, auth, monkeypatch):
+    """Test that thumbnails follow the gallery's access rules."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest.get_config(), "allow_anonymous", False)
+    user = storage.create_user("testuser", "hash")
+    headers = {'Authorization': f'Bearer {auth.create_token(user.id, "testuser")}'}
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        assert (await client.get('/api/thumbnail/missing.png')).status == 401
+        assert (await client.get('/api/files/missing.png/url')).status == 401
+        assert (await client.get('/api/thumbnail/missing.png', headers=headers)).status == 404
+
+
+async def test_file_links_are_signed_only_for_readers(storage, auth, monkeypatch):
+    """Test that fresh download links need a recorded file in a room the caller can read."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from server import main
+    from server.api import rest
+    from server.models import Room
+    
+    monkeypatch.setattr(rest, "get_storage", lambda: storage)
+    monkeypatch.setattr(rest.get_config(), "allow_anonymous", True)
+    owner = storage.create_user("owner", "hash")
+    other = storage.create_user("other", "hash")
+    owner_headers = {'Authorization': f'Bearer {auth.create_token(owner.id, "owner")}'}
+    other_headers = {'Authorization': f'Bearer {auth.create_token(other.id, "other")}'}
+    with storage.get_session() as session:
+        session.add(Room(name="private-room", owner_id=owner.id, is_private=True))
+        session.commit()
+    await storage.save_file("plan.txt", b"private plan", owner.id, "owner", "private-room", "text/plain")
+    await storage.save_file("notes.txt", b"public notes", owner.id, "owner", "open-room", "text/plain")
+    private_name = storage.list_room_files("private-room")[0].filename
+    public_name = storage.list_room_files("open-room")[0].filename
+    (storage.upload_dir / "secret_probe.txt").write_bytes(b"not a chat file")
+    
+    async with TestClient(TestServer(main.create_app())) as client:
+        # Files on disk without a record are never signed
+        assert (await client.get('/api/files/secret_probe.txt/url')).status == 404
+        
+        assert (await client.get(f'/api/files/{private_name}/url')).status == 403
+        assert (await client.get(f'/api/files/{private_name}/url', headers=other_headers)).status == 403
+        assert (await client.get(f'/api/download/{private_name}', headers=other_headers)).status == 403
+        assert (await client.get('/api/rooms/private-room/files')).status == 403
+        
+        signed = await client.get(f'/api/files/{private_name}/url', headers=owner_headers)
+        assert signed.status == 200
+        download = await client.get((await signed.json())['file_url'])
+        assert await download.read() == b"private plan"
+        
+        # Open rooms stay readable anonymously
+        assert (await client.get(f'/api/files/{public_name}/url')).status == 200
+
+
+async def test_sfu_forwards_without_mesh():
+    """Test that SFU peers publish one track and receive everyone else's audio."""
+    from aiortc.mediastreams import AudioStreamTrack
+    from client.core.media import VoiceManager
+    from server.voice.sfu import SFU
+    
+    sfu = SFU()
+    clients = {}
+    
+    for name in ("a", "b", "c"):
+        client = clients[name] = VoiceManager()
+        
+        async def to_client(message, client=client):
+            await client.handle_signal(message)
+        
+        async def to_server(message, name=name):
+            await sfu.handle_message(name, message)
+        
+        await sfu.join("voice-room", name, to_client)
+        await client.start_voice_chat(to_server, AudioStreamTrack())
+    
+    try:
+        for _ in range(200):
+            if all(len(c.slot_peers) == 2 for c in clients.values()):
+                break
+            await asyncio.sleep(0.05)
+        assert sorted(clients["c"].slot_peers.values()) == ["a", "b"]
+        
+        # Constant uplink: one sender per client, however many peers there are
+        for client in clients.values():
+            assert [s.track for s in client.peer_connection.getSenders() if s.track] == [client.audio_track]
+        
+        mid = next(m for m, peer in clients["c"].slot_peers.items() if peer == "a")
+        stream = clients["c"].playout[mid]
+        for _ in range(100):
+            if stream.packets_received:
+                break
+            await asyncio.sleep(0.05)
+        assert stream.packets_received > 0
+        assert stream.read().shape == (960,)
+        assert sfu.packets_forwarded > 0
+        
+        await clients["c"].unsubscribe("a")
+        assert list(clients["c"].slot_peers.values()) == ["b"]
+        
+        await sfu.leave("a")
+        assert "a" not in clients["b"].slot_peers.values()
+    finally:
+        for client in clients.values():
+            await client.stop_voice_chat()
+        await sfu.stop()
+
+
+async def test_sfu_refuses_unsupported_aiortc(monkeypatch):
+    """Test that the SFU checks for the aiortc internals it replaces before connecting."""
+    from aiortc.rtcrtpreceiver import RTCRtpReceiver
+    from server.voice.sfu import SFU, SfuPeer
+    
+    sfu = SFU()
+    peer = SfuPeer("a", "voice-room", None)
+    await sfu._create_connection(peer).close()
+    monkeypatch.delattr(RTCRtpReceiver, "_handle_rtp_packet")
+    with pytest.raises(RuntimeError, match="_handle_rtp_packet"):
+        sfu._create_connection(peer)
+
+
+async def test_sfu_active_speakers():
+    """Test that speakers come from RTP audio levels and are announced only on change."""
+    from aiortc.rtp import RtpPacket
+    from server.voice.sfu import SFU, SPEAKER_TIMEOUT
+    
+    sfu = SFU()
+    received = {"a": [], "b": []}
+    for name in received:
+        async def send(message, name=name):
+            received[name].append(message)
+        await sfu.join("voice-room", name, send)
+    
+    def hear(name, level, count=20):
+        for _ in range(count):
+            packet = RtpPacket()
+            packet.extensions.audio_level = (False, level)  # -dBov
+            sfu._measure(sfu.peers[name], packet)
+    
+    try:
+        hear("a", 20)
+        hear("b", 90)  # Background noise
+        await sfu.update_speakers()
+        await sfu.update_speakers()
+        assert received["a"] == received["b"] == [{'type': 'sfu_speakers', 'peers': ["a"]}]
+        
+        hear("b", 10)
+        await sfu.update_speakers()
+        assert received["b"][-1]['peers'] == ["b", "a"]
+        
+        # Peers stop sending when they stop talking
+        sfu.peers["a"].heard_at -= SPEAKER_TIMEOUT + 1
+        await sfu.update_speakers()
+        assert received["b"][-1]['peers'] == ["b"]
+        assert len(received["a"]) == 3
+    finally:
+        await sfu.stop()
+
+
+async def test_voice_signaling_is_addressed():
+    """Test peer IDs, rosters and delivery of addressed signaling to one peer."""
+    from aiohttp.test_utils import TestClient, TestServer
+    from common.protocol import SignalingMessage
+    from server.main import create_app
+    
+    async with TestClient(TestServer(create_app())) as client:
+        sockets, ids = {}, {}
+        for name in ("a", "b", "c"):
+            ws = sockets[name] = await client.ws_connect('/voice', params={'room': 'sig-room', 'user': name})
+            roster = await ws.receive_json()
+            assert roster['type'] == 'roster'
+            assert sorted(p['user'] for p in roster['peers']) == sorted(ids)
+            ids[name] = roster['peer_id']
+        
+        joined = await sockets["a"].receive_json()
+        assert joined == {'type': 'peer_joined', 'peer': ids["b"], 'user': 'b'}
+        assert (await sockets["a"].receive_json())['peer'] == ids["c"]
+        assert (await sockets["b"].receive_json())['peer'] == ids["c"]
+        
+        offer = SignalingMessage("offer", "sig-room", "a", {'sdp': 'v=0'}, to_peer=ids["c"])
+        await sockets["a"].send_json(offer.to_dict())
+        received = SignalingMessage.from_dict(await sockets["c"].receive_json())
+        assert received.from_peer == ids["a"]
+        assert received.data == {'sdp': 'v=0'}
+        
+        # b got nothing: the next message it sees is c leaving
+        await sockets["c"].close()
+        assert await sockets["b"].receive_json() == {'type': 'peer_left', 'peer': ids["c"]}
+        
+        for ws in sockets.values():
+            await ws.close()
+
+
+async def test_concurrent_signaling_joins_see_each_other():
+    """Test that two peers joining at the same time each learn about the other."""
+    from server.voice import signaling
+    
+    class SlowSocket:
+        """Signaling socket whose sends yield to the event loop, like a busy connection."""
+        closed = False
+        
+        def __init__(self):
+            self.received = []
+        
+        async def send_json(self, data):
+            await asyncio.sleep(0)
+            self.received.append(data)
+        
+        async def send_str(self, data):
+            await asyncio.sleep(0)
+            self.received.append(json.loads(data))
+    
+    a, b = SlowSocket(), SlowSocket()
+    id_a, id_b = await asyncio.gather(
+        signaling.join_signaling("race-room", "a", a),
+        signaling.join_signaling("race-room", "b", b),
+    )
+    try:
+        def known_peers(ws):
+            roster = next(m for m in ws.received if m['type'] == 'roster')
+            joined = [m['peer'] for m in ws.received if m['type'] == 'peer_joined']
+            return {p['peer'] for p in roster['peers']} | set(joined)
+        
+        assert known_peers(a) == {id_b}
+        assert known_peers(b) == {id_a}
+    finally:
+        await signaling.leave_signaling(id_a)
+        await signaling.leave_signaling(id_b)